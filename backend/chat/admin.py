@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
-    User, ChatRoom, RoomMembership, Message, MessageRead,
+    User, ChatRoom, RoomMembership, Message,
     UserBlock, UserReport, Notification, UserSettings,
     Update, Tool
 )
@@ -0,0 +1,220 @@
+# backend/chat/async_views.py
+"""
+Async versions of the hottest REST endpoints, routed in place of the sync
+ones when ``settings.ASYNC_HOT_VIEWS`` is on.
+
+Same URLs, request bodies, responses, status codes and cursor headers as
+their counterparts in ``views.py``; authentication and throttling are DRF's
+own classes, so tokens and rate limits are shared with the sync views.
+Single queries go through the async ORM. The rest runs as self-contained
+blocks (one transaction or a few reads each) on the executor's thread pool
+rather than the single thread shared by all sync code, so slow requests don't
+queue behind each other; each block gets that thread's own connection. New
+messages are fanned out on the event loop (``fanout.apublish``).
+"""
+import functools
+import json
+
+from channels.db import database_sync_to_async
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import Http404, HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+
+from . import fanout, inbox, read_state, room_activity, search, views
+from .models import ChatRoom, Message
+from .pagination import InvalidCursor, decode_timestamp_cursor, paginate_messages, parse_page_size
+from .serializers import ChatRoomSerializer, MessageSerializer
+
+_renderer = JSONRenderer()
+
+
+def _in_pool(func):
+    """``func`` on a pool thread, closing stale connections around it like Channels consumers do."""
+    return database_sync_to_async(func, thread_sensitive=False)
+
+
+def _render(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type='application/json')
+
+
+def _error_response(exc):
+    """What DRF's exception handler returns for ``exc``."""
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = _render(detail, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = _authenticators[0].authenticate_header(None)
+    if getattr(exc, 'wait', None) is not None:
+        response['Retry-After'] = str(int(exc.wait))
+    return response
+
+
+_authenticators = [cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+
+def _authenticate_and_throttle(request):
+    """``APIView.initial`` for an ``IsAuthenticated`` view: sets ``request.user``/``request.auth`` or raises."""
+    for authenticator in _authenticators:
+        result = authenticator.authenticate(request)
+        if result is not None:
+            request.user, request.auth = result
+            break
+    else:
+        raise exceptions.NotAuthenticated()
+
+    waits = []
+    for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+        throttle = throttle_class()
+        if not throttle.allow_request(request, None):
+            waits.append(throttle.wait())
+    if waits:
+        raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+def _request_data(request):
+    if request.method not in ('POST', 'PUT', 'PATCH') or not request.body:
+        return {}
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body)
+        except ValueError as exc:
+            raise exceptions.ParseError(f'JSON parse error - {exc}')
+    return request.POST
+
+
+def async_api_view(methods):
+    """``@api_view(methods)`` + ``IsAuthenticated`` for an ``async def`` view."""
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                await _in_pool(_authenticate_and_throttle)(request)
+                request.data = _request_data(request)
+                return await view(request, *args, **kwargs)
+            except Http404 as exc:
+                return _error_response(exceptions.NotFound(*exc.args))
+            except exceptions.APIException as exc:
+                return _error_response(exc)
+        return wrapper
+    return decorator
+
+
+async def _member_room_id(room_id, user):
+    return await _in_pool(views._member_room_id)(room_id, user)
+
+
+@async_api_view(['GET'])
+async def _room_list(request):
+    rooms = await _in_pool(inbox.room_list)(request.user)
+    return _render(ChatRoomSerializer(rooms, many=True).data)
+
+
+@csrf_exempt
+async def chat_rooms(request):
+    if request.method == 'POST':
+        # Creating rooms isn't hot; the sync view keeps that logic in one place
+        return await _in_pool(views.chat_rooms)(request)
+    return await _room_list(request)
+
+
+def _message_page(request, room_id, params, limit, before, after, around):
+    messages = Message.objects.filter(
+        room_id=room_id, deleted_at__isnull=True
+    ).select_related('sender', 'reply_to__sender')
+    page, before_cursor, after_cursor = paginate_messages(
+        messages, limit, before=before, after=after, around=around
+    )
+    if page and before is None and after is None and around is None:
+        read_state.mark_message_read(page[-1], request.user)
+
+    context = {'request': request}
+    if params.get('receipts') == 'compact':
+        context['receipts'] = 'compact'
+        context['receipts_limit'] = parse_page_size(params.get('receipts_limit'), default=MessageSerializer.COMPACT_RECEIPTS_LIMIT, maximum=50)
+    return MessageSerializer(page, many=True, context=context).data, before_cursor, after_cursor
+
+
+@async_api_view(['GET'])
+async def room_messages(request, room_id):
+    room_id = await _member_room_id(room_id, request.user)
+    params = request.GET
+    limit = parse_page_size(params.get('limit'))
+
+    try:
+        before = decode_timestamp_cursor(params['before']) if params.get('before') else None
+        after = decode_timestamp_cursor(params['after']) if params.get('after') else None
+    except InvalidCursor:
+        return _render({'error': 'Invalid cursor'}, status=400)
+
+    around = None
+    if params.get('around'):
+        try:
+            around = await Message.objects.only('id', 'timestamp').aget(room_id=room_id, id=params['around'])
+        except (Message.DoesNotExist, ValidationError):
+            return _render({'error': 'Message not found'}, status=404)
+
+    data, before_cursor, after_cursor = await _in_pool(_message_page)(
+        request, room_id, params, limit, before, after, around
+    )
+    response = _render(data)
+    if before_cursor:
+        response['X-Cursor-Before'] = before_cursor
+    if after_cursor:
+        response['X-Cursor-After'] = after_cursor
+    return response
+
+
+@async_api_view(['POST'])
+async def mark_room_read(request, room_id):
+    room_id = await _member_room_id(room_id, request.user)
+    try:
+        room = await ChatRoom.objects.select_related('last_message').aget(id=room_id)
+    except ChatRoom.DoesNotExist:
+        raise Http404
+    count = await _in_pool(read_state.mark_room_read)(room, request.user)
+    return _render({'message': 'Messages marked as read', 'count': count})
+
+
+def _create_message(message_data):
+    with transaction.atomic():
+        message = Message.objects.create(**message_data)
+        read_state.record_new_message(message)
+        search.index_message(message)
+        room_activity.bump(message)
+    return message, MessageSerializer(message).data
+
+
+@async_api_view(['POST'])
+async def send_message(request):
+    room_id = request.data.get('room_id')
+    content = request.data.get('content')
+    message_type = request.data.get('message_type', 'text')
+    reply_to_id = request.data.get('reply_to')
+
+    if not room_id or not content:
+        return _render({'error': 'room_id and content required'}, status=400)
+
+    room_id = await _member_room_id(room_id, request.user)
+
+    message_data = {
+        'sender': request.user,
+        'room_id': room_id,
+        'content': content,
+        'message_type': message_type
+    }
+
+    if reply_to_id:
+        try:
+            message_data['reply_to'] = await Message.objects.aget(id=reply_to_id, room_id=room_id)
+        except (Message.DoesNotExist, ValidationError):
+            raise Http404('No Message matches the given query.')
+
+    message, data = await _in_pool(_create_message)(message_data)
+    await fanout.apublish(message, data)
+    return _render(data, status=201)
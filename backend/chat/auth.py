@@ -0,0 +1,247 @@
+# backend/chat/auth.py
+"""
+JWT authentication shared by DRF, the Channels consumer and Socket.IO.
+
+A verified access token maps to a compact principal (id, username,
+is_active, tokens_valid_after) kept in a per-process cache for
+``LOCAL_TTL`` seconds and in Redis (``auth:principal:<user_id>``), so
+authenticating normally touches neither the database nor the JWT signature.
+The principal is handed out as a ``User`` with only those fields loaded:
+anything that just needs ``user.id`` runs without a ``User`` query, and the
+first access to another field loads the rest in one query.
+
+Tokens stop working when the user logs out (``revoke_token``: the token id
+is blacklisted until it expires), changes password (``tokens_valid_after``)
+or is deleted or deactivated (``invalidate_user``). ``invalidate_user`` also
+bumps ``auth:gen:<user_id>``; filling the cache watches it, so a principal
+loaded before an invalidation is never cached after it.
+"""
+import logging
+import threading
+import time
+from urllib.parse import parse_qs
+
+import redis
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from rest_framework import authentication, exceptions
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import User
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'AUTH_CACHE', {})
+
+LOCAL_TTL = _config.get('LOCAL_TTL', 5)
+LOCAL_SIZE = _config.get('LOCAL_SIZE', 10000)
+PRINCIPAL_TTL = _config.get('PRINCIPAL_TTL', 15 * 60)
+
+PRINCIPAL_FIELDS = ['id', 'username', 'is_active', 'tokens_valid_after']
+
+
+def _principal_key(user_id):
+    return f'auth:principal:{user_id}'
+
+
+def _revoked_key(jti):
+    return f'auth:revoked:{jti}'
+
+
+def _generation_key(user_id):
+    return f'auth:gen:{user_id}'
+
+
+class _TokenCache:
+    """raw token -> (claims, principal), for at most ``LOCAL_TTL`` seconds."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, raw):
+        with self.lock:
+            entry = self.entries.get(raw)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1], entry[2]
+
+    def set(self, raw, claims, principal):
+        expires = min(time.monotonic() + LOCAL_TTL, time.monotonic() + claims['exp'] - time.time())
+        with self.lock:
+            if len(self.entries) >= self.size:
+                now = time.monotonic()
+                self.entries = {key: entry for key, entry in self.entries.items() if entry[0] >= now}
+                if len(self.entries) >= self.size:
+                    self.entries.clear()
+            self.entries[raw] = (expires, claims, principal)
+
+    def discard(self, jti=None, user_id=None):
+        with self.lock:
+            self.entries = {
+                key: entry for key, entry in self.entries.items()
+                if entry[1]['jti'] != jti and entry[2]['id'] != user_id
+            }
+
+
+_tokens = _TokenCache(LOCAL_SIZE)
+
+
+def _load_principal(user_id):
+    row = User.objects.filter(id=user_id).values(*PRINCIPAL_FIELDS).first()
+    if row is None:
+        return None
+    valid_after = row['tokens_valid_after']
+    row['tokens_valid_after'] = valid_after.timestamp() if valid_after else 0
+    return row
+
+
+def _principal_and_revocation(user_id, jti):
+    """The principal (cached or loaded) and whether ``jti`` was revoked, in one Redis round trip."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hgetall(_principal_key(user_id))
+        pipe.exists(_revoked_key(jti))
+        cached, revoked = pipe.execute()
+    except redis.RedisError:
+        logger.exception('Auth cache read failed for user %s', user_id)
+        return _load_principal(user_id), False
+
+    if cached:
+        principal = {
+            'id': int(cached['id']),
+            'username': cached['username'],
+            'is_active': cached['is_active'] == '1',
+            'tokens_valid_after': float(cached['tokens_valid_after']),
+        }
+        return principal, bool(revoked)
+
+    try:
+        with get_redis().pipeline() as pipe:
+            pipe.watch(_generation_key(user_id))
+            principal = _load_principal(user_id)
+            if principal is not None:
+                pipe.multi()
+                pipe.hset(_principal_key(user_id), mapping=dict(principal, is_active=int(principal['is_active'])))
+                pipe.expire(_principal_key(user_id), PRINCIPAL_TTL)
+                pipe.execute()
+    except redis.WatchError:
+        # Invalidated while loading, after its transaction committed: read again
+        principal = _load_principal(user_id)
+    except redis.RedisError:
+        logger.exception('Auth cache write failed for user %s', user_id)
+        principal = _load_principal(user_id)
+    return principal, bool(revoked)
+
+
+def principal_user(principal):
+    """A ``User`` carrying only the principal's fields; the rest load together on first use."""
+    user = User.from_db(
+        'default',
+        ['id', 'username', 'is_active'],
+        [principal['id'], principal['username'], principal['is_active']],
+    )
+    user._load_deferred_together = True
+    return user
+
+
+def authenticate_token(raw_token):
+    """``(user, claims)`` for a valid, unrevoked access token, else ``None``."""
+    if isinstance(raw_token, bytes):
+        raw_token = raw_token.decode('latin-1')
+    cached = _tokens.get(raw_token)
+    if cached is not None:
+        claims, principal = cached
+        return principal_user(principal), claims
+
+    try:
+        token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    claims = {
+        'user_id': token[api_settings.USER_ID_CLAIM],
+        'jti': token[api_settings.JTI_CLAIM],
+        'iat': token.get('iat', 0),
+        'exp': token['exp'],
+    }
+    principal, revoked = _principal_and_revocation(claims['user_id'], claims['jti'])
+    if revoked or principal is None or not principal['is_active']:
+        return None
+    if claims['iat'] < int(principal['tokens_valid_after']):
+        return None
+
+    _tokens.set(raw_token, claims, principal)
+    return principal_user(principal), claims
+
+
+def revoke_token(claims):
+    """Blacklist one access token (logout) until it would have expired anyway."""
+    _tokens.discard(jti=claims['jti'])
+    ttl = int(claims['exp'] - time.time())
+    if ttl > 0:
+        try:
+            get_redis().set(_revoked_key(claims['jti']), 1, ex=ttl)
+        except redis.RedisError:
+            logger.exception('Could not revoke token %s', claims['jti'])
+
+
+def invalidate_user(user_id):
+    """Drop the cached principal (password change, deletion, deactivation)."""
+    _tokens.discard(user_id=user_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(_generation_key(user_id))
+        pipe.expire(_generation_key(user_id), PRINCIPAL_TTL)
+        pipe.delete(_principal_key(user_id))
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Auth cache invalidation failed for user %s', user_id)
+
+
+class CachedJWTAuthentication(authentication.BaseAuthentication):
+    """DRF counterpart of ``authenticate_token``: ``request.auth`` holds the token claims."""
+
+    def authenticate(self, request):
+        parts = authentication.get_authorization_header(request).split()
+        if not parts or parts[0].decode('latin-1') not in api_settings.AUTH_HEADER_TYPES:
+            return None
+        if len(parts) != 2:
+            raise exceptions.AuthenticationFailed('Authorization header must contain two space-delimited values')
+        result = authenticate_token(parts[1])
+        if result is None:
+            raise exceptions.AuthenticationFailed('Given token not valid for any token type')
+        return result
+
+    def authenticate_header(self, request):
+        return f'{api_settings.AUTH_HEADER_TYPES[0]} realm="api"'
+
+
+def token_from_scope(scope):
+    """``?token=`` or an ``Authorization: Bearer`` header of an ASGI connection."""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    if query.get('token'):
+        return query['token'][0]
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.split()
+            if len(parts) == 2 and parts[0].decode('latin-1') in api_settings.AUTH_HEADER_TYPES:
+                return parts[1]
+    return None
+
+
+class JWTAuthMiddleware:
+    """Channels middleware setting ``scope['user']`` from the connection's token."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        token = token_from_scope(scope)
+        result = await database_sync_to_async(authenticate_token)(token) if token else None
+        scope = dict(scope, user=result[0] if result else AnonymousUser())
+        return await self.inner(scope, receive, send)
@@ -0,0 +1,223 @@
+# backend/chat/backup_chain.py
+"""
+Incremental cloud backups.
+
+A chain starts with a full snapshot; each later backup of the user is an
+increment on the newest one, holding the messages sent, edited or deleted
+(as tombstones) since its base's ``high_water_mark`` (less ``OVERLAP``
+seconds, for messages that were committed while the base was being
+written) plus the profile, settings, contacts and rooms, which are small
+and always complete. Every ``FULL_EVERY``-th backup starts a new chain.
+
+Restoring a backup replays its chain oldest first, skipping the rooms its
+newest backup no longer lists (the user left them). Chains whose newest
+backup is older than ``COMPACT_AFTER_DAYS`` are folded into one full
+snapshot by ``manage.py compact_backups``.
+"""
+import datetime
+import heapq
+import itertools
+import json
+import uuid
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import backup_storage, export, restore
+from .models import UserBackup
+
+_config = getattr(settings, 'BACKUP_CHAIN', {})
+
+FULL_EVERY = _config.get('FULL_EVERY', 7)
+OVERLAP = _config.get('OVERLAP', 60)
+COMPACT_AFTER_DAYS = _config.get('COMPACT_AFTER_DAYS', 30)
+
+EPOCH = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+
+
+def _save(backup, chunks, progress=None):
+    backup_storage.write(backup, chunks, progress)
+    try:
+        backup.save()
+    except Exception:
+        backup_storage.delete(backup)
+        raise
+    return backup
+
+
+def plan(user, full=False):
+    """``(base, since)`` of the next backup of ``user``: ``(None, None)`` for a full snapshot."""
+    base = None if full else UserBackup.objects.filter(user=user).only(
+        'id', 'sequence', 'high_water_mark', 'created_at'
+    ).order_by('-created_at').first()
+    if base is None or base.sequence + 1 >= FULL_EVERY:
+        return None, None
+    return base, (base.high_water_mark or base.created_at) - datetime.timedelta(seconds=OVERLAP)
+
+
+def create(user, full=False, context=None, progress=None):
+    """
+    Back ``user`` up: an increment on their newest backup, or a full snapshot
+    when a chain is due. ``progress`` is passed on to the export and writer.
+    """
+    high_water_mark = timezone.now()
+    base, since = plan(user, full)
+    if base is None:
+        backup = UserBackup(user=user, kind='full', high_water_mark=high_water_mark)
+    else:
+        backup = UserBackup(
+            user=user, kind='incremental', base=base, sequence=base.sequence + 1, high_water_mark=high_water_mark
+        )
+    return _save(backup, export.stream(user, context=context, since=since, progress=progress), progress)
+
+
+def chain(backup):
+    """The backups ``backup`` is restored from, its full snapshot first."""
+    backups = [backup]
+    while backups[-1].base_id is not None:
+        backups.append(UserBackup.objects.get(id=backups[-1].base_id))
+    return backups[::-1]
+
+
+def room_ids(backup):
+    """Ids of the rooms in ``backup``'s payload: the rooms its user was in when it was taken."""
+    return {
+        uuid.UUID(str(data['id'])) for kind, data in restore.records(backup_storage.read(backup))
+        if kind == 'room' and isinstance(data, dict) and data.get('id')
+    }
+
+
+def _timestamp(message):
+    try:
+        return parse_datetime(message.get('timestamp') or '') or EPOCH
+    except ValueError:
+        return EPOCH
+
+
+def _entries(link, position):
+    """
+    ``(key, kind, data)`` of the rooms and messages of ``link``'s payload,
+    sorted by ``key`` as the export writes them: rooms by id, each followed
+    by its messages by ``(timestamp, id)``. ``position`` (the link's place
+    in its chain) comes last, so versions of an entry sort oldest first.
+    """
+    room_id = None
+    for kind, data in restore.records(backup_storage.read(link)):
+        if kind == 'room':
+            room_id = str(data.get('id') or '') if isinstance(data, dict) else ''
+            if room_id:
+                yield (room_id, 0, position), kind, data
+        elif kind == 'message' and room_id and isinstance(data, dict):
+            yield (room_id, 1, _timestamp(data), str(data.get('id')), position), kind, data
+
+
+def _newest(messages):
+    """The newest version of each of ``messages``, where versions are adjacent and oldest first."""
+    previous = None
+    for message in messages:
+        if previous is not None and previous.get('id') != message.get('id'):
+            yield previous
+        previous = message
+    if previous is not None:
+        yield previous
+
+
+def merge(links):
+    """
+    A full payload equivalent to the chain ``links`` (oldest first), as text
+    chunks: the profile, settings, contacts and rooms of the newest backup
+    (rooms left since older ones are dropped) and the newest version of
+    every message of those rooms, deleted ones kept as tombstones. The
+    payloads are read side by side a chunk at a time, so only an entry or
+    so of each is held in memory.
+    """
+    tip, last = links[-1], len(links) - 1
+    payload = {'timestamp': (tip.high_water_mark or tip.created_at).isoformat(), 'user_id': tip.user_id}
+    for kind, data in restore.records(backup_storage.read(tip)):
+        # The export writes these before the rooms
+        if kind == 'room':
+            break
+        if kind == 'contact':
+            payload.setdefault('contacts', []).append(data)
+        else:
+            payload[kind] = data
+    yield json.dumps(payload, cls=DjangoJSONEncoder)[:-1] + ', "chat_rooms": ['
+
+    entries = heapq.merge(*(_entries(link, position) for position, link in enumerate(links)), key=lambda entry: entry[0])
+    first_room = True
+    for _, room_entries in itertools.groupby(entries, key=lambda entry: entry[0][0]):
+        room = None
+        for kind, items in itertools.groupby(room_entries, key=lambda entry: entry[1]):
+            if kind == 'room':
+                for key, _, data in items:
+                    room = data if key[-1] == last else None
+                if room is not None:
+                    yield ('' if first_room else ', ') + '{"room": ' + json.dumps(room, cls=DjangoJSONEncoder) + ', "messages": ['
+                    first_room = False
+            elif room is not None:
+                for i, message in enumerate(_newest(data for _, _, data in items)):
+                    yield (', ' if i else '') + json.dumps(message, cls=DjangoJSONEncoder)
+            else:
+                # A room the user has left: skip its messages
+                for _ in items:
+                    pass
+        if room is not None:
+            yield ']}'
+    yield ']}'
+
+
+def _descendants(backup):
+    """``backup``'s increments in chain order, or ``None`` if the chain branches."""
+    backups = []
+    current = backup
+    while True:
+        increments = list(UserBackup.objects.filter(base=current))
+        if not increments:
+            return backups
+        if len(increments) > 1:
+            return None
+        current = increments[0]
+        backups.append(current)
+
+
+def compact(full, older_than=None):
+    """
+    Replace the chain starting at ``full`` with one full snapshot equivalent
+    to its newest backup, if that is older than ``older_than``
+    (``COMPACT_AFTER_DAYS`` ago). Returns the snapshot, or ``None`` if
+    there is nothing to compact: a lone snapshot, a chain still in use or a
+    chain that branches.
+    """
+    if older_than is None:
+        older_than = timezone.now() - datetime.timedelta(days=COMPACT_AFTER_DAYS)
+    increments = _descendants(full)
+    if not increments or increments[-1].created_at >= older_than:
+        return None
+    tip = increments[-1]
+
+    backup = UserBackup(user_id=full.user_id, kind='full', high_water_mark=tip.high_water_mark)
+    backup_storage.write(backup, merge(chain(tip)))
+    try:
+        with transaction.atomic():
+            backup.save()
+            UserBackup.objects.filter(id=backup.id).update(created_at=tip.created_at)
+            # Newest first: RESTRICT refuses to delete a base before its increments
+            for link in reversed([full, *increments]):
+                link.delete()
+    except Exception:
+        backup_storage.delete(backup)
+        raise
+    backup.created_at = tip.created_at
+    return backup
+
+
+def compactable(older_than=None):
+    """Full snapshots with increments, taken before ``older_than`` (``COMPACT_AFTER_DAYS`` ago)."""
+    if older_than is None:
+        older_than = timezone.now() - datetime.timedelta(days=COMPACT_AFTER_DAYS)
+    return UserBackup.objects.filter(
+        kind='full', created_at__lt=older_than, increments__isnull=False
+    ).distinct().order_by('created_at')
@@ -0,0 +1,190 @@
+# backend/chat/backup_jobs.py
+"""
+Backups and restores as background jobs.
+
+The endpoints only record a ``BackupJob`` and hand its id to a runner once
+the transaction commits: the ``run_backup_job`` Celery task, or ``inline``
+(synchronously in the request, before it responds; for tests and
+single-process setups). ``run`` does the work, writing progress to the row
+at most every ``PROGRESS_INTERVAL`` seconds for clients polling
+``/backup-jobs/<id>/``, and tells the user's sockets when the job has
+finished (a ``backup_job`` event in the ``user_<id>`` Channels group and
+Socket.IO room).
+
+Saving progress also renews the job's lease (``heartbeat_at``). A job left
+``running`` for ``LEASE_TIMEOUT`` seconds without one, its worker gone,
+is started over by the next ``run`` (Celery delivers the task again, as
+tasks are acknowledged late); the worker it was taken from, if it comes
+back, finishes without saving.
+"""
+import datetime
+import json
+import logging
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import backup_chain, backup_storage, emitter, export, restore
+from .models import BackupJob, Message, UserBackup
+from .serializers import BackupJobSerializer
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'BACKUP_JOBS', {})
+
+RUNNER = _config.get('RUNNER', 'celery')
+PROGRESS_INTERVAL = _config.get('PROGRESS_INTERVAL', 1.0)
+LEASE_TIMEOUT = _config.get('LEASE_TIMEOUT', 600)
+
+
+def user_group(user_id):
+    """Channels group and Socket.IO room of every socket of the user."""
+    return f'user_{user_id}'
+
+
+def start(user, kind, **fields):
+    """Record a job and run it once the transaction commits."""
+    job = BackupJob.objects.create(user=user, kind=kind, **fields)
+    transaction.on_commit(lambda: dispatch(job.id))
+    return job
+
+
+def dispatch(job_id):
+    if RUNNER == 'inline':
+        run(job_id)
+        return
+    from .tasks import run_backup_job
+    run_backup_job.delay(str(job_id))
+
+
+class Progress:
+    """Counts messages and bytes; ``percent`` follows whichever of them ``total`` is in."""
+
+    def __init__(self, job, total, unit):
+        self.job = job
+        self.total = total
+        self.unit = unit
+        self.saved_at = time.monotonic()
+
+    def __call__(self, messages=0, size=0):
+        self.job.messages_processed += messages
+        self.job.bytes_processed += int(size)
+        if time.monotonic() - self.saved_at >= PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self):
+        done = self.job.messages_processed if self.unit == 'messages' else self.job.bytes_processed
+        # 100 is for finished jobs only
+        self.job.percent = min(99, done * 100 // self.total) if self.total else 0
+        BackupJob.objects.filter(id=self.job.id, started_at=self.job.started_at).update(
+            percent=self.job.percent,
+            messages_processed=self.job.messages_processed,
+            bytes_processed=self.job.bytes_processed,
+            heartbeat_at=timezone.now(),
+        )
+        self.saved_at = time.monotonic()
+
+
+def _backup(job):
+    base, since = backup_chain.plan(job.user, job.params.get('full', False))
+    mine = Q(room__roommembership__user=job.user)
+    if since is not None:
+        # As the export: rooms joined since are backed up whole (one Q, so one join)
+        mine &= export.changed_since(since) | Q(room__roommembership__joined_at__gt=since)
+    progress = Progress(job, Message.objects.filter(mine).count(), 'messages')
+    job.backup = backup_chain.create(job.user, full=job.params.get('full', False), progress=progress)
+
+
+def _restore(job, payloads, total_bytes, rooms=None):
+    """Restore ``(chunks, output)`` payloads in order, parsed as their bytes are read."""
+    progress = Progress(job, total_bytes, 'bytes')
+    engine = restore.Restore(job.user, dry_run=job.params.get('dry_run', False), progress=progress, rooms=rooms)
+    # The same dict: a failed job keeps the counts of what it got through
+    job.summary = engine.summary
+    for chunks, output in payloads:
+        engine.apply(restore.records(chunks, output, progress))
+    engine.finish()
+
+
+def _restore_backup(job):
+    links = backup_chain.chain(job.backup)
+    rooms = backup_chain.room_ids(links[-1]) if len(links) > 1 else None
+    _restore(job, ((backup_storage.read(link), 'json') for link in links), sum(link.size_bytes for link in links), rooms)
+
+
+def _restore_upload(job):
+    size = sum(entry['size'] for entry in job.upload.get('chunks', []))
+    _restore(job, [(backup_storage.read_chunks(job.upload), job.params.get('output', 'json'))], size)
+
+
+HANDLERS = {
+    'backup': _backup,
+    'restore_backup': _restore_backup,
+    'restore_upload': _restore_upload,
+}
+
+
+def claim(job_id):
+    """
+    Take a pending job, or a running one whose lease has expired, starting
+    it over. ``started_at`` tells this run from the one it replaced.
+    """
+    now = timezone.now()
+    expired = Q(status='running', heartbeat_at__lt=now - datetime.timedelta(seconds=LEASE_TIMEOUT))
+    return BackupJob.objects.filter(Q(status='pending') | expired, id=job_id).update(
+        status='running', started_at=now, heartbeat_at=now, percent=0, messages_processed=0, bytes_processed=0
+    )
+
+
+def run(job_id):
+    """Run a job unless another worker holds it (see ``claim``)."""
+    if not claim(job_id):
+        return
+    job = BackupJob.objects.select_related('user', 'backup').get(id=job_id)
+    try:
+        HANDLERS[job.kind](job)
+    except (backup_storage.CorruptBackup, OSError, UserBackup.DoesNotExist):
+        logger.exception('Backup job %s failed', job.id)
+        job.status, job.error = 'failed', 'Backup data is missing or damaged'
+    except Exception as e:
+        logger.exception('Backup job %s failed', job.id)
+        job.status, job.error = 'failed', str(e) or e.__class__.__name__
+    else:
+        job.status, job.percent = 'succeeded', 100
+    finally:
+        finished = _finish(job)
+    if finished:
+        notify(job)
+    return job
+
+
+def _finish(job):
+    """Save the finished ``job``; ``False`` if it was taken over while this run was stalled."""
+    with transaction.atomic():
+        # The run that took it over owns the row and the upload
+        if not BackupJob.objects.select_for_update().filter(id=job.id, started_at=job.started_at).exists():
+            return False
+        if job.upload:
+            backup_storage.delete_chunks(job.upload)
+            job.upload = {}
+        job.finished_at = timezone.now()
+        job.save()
+    return True
+
+
+def notify(job):
+    data = BackupJobSerializer(job).data
+    group = user_group(job.user_id)
+    try:
+        async_to_sync(get_channel_layer().group_send)(group, {
+            'type': 'backup_job',
+            'text': json.dumps({'type': 'backup_job', **data}),
+        })
+    except Exception:
+        logger.exception('Backup job notification to Channels failed for user %s', job.user_id)
+    emitter.emit('backup_job', data, room=group)
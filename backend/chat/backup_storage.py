@@ -0,0 +1,111 @@
+# backend/chat/backup_storage.py
+"""
+Cloud backup payloads, kept out of the database.
+
+A backup is written through the ``backups`` storage (``STORAGES`` setting:
+the local filesystem by default, S3 through django-storages) as a series of
+gzip files of ``CHUNK_SIZE`` uncompressed bytes each.
+``UserBackup.manifest`` lists them in order with their sizes and SHA-256
+digests, so listing backups never reads payloads and a restore can read
+them back one chunk at a time.
+
+Uploads waiting for a restore job are kept the same way (``BackupJob.upload``).
+"""
+import gzip
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import storages
+
+_config = getattr(settings, 'BACKUP_STORAGE', {})
+
+STORAGE = _config.get('STORAGE', 'backups')
+CHUNK_SIZE = _config.get('CHUNK_SIZE', 4 * 1024 * 1024)
+COMPRESSION_LEVEL = _config.get('COMPRESSION_LEVEL', 6)
+
+
+class CorruptBackup(Exception):
+    pass
+
+
+def get_storage():
+    return storages[STORAGE]
+
+
+def _save(storage, name, raw):
+    data = gzip.compress(raw, compresslevel=COMPRESSION_LEVEL)
+    return {
+        'name': storage.save(name, ContentFile(data)),
+        'size': len(raw),
+        'stored_size': len(data),
+        'sha256': hashlib.sha256(data).hexdigest(),
+    }
+
+
+def write_chunks(prefix, chunks, progress=None):
+    """
+    Store ``chunks`` (text or bytes, in order) under ``prefix`` and return
+    their manifest. Chunks already written are removed if this fails.
+    ``progress`` is called with ``size=<bytes>`` as they are consumed.
+    """
+    storage = get_storage()
+    entries = []
+    buffer = bytearray()
+    try:
+        for chunk in chunks:
+            data = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+            buffer += data
+            if progress is not None:
+                progress(size=len(data))
+            while len(buffer) >= CHUNK_SIZE:
+                entries.append(_save(storage, f'{prefix}/{len(entries):05d}.json.gz', bytes(buffer[:CHUNK_SIZE])))
+                del buffer[:CHUNK_SIZE]
+        if buffer or not entries:
+            entries.append(_save(storage, f'{prefix}/{len(entries):05d}.json.gz', bytes(buffer)))
+    except BaseException:
+        delete_chunks({'chunks': entries})
+        raise
+    return {'encoding': 'gzip', 'chunks': entries}
+
+
+def read_chunks(manifest):
+    """The payload of ``manifest`` as decompressed byte chunks, verified against it."""
+    storage = get_storage()
+    for entry in manifest.get('chunks', []):
+        with storage.open(entry['name'], 'rb') as f:
+            data = f.read()
+        if hashlib.sha256(data).hexdigest() != entry['sha256']:
+            raise CorruptBackup(f'Chunk {entry["name"]} does not match the manifest')
+        yield gzip.decompress(data)
+
+
+def delete_chunks(manifest):
+    storage = get_storage()
+    for entry in manifest.get('chunks', []):
+        storage.delete(entry['name'])
+
+
+def write(backup, chunks, progress=None):
+    """
+    Store the text ``chunks`` (the export, in order) as ``backup``'s payload
+    and fill in its ``manifest``, ``size_bytes`` and ``stored_bytes`` (unsaved).
+    """
+    backup.manifest = write_chunks(f'{backup.user_id}/{backup.id}', chunks, progress)
+    backup.size_bytes = sum(entry['size'] for entry in backup.manifest['chunks'])
+    backup.stored_bytes = sum(entry['stored_size'] for entry in backup.manifest['chunks'])
+    return backup
+
+
+def read(backup):
+    return read_chunks(backup.manifest)
+
+
+def load(backup):
+    """The decoded payload of ``backup``."""
+    return json.loads(b''.join(read(backup)))
+
+
+def delete(backup):
+    delete_chunks(backup.manifest)
@@ -1,13 +1,23 @@
 # backend/chat/consumers.py
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
-from .models import Message, User, ChatRoom, RoomMembership, MessageRead
+from django.db import transaction
+from .models import Message
+from . import fanout, member_cache, presence, read_state, room_activity, search
+from .frame_batching import FrameBatcher, wants_batching
+from .typing_state import TypingDebouncer, TypingRoom
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
+        self.typing = TypingDebouncer()
+        self.typing_room = TypingRoom()
+        self.typing_changed = asyncio.Event()
+        self.typing_task = None
+        self.heartbeat_task = None
+        self.batcher = FrameBatcher(self.send) if wants_batching(self.scope) else None
         if self.user.is_anonymous:
             await self.close()
             return
@@ -25,41 +35,30 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        # Events meant for the user rather than the room (e.g. finished backup jobs)
+        await self.channel_layer.group_add(f"user_{self.user.id}", self.channel_name)
         await self.accept()
         
-        # Update online status
-        await self.set_online_status(True)
-        
-        # Notify others user joined
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'status': 'online'
-            }
-        )
+        # Counted across all of the user's sockets; rooms only hear about 0 <-> 1 changes
+        await self.update_presence(True)
+        self.heartbeat_task = asyncio.create_task(self.send_heartbeats())
 
     async def disconnect(self, close_code):
+        if self.typing_task is not None:
+            self.typing_task.cancel()
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+        if self.batcher is not None:
+            self.batcher.close()
+        await self.publish_typing(False)
+        
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        await self.channel_layer.group_discard(f"user_{self.user.id}", self.channel_name)
         
-        # Update online status
-        await self.set_online_status(False)
-        
-        # Notify others user left
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_status',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'status': 'offline'
-            }
-        )
+        await self.update_presence(False)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
@@ -80,27 +79,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if not content:
             return
         
-        # Save message
-        message = await self.save_message(content, msg_type, reply_to_id)
-        
-        # Send to group
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message_id': str(message.id),
-                'content': content,
-                'message_type': msg_type,
-                'sender_id': self.user.id,
-                'sender_username': self.user.username,
-                'timestamp': message.timestamp.isoformat(),
-                'reply_to': reply_to_id
-            }
-        )
+        # Saved messages reach every transport through the fan-out service
+        await self.save_message(content, msg_type, reply_to_id)
+        await self.publish_typing(False)
 
     async def handle_typing(self, data):
-        is_typing = data.get('is_typing', False)
-        
+        await self.publish_typing(bool(data.get('is_typing', False)))
+
+    async def publish_typing(self, is_typing):
+        # Debounced: only state changes and periodic refreshes reach the group
+        if not self.typing.should_publish(is_typing):
+            return
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -117,70 +106,89 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.mark_message_read(message_id)
 
     async def chat_message(self, event):
-        # Don't send message back to sender
+        # Don't send message back to sender; the frame is encoded once by the fan-out
         if event['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'message',
-                'message_id': event['message_id'],
-                'content': event['content'],
-                'message_type': event['message_type'],
-                'sender_id': event['sender_id'],
-                'sender_username': event['sender_username'],
-                'timestamp': event['timestamp'],
-                'reply_to': event.get('reply_to')
-            }))
+            await self.send_event(event['text'])
+
+    async def reaction_update(self, event):
+        await self.send_event(event['text'])
+
+    async def backup_job(self, event):
+        await self.send_event(event['text'])
 
     async def typing_indicator(self, event):
         # Don't send typing indicator back to sender
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'typing',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_typing': event['is_typing']
-            }))
+            self.typing_room.update(event['user_id'], event['username'], event['is_typing'])
+            self.typing_changed.set()
+            if self.typing_task is None or self.typing_task.done():
+                self.typing_task = asyncio.create_task(self.send_typing_frames())
+
+    async def send_typing_frames(self):
+        # Aggregated "N typing" frames, throttled, until nobody is typing anymore
+        while True:
+            self.typing_changed.clear()
+            delay = self.typing_room.next_deadline()
+            if delay is None:
+                return
+            try:
+                # Woken early when someone starts or stops typing
+                await asyncio.wait_for(self.typing_changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            frame = self.typing_room.poll()
+            if frame is not None:
+                await self.send_event(json.dumps(frame))
 
     async def user_status(self, event):
         # Don't send status back to sender
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
+            await self.send_event(json.dumps({
                 'type': 'user_status',
                 'user_id': event['user_id'],
                 'username': event['username'],
                 'status': event['status']
             }))
 
+    async def send_event(self, text):
+        # Clients that connected with ?batch=1 get events coalesced into array frames
+        if self.batcher is not None:
+            await self.batcher.add(text)
+        else:
+            await self.send(text_data=text)
+
     @database_sync_to_async
     def check_room_membership(self):
-        try:
-            RoomMembership.objects.get(user=self.user, room_id=self.room_id)
-            return True
-        except RoomMembership.DoesNotExist:
-            return False
+        return member_cache.is_member(self.room_id, self.user.id)
 
     @database_sync_to_async
     def save_message(self, content, msg_type, reply_to_id):
-        room = ChatRoom.objects.get(id=self.room_id)
+        # Cached check, so members removed while connected can't keep posting
+        if not member_cache.is_member(self.room_id, self.user.id):
+            return None
         
         message_data = {
             'sender': self.user,
-            'room': room,
+            'room_id': self.room_id,
             'content': content,
             'message_type': msg_type
         }
         
         if reply_to_id:
             try:
-                reply_message = Message.objects.get(id=reply_to_id, room=room)
+                reply_message = Message.objects.get(id=reply_to_id, room_id=self.room_id)
                 message_data['reply_to'] = reply_message
             except Message.DoesNotExist:
                 pass
         
-        message = Message.objects.create(**message_data)
-        
-        # Update room timestamp
-        room.updated_at = timezone.now()
-        room.save()
+        with transaction.atomic():
+            message = Message.objects.create(**message_data)
+            read_state.record_new_message(message)
+            search.index_message(message)
+            
+            # Room timestamp and preview, written behind
+            room_activity.bump(message)
+            fanout.publish(message)
         
         return message
 
@@ -188,14 +196,25 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def mark_message_read(self, message_id):
         try:
             message = Message.objects.get(id=message_id, room_id=self.room_id)
-            MessageRead.objects.get_or_create(message=message, user=self.user)
+            read_state.mark_message_read(message, self.user)
         except Message.DoesNotExist:
             pass
 
+    async def send_heartbeats(self):
+        # Keeps this socket counted; one left behind by a dead worker expires
+        while True:
+            await asyncio.sleep(presence.HEARTBEAT_INTERVAL)
+            await self.refresh_presence()
+
+    @database_sync_to_async
+    def refresh_presence(self):
+        if presence.heartbeat(self.user.id, self.channel_name):
+            presence.announce(self.user.id, self.user.username, 'online')
+
     @database_sync_to_async
-    def set_online_status(self, status):
-        user = User.objects.get(id=self.user.id)
-        user.online_status = status
-        if not status:
-            user.last_seen = timezone.now()
-        user.save()
\ No newline at end of file
+    def update_presence(self, connected):
+        if connected:
+            if presence.connect(self.user.id, self.channel_name):
+                presence.announce(self.user.id, self.user.username, 'online')
+        elif presence.disconnect(self.user.id, self.channel_name):
+            presence.announce(self.user.id, self.user.username, 'offline')
@@ -0,0 +1,66 @@
+# backend/chat/direct_rooms.py
+"""
+Direct rooms: one per pair of users, found through ``DirectRoom`` rows
+keyed by ``(user_low, user_high)`` (the two ids in ascending order). The
+unique index makes opening a DM a single indexed lookup however many rooms
+either user is in, and makes concurrent creates of the same pair converge
+on one room.
+
+Duplicates created before the mapping existed are merged by
+``manage.py dedupe_direct_rooms``.
+"""
+from django.db import IntegrityError, transaction
+
+from . import member_cache
+from .models import ChatRoom, DirectRoom, RoomMembership
+
+
+def pair(user_id, other_user_id):
+    return (user_id, other_user_id) if user_id < other_user_id else (other_user_id, user_id)
+
+
+def find(user_id, other_user_id):
+    """The direct room of the two users, or ``None``."""
+    low, high = pair(user_id, other_user_id)
+    mapping = DirectRoom.objects.select_related('room').filter(user_low_id=low, user_high_id=high).first()
+    return mapping.room if mapping else None
+
+
+def _rejoin(room, user_ids):
+    """Put back whichever of the pair has left the room."""
+    missing = [user_id for user_id in user_ids if not member_cache.is_member(room.id, user_id)]
+    for user_id in missing:
+        RoomMembership.objects.get_or_create(room=room, user_id=user_id)
+
+
+def get_or_create(user, other_user_id):
+    """``(room, created)``: the direct room of ``user`` and ``other_user_id``, created if they have none."""
+    room = find(user.id, other_user_id)
+    if room is not None:
+        _rejoin(room, [user.id, other_user_id])
+        return room, False
+
+    low, high = pair(user.id, other_user_id)
+    try:
+        with transaction.atomic():
+            room = ChatRoom.objects.create(room_type='direct', created_by=user)
+            DirectRoom.objects.create(user_low_id=low, user_high_id=high, room=room)
+            RoomMembership.objects.create(user=user, room=room, role='admin')
+            RoomMembership.objects.create(user_id=other_user_id, room=room, role='member')
+    except IntegrityError:
+        # Created concurrently by the other request
+        room = find(user.id, other_user_id)
+        if room is None:
+            raise
+        return room, False
+    return room, True
+
+
+def map_room(room):
+    """Record ``room`` (a two-member direct room) as its pair's room unless the pair has one; ``True`` if recorded."""
+    user_ids = list(RoomMembership.objects.filter(room=room).values_list('user_id', flat=True))
+    if len(user_ids) != 2:
+        return False
+    low, high = pair(*user_ids)
+    _, created = DirectRoom.objects.get_or_create(user_low_id=low, user_high_id=high, defaults={'room': room})
+    return created
@@ -0,0 +1,148 @@
+# backend/chat/emitter.py
+"""
+Process-wide Socket.IO emitter for events raised outside the Socket.IO server
+(REST views, management commands).
+
+Publishes straight onto the pub/sub channel the ``AsyncRedisManager`` in
+``sockets.py`` listens on, in the same pickled format as
+``socketio.RedisManager``, over one pooled Redis connection per process.
+With ``SOCKETIO_EMIT_BLOCKING = False`` emits are queued and a background
+thread publishes them in pipelined batches, so requests never wait on Redis.
+``AsyncEmitter`` is the same for async views, on ``redis.asyncio``.
+"""
+import asyncio
+import logging
+import pickle
+import queue
+import threading
+import uuid
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'socketio'
+
+
+def _packet(event, data, room, namespace, skip_sid, host_id):
+    return pickle.dumps({
+        'method': 'emit', 'event': event, 'data': data,
+        'namespace': namespace or '/', 'room': room,
+        'skip_sid': skip_sid, 'callback': None, 'host_id': host_id,
+    })
+
+
+class Emitter:
+    def __init__(self, url, channel=CHANNEL, blocking=True, batch_size=100, max_queue=10000):
+        # from_url keeps a connection pool; connections are reused across emits
+        self.redis = redis.Redis.from_url(url, socket_connect_timeout=2, socket_timeout=2)
+        self.channel = channel
+        self.blocking = blocking
+        self.batch_size = batch_size
+        self.host_id = uuid.uuid4().hex
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def emit(self, event, data, room=None, namespace=None, skip_sid=None):
+        """
+        ``data`` must already be JSON-ready (e.g. ``serializer.data``); it is
+        encoded exactly once, here.
+        """
+        packet = _packet(event, data, room, namespace, skip_sid, self.host_id)
+        if self.blocking:
+            self._publish([packet])
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(packet)
+        except queue.Full:
+            logger.warning('Socket.IO emit queue full, dropping %r event', event)
+
+    def flush(self):
+        """Block until every queued emit has been published."""
+        if self._worker is not None:
+            self._queue.join()
+
+    def _publish(self, packets):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for packet in packets:
+                pipe.publish(self.channel, packet)
+            pipe.execute()
+        except redis.RedisError:
+            logger.exception('Socket.IO emit failed, dropped %d event(s)', len(packets))
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='socketio-emitter', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Take whatever piled up meanwhile, without waiting for more
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._publish(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+class AsyncEmitter:
+    """``Emitter.emit`` for the event loop; one instance per loop, see ``get_async_emitter``."""
+
+    def __init__(self, url, channel=CHANNEL):
+        self.redis = redis.asyncio.Redis.from_url(url, socket_connect_timeout=2, socket_timeout=2)
+        self.channel = channel
+        self.host_id = uuid.uuid4().hex
+
+    async def emit(self, event, data, room=None, namespace=None, skip_sid=None):
+        packet = _packet(event, data, room, namespace, skip_sid, self.host_id)
+        try:
+            await self.redis.publish(self.channel, packet)
+        except redis.RedisError:
+            logger.exception('Socket.IO emit failed, dropped %r event', event)
+
+
+_emitter = None
+_emitter_lock = threading.Lock()
+
+
+def get_emitter():
+    global _emitter
+    if _emitter is None:
+        with _emitter_lock:
+            if _emitter is None:
+                _emitter = Emitter(
+                    settings.REDIS_URL,
+                    blocking=getattr(settings, 'SOCKETIO_EMIT_BLOCKING', True),
+                    batch_size=getattr(settings, 'SOCKETIO_EMIT_BATCH_SIZE', 100),
+                )
+    return _emitter
+
+
+def emit(event, data, room=None, **kwargs):
+    get_emitter().emit(event, data, room=room, **kwargs)
+
+
+# redis.asyncio connections belong to the loop that opened them
+_async_emitters = weakref.WeakKeyDictionary()
+
+
+def get_async_emitter():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_emitters:
+        _async_emitters[loop] = AsyncEmitter(settings.REDIS_URL)
+    return _async_emitters[loop]
@@ -0,0 +1,195 @@
+# backend/chat/export.py
+"""
+The ``/chat/backup/`` export, produced as a stream of chunks so memory stays
+flat however long a user's history is.
+
+Rooms are read ``ROOM_BATCH_SIZE`` and messages ``MESSAGE_BATCH_SIZE`` at a
+time in keyset order, each batch serialized with its senders, read receipts
+and reactions resolved in a constant number of queries, encoded and
+released before the next one is read.
+
+Messages carry their ``deleted_at``, so a deleted message is kept as a
+tombstone. With ``since``, only messages sent, edited or deleted after it
+are included, except in rooms the user joined after it, whose history is
+all new to the backup (the other sections, the user's rooms among them, are
+small and always complete): the payload of an incremental cloud backup
+(``chat/backup_chain.py``).
+
+``json`` chunks make up the same document the export has always been;
+``ndjson`` writes one record per line (``header``, ``profile``, ``settings``,
+``contact``, ``room``, ``message``) for consumers that parse as they read.
+"""
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import serializers
+
+from .inbox import room_list_queryset
+from .models import Contact, Message, UserSettings
+from .pagination import keyset_slice
+from .serializers import (
+    ChatRoomSerializer, ContactSerializer, MessageSerializer, UserSerializer, UserSettingsSerializer
+)
+
+_config = getattr(settings, 'CHAT_EXPORT', {})
+
+ROOM_BATCH_SIZE = _config.get('ROOM_BATCH_SIZE', 100)
+MESSAGE_BATCH_SIZE = _config.get('MESSAGE_BATCH_SIZE', 500)
+
+SECTIONS = ('profile', 'contacts', 'settings', 'chats')
+FORMATS = ('json', 'ndjson')
+
+# Not part of ``MessageSerializer``: the API leaves deleted messages out
+_DELETED_AT = serializers.DateTimeField()
+
+
+def sections(include):
+    """The sections named by an ``include`` query value (``all`` by default)."""
+    names = {name.strip() for name in (include or 'all').split(',')}
+    return set(SECTIONS) if 'all' in names else names & set(SECTIONS)
+
+
+def _dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+def _settings(user, context):
+    try:
+        return UserSettingsSerializer(UserSettings.objects.get(user=user), context=context).data
+    except UserSettings.DoesNotExist:
+        return {}
+
+
+def _contact_batches(user, context):
+    contacts = Contact.objects.filter(user=user).select_related('contact_user')
+    cursor = None
+    while True:
+        batch, has_more = keyset_slice(contacts, 'created_at', MESSAGE_BATCH_SIZE, cursor=cursor)
+        if batch:
+            yield ContactSerializer(batch, many=True, context=context).data
+        if not has_more:
+            return
+        cursor = (batch[-1].created_at, batch[-1].id)
+
+
+def _room_batches(user):
+    """The user's rooms with their memberships prefetched, ``ROOM_BATCH_SIZE`` at a time."""
+    rooms = room_list_queryset(user).annotate(my_joined_at=F('roommembership__joined_at')).order_by('id')
+    last_id = None
+    while True:
+        batch = list((rooms.filter(id__gt=last_id) if last_id else rooms)[:ROOM_BATCH_SIZE])
+        if batch:
+            yield batch
+        if len(batch) < ROOM_BATCH_SIZE:
+            return
+        last_id = batch[-1].id
+
+
+def changed_since(since):
+    """Messages sent, edited or deleted after ``since``."""
+    return Q(timestamp__gt=since) | Q(edited_at__gt=since) | Q(deleted_at__gt=since)
+
+
+def _serialize(messages, context):
+    data = MessageSerializer(messages, many=True, context=context).data
+    for message, item in zip(messages, data):
+        item['deleted_at'] = _DELETED_AT.to_representation(message.deleted_at)
+    return data
+
+
+def _message_batches(room, context, since=None, progress=None):
+    """Serialized messages of ``room``, oldest first, ``MESSAGE_BATCH_SIZE`` at a time."""
+    messages = Message.objects.filter(room=room).select_related('sender', 'reply_to__sender')
+    # A room joined since then is exported whole
+    if since is not None and room.my_joined_at <= since:
+        messages = messages.filter(changed_since(since))
+    cursor = None
+    while True:
+        batch, has_more = keyset_slice(messages, 'timestamp', MESSAGE_BATCH_SIZE, cursor=cursor)
+        if batch:
+            yield _serialize(batch, context)
+            if progress is not None:
+                progress(messages=len(batch))
+        if not has_more:
+            return
+        cursor = (batch[-1].timestamp, batch[-1].id)
+
+
+def _header(user, since):
+    header = {'timestamp': timezone.now().isoformat(), 'user_id': user.id}
+    if since is not None:
+        header['since'] = since.isoformat()
+    return header
+
+
+def export_json(user, include, context, since=None, progress=None):
+    """Chunks of the export as one JSON document."""
+    wanted = sections(include)
+    yield _dumps(_header(user, since))[:-1]
+    if 'profile' in wanted:
+        yield ', "profile": ' + _dumps(UserSerializer(user, context=context).data)
+    if 'contacts' in wanted:
+        yield ', "contacts": ['
+        first = True
+        for batch in _contact_batches(user, context):
+            yield ('' if first else ', ') + _dumps(batch)[1:-1]
+            first = False
+        yield ']'
+    if 'settings' in wanted:
+        yield ', "settings": ' + _dumps(_settings(user, context))
+    if 'chats' in wanted:
+        yield ', "chat_rooms": ['
+        first_room = True
+        for rooms in _room_batches(user):
+            for room in rooms:
+                yield ('' if first_room else ', ') + '{"room": ' + _dumps(ChatRoomSerializer(room, context=context).data) + ', "messages": ['
+                first_room = False
+                first = True
+                for batch in _message_batches(room, context, since, progress):
+                    yield ('' if first else ', ') + _dumps(batch)[1:-1]
+                    first = False
+                yield ']}'
+        yield ']'
+    yield '}'
+
+
+def export_ndjson(user, include, context, since=None, progress=None):
+    """Chunks of the export as newline-delimited ``{"type": ..., "data": ...}`` records."""
+    def line(kind, data, **extra):
+        return _dumps({'type': kind, **extra, 'data': data}) + '\n'
+
+    wanted = sections(include)
+    yield line('header', _header(user, since))
+    if 'profile' in wanted:
+        yield line('profile', UserSerializer(user, context=context).data)
+    if 'settings' in wanted:
+        yield line('settings', _settings(user, context))
+    if 'contacts' in wanted:
+        for batch in _contact_batches(user, context):
+            yield ''.join(line('contact', contact) for contact in batch)
+    if 'chats' in wanted:
+        for rooms in _room_batches(user):
+            for room in rooms:
+                yield line('room', ChatRoomSerializer(room, context=context).data)
+                for batch in _message_batches(room, context, since, progress):
+                    yield ''.join(line('message', message, room=str(room.id)) for message in batch)
+
+
+def gzipped(chunks):
+    """Gzip a stream of text chunks as it is produced."""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(user, include=None, output='json', context=None, since=None, progress=None):
+    """``progress``, if given, is called with ``messages=<count>`` after each batch."""
+    generate = export_ndjson if output == 'ndjson' else export_json
+    return generate(user, include, context or {}, since, progress)
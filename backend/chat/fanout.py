@@ -0,0 +1,180 @@
+# backend/chat/fanout.py
+"""
+One delivery pipeline for new messages, whichever path created them (REST,
+Channels consumer, system messages).
+
+``publish(message)`` serializes the message once and hands the resulting
+``FanoutEvent`` to every configured sink after the surrounding transaction
+commits. Sinks come from ``settings.MESSAGE_FANOUT_SINKS`` (dotted paths);
+by default the Channels groups and the Socket.IO rooms. A failing sink is
+logged and counted; it never stops the others.
+
+Async views use ``adeliver`` instead: sinks with a native ``apublish`` run on
+the event loop, the rest in a worker thread.
+"""
+import json
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import emitter
+from .serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINKS = [
+    'chat.fanout.ChannelsSink',
+    'chat.fanout.SocketIOSink',
+]
+
+
+class FanoutEvent:
+    """A serialized message on its way out; sinks share the payload and its encodings."""
+
+    def __init__(self, message, payload, name='message'):
+        self.name = name
+        self.room_id = str(message.room_id)
+        self.sender_id = message.sender_id
+        self.payload = payload
+        self._channels_frame = None
+
+    @property
+    def channels_frame(self):
+        """The WebSocket text frame ``ChatConsumer`` clients expect, encoded once."""
+        if self._channels_frame is None:
+            payload = self.payload
+            self._channels_frame = json.dumps({
+                'type': self.name,
+                'message_id': payload['id'],
+                'content': payload['content'],
+                'message_type': payload['message_type'],
+                'sender_id': payload['sender']['id'],
+                'sender_username': payload['sender']['username'],
+                'timestamp': payload['timestamp'],
+                'reply_to': payload['reply_to']['id'] if payload['reply_to'] else None,
+            })
+        return self._channels_frame
+
+
+class BaseSink:
+    name = None
+
+    def publish(self, event):
+        raise NotImplementedError
+
+    async def apublish(self, event):
+        await sync_to_async(self.publish, thread_sensitive=False)(event)
+
+
+class ChannelsSink(BaseSink):
+    """``chat_<room_id>`` groups joined by ``ChatConsumer``."""
+    name = 'channels'
+
+    def publish(self, event):
+        async_to_sync(self.apublish)(event)
+
+    async def apublish(self, event):
+        await get_channel_layer().group_send(f'chat_{event.room_id}', {
+            'type': 'chat_message',
+            'sender_id': event.sender_id,
+            'text': event.channels_frame,
+        })
+
+
+class SocketIOSink(BaseSink):
+    """Socket.IO rooms (named by room id), through the shared emitter."""
+    name = 'socketio'
+
+    def publish(self, event):
+        emitter.emit(event.name, event.payload, room=event.room_id)
+
+    async def apublish(self, event):
+        await emitter.get_async_emitter().emit(event.name, event.payload, room=event.room_id)
+
+
+class Metrics:
+    """Per-sink publish counters and latency, in-process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sinks = {}
+
+    def record(self, sink, seconds, ok=True):
+        with self._lock:
+            stats = self._sinks.setdefault(sink, {'published': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['published' if ok else 'errors'] += 1
+            ms = seconds * 1000
+            stats['total_ms'] += ms
+            stats['max_ms'] = max(stats['max_ms'], ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                sink: dict(stats, avg_ms=stats['total_ms'] / ((stats['published'] + stats['errors']) or 1))
+                for sink, stats in self._sinks.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._sinks.clear()
+
+
+metrics = Metrics()
+
+_sinks = None
+
+
+def get_sinks():
+    global _sinks
+    if _sinks is None:
+        paths = getattr(settings, 'MESSAGE_FANOUT_SINKS', DEFAULT_SINKS)
+        _sinks = [import_string(path)() for path in paths]
+    return _sinks
+
+
+def deliver(event):
+    for sink in get_sinks():
+        started = time.perf_counter()
+        try:
+            sink.publish(event)
+        except Exception:
+            metrics.record(sink.name, time.perf_counter() - started, ok=False)
+            logger.exception('Fan-out to %s failed for room %s', sink.name, event.room_id)
+        else:
+            metrics.record(sink.name, time.perf_counter() - started)
+
+
+async def adeliver(event):
+    for sink in get_sinks():
+        started = time.perf_counter()
+        try:
+            await sink.apublish(event)
+        except Exception:
+            metrics.record(sink.name, time.perf_counter() - started, ok=False)
+            logger.exception('Fan-out to %s failed for room %s', sink.name, event.room_id)
+        else:
+            metrics.record(sink.name, time.perf_counter() - started)
+
+
+def publish(message, payload=None):
+    """
+    Fan ``message`` out to every sink once the current transaction commits
+    (immediately outside of one). Pass ``payload`` when the caller already
+    serialized the message; returns it either way.
+    """
+    if payload is None:
+        payload = MessageSerializer(message).data
+    event = FanoutEvent(message, payload)
+    transaction.on_commit(lambda: deliver(event))
+    return payload
+
+
+async def apublish(message, payload):
+    """``publish`` for async views, awaited once the message's transaction has committed."""
+    await adeliver(FanoutEvent(message, payload))
@@ -0,0 +1,64 @@
+# backend/chat/frame_batching.py
+"""
+Coalesces outgoing WebSocket events into array frames for clients that
+opted in (``?batch=1``): events are held for up to ``WINDOW`` seconds, or
+until ``MAX_EVENTS``/``MAX_BYTES`` is reached, then sent as one
+``[event, event, ...]`` frame. Events arrive already JSON-encoded and are
+joined as is, never decoded again.
+"""
+import asyncio
+
+from django.conf import settings
+
+_config = getattr(settings, 'WEBSOCKET_BATCHING', {})
+
+WINDOW = _config.get('WINDOW', 0.05)
+MAX_EVENTS = _config.get('MAX_EVENTS', 50)
+MAX_BYTES = _config.get('MAX_BYTES', 64 * 1024)
+
+
+def wants_batching(scope):
+    """Clients negotiate batching with ``batch=1`` in the connection query string."""
+    query = scope.get('query_string', b'').decode('latin-1')
+    return any(param in ('batch=1', 'batch=true') for param in query.split('&'))
+
+
+class FrameBatcher:
+    def __init__(self, send, window=WINDOW, max_events=MAX_EVENTS, max_bytes=MAX_BYTES):
+        self.send = send
+        self.window = window
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.pending = []
+        self.pending_bytes = 0
+        self.timer = None
+
+    async def add(self, text):
+        self.pending.append(text)
+        self.pending_bytes += len(text)
+        if len(self.pending) >= self.max_events or self.pending_bytes >= self.max_bytes:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        self.timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        frame = '[' + ','.join(self.pending) + ']'
+        self.pending = []
+        self.pending_bytes = 0
+        await self.send(text_data=frame)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.pending = []
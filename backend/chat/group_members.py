@@ -0,0 +1,116 @@
+# backend/chat/group_members.py
+"""
+Set-based membership changes for group rooms: adding, removing or changing
+the role of any number of users takes a constant number of queries, one
+system message and one fan-out event.
+
+Additions and role changes lock the room row so ``ChatRoom.max_members``
+and "at least one admin" hold under concurrent requests. Memberships are
+written in bulk, so the membership cache is invalidated here rather than
+by the model signals.
+"""
+from django.db import transaction
+
+from . import fanout, member_cache, read_state, room_activity
+from .models import ChatRoom, Message, RoomMembership, User
+
+ROLES = ('admin', 'member')
+# Usernames spelled out in a system message; the rest are counted
+MAX_NAMED = 3
+
+
+class MembershipError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_user_ids(values, field='user_ids'):
+    """Distinct integer ids from a request's list of user ids; entries that aren't ids are skipped."""
+    if not isinstance(values, (list, tuple)):
+        raise MembershipError(f'{field} must be a list')
+    user_ids = []
+    for value in values:
+        try:
+            user_ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(user_ids))
+
+
+def _names(usernames):
+    if len(usernames) <= MAX_NAMED:
+        return ', '.join(usernames)
+    return f'{", ".join(usernames[:MAX_NAMED])} and {len(usernames) - MAX_NAMED} others'
+
+
+def _announce(room, actor, content):
+    message = Message.objects.create(room=room, sender=actor, content=content, message_type='system')
+    read_state.record_new_message(message)
+    room_activity.set_last_message(message)
+    fanout.publish(message)
+
+
+def _locked(room):
+    return ChatRoom.objects.select_for_update().get(id=room.id)
+
+
+def _invalidate(room):
+    room_id = room.id
+    transaction.on_commit(lambda: member_cache.invalidate(room_id))
+
+
+@transaction.atomic
+def add_members(room, actor, user_ids, role='member', announce=True):
+    """
+    Add the active users among ``user_ids`` that aren't members yet, all or
+    none: ``MembershipError`` if they would take the room past
+    ``max_members``. Returns the added ``(user_id, username)`` pairs.
+    """
+    room = _locked(room)
+    existing = set(RoomMembership.objects.filter(room=room).values_list('user_id', flat=True))
+    wanted = [user_id for user_id in user_ids if user_id not in existing]
+    found = dict(User.objects.filter(id__in=wanted, is_active=True).values_list('id', 'username'))
+    added = [(user_id, found[user_id]) for user_id in wanted if user_id in found]
+    if not added:
+        return added
+    if len(existing) + len(added) > room.max_members:
+        raise MembershipError(f'This group is limited to {room.max_members} members')
+
+    RoomMembership.objects.bulk_create(
+        [RoomMembership(room=room, user_id=user_id, role=role) for user_id, _ in added],
+        ignore_conflicts=True,
+    )
+    _invalidate(room)
+    if announce:
+        _announce(room, actor, f'Added {_names([name for _, name in added])} to the group')
+    return added
+
+
+@transaction.atomic
+def remove_members(room, actor, user_ids):
+    """Remove ``user_ids`` (never ``actor``: leaving is separate). Returns the removed ``(user_id, username)`` pairs."""
+    removed = list(
+        RoomMembership.objects.filter(room=room, user_id__in=user_ids).exclude(
+            user=actor
+        ).order_by('id').values_list('user_id', 'user__username')
+    )
+    if not removed:
+        return removed
+    RoomMembership.objects.filter(room=room, user_id__in=[user_id for user_id, _ in removed]).delete()
+    _announce(room, actor, f'Removed {_names([name for _, name in removed])} from the group')
+    return removed
+
+
+@transaction.atomic
+def set_roles(room, user_ids, role):
+    """Give ``user_ids`` ``role``; refuses to leave the group without an admin. Returns how many changed."""
+    if role not in ROLES:
+        raise MembershipError('Invalid role')
+    room = _locked(room)
+    updated = RoomMembership.objects.filter(room=room, user_id__in=user_ids).exclude(role=role).update(role=role)
+    if updated and not RoomMembership.objects.filter(room=room, role='admin').exists():
+        raise MembershipError('A group needs at least one admin')
+    if updated:
+        _invalidate(room)
+    return updated
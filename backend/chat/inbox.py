@@ -0,0 +1,81 @@
+# backend/chat/inbox.py
+from django.db.models import Count, F, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import room_activity
+from .models import ChatRoom, RoomMembership
+from .pagination import encode_cursor, keyset_slice
+
+
+def room_list_queryset(user, members='all'):
+    """
+    Rooms of ``user`` with everything the room list renders resolved up front:
+    the caller's membership flags, the member count, the last message preview
+    and the memberships, so serialization issues no per-room queries.
+
+    ``members`` is ``'all'`` to prefetch every membership, or ``'direct'`` to
+    prefetch them for direct rooms only (group member lists are not needed to
+    render an inbox and can be arbitrarily large).
+    """
+    member_count = RoomMembership.objects.filter(
+        room=OuterRef('pk')
+    ).order_by().values('room').annotate(total=Count('id')).values('total')
+
+    memberships = RoomMembership.objects.select_related('user').order_by('id')
+    if members == 'direct':
+        memberships = memberships.filter(room__room_type='direct')
+
+    # filter() and annotate() share the join, so F() reads the caller's own membership
+    return ChatRoom.objects.filter(
+        roommembership__user=user
+    ).annotate(
+        my_unread_count=F('roommembership__unread_count'),
+        my_is_archived=F('roommembership__is_archived'),
+        my_is_muted=F('roommembership__is_muted'),
+        num_members=Coalesce(Subquery(member_count, output_field=IntegerField()), Value(0)),
+    ).select_related(
+        'last_message__sender'
+    ).prefetch_related(
+        Prefetch('roommembership_set', queryset=memberships)
+    )
+
+
+def room_list(user):
+    """Every room of ``user``, newest activity first (pending bumps included)."""
+    rooms = room_activity.apply_pending(list(room_list_queryset(user)))
+    return sorted(rooms, key=lambda room: (room.updated_at, room.id), reverse=True)
+
+
+def inbox_page(user, limit, cursor=None, archived=False, muted=None):
+    """
+    One page of the inbox, newest activity first, keyset-paginated on
+    ``(updated_at, id)``. Returns ``(rooms, next_cursor)``.
+
+    Rooms with unflushed activity (``room_activity``) are left out of the
+    keyset query and merged in at their pending ``updated_at``.
+    """
+    rooms = room_list_queryset(user, members='direct').filter(my_is_archived=archived)
+    memberships = RoomMembership.objects.filter(user=user, is_archived=archived)
+    if muted is not None:
+        rooms = rooms.filter(my_is_muted=muted)
+        memberships = memberships.filter(is_muted=muted)
+
+    # Scores of this user's rooms only, not the whole pending set
+    bumps = room_activity.pending(memberships.values_list('room_id', flat=True))
+    page, has_more = keyset_slice(
+        rooms.exclude(id__in=list(bumps)) if bumps else rooms,
+        'updated_at', limit, cursor=cursor, descending=True,
+    )
+    if bumps:
+        bumped = room_activity.apply_pending(list(rooms.filter(id__in=list(bumps))), bumps)
+        if cursor is not None:
+            timestamp, pk = cursor
+            bumped = [room for room in bumped if (room.updated_at, str(room.id)) < (timestamp, str(pk))]
+        merged = sorted(page + bumped, key=lambda room: (room.updated_at, room.id), reverse=True)
+        has_more = has_more or len(merged) > limit
+        page = merged[:limit]
+
+    next_cursor = None
+    if has_more and page:
+        next_cursor = encode_cursor(page[-1].updated_at, page[-1].id)
+    return page, next_cursor
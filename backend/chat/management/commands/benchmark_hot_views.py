@@ -0,0 +1,158 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import member_cache
+from chat.models import ChatRoom, Message, RoomMembership, User
+
+MODES = {'sync': 'False', 'async': 'True'}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare requests/s and p99 latency of the sync and async hot chat views '
+        '(ASYNC_HOT_VIEWS) under concurrent clients, each against a fresh uvicorn '
+        'server on the configured database. Creates bench_* users and a room on first run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=20, help='Seconds of load per mode')
+        parser.add_argument('--warmup', type=float, default=3, help='Seconds of load before measuring')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--modes', default='sync,async')
+        parser.add_argument('--url', help='Benchmark an already running server instead of starting one')
+
+    def handle(self, *args, **options):
+        tokens, room_id = self.fixtures(options['clients'])
+        if options['url']:
+            results = {options['url']: self.run_load(options['url'], tokens, room_id, options)}
+        else:
+            results = {}
+            for mode in options['modes'].split(','):
+                if mode not in MODES:
+                    raise CommandError(f'Unknown mode {mode!r}')
+                with self.server(mode, options['port']):
+                    results[mode] = self.run_load(f'http://127.0.0.1:{options["port"]}', tokens, room_id, options)
+        self.report(results)
+
+    def fixtures(self, clients):
+        users = []
+        for i in range(clients):
+            user, created = User.objects.get_or_create(username=f'bench_{i}')
+            if created:
+                user.set_unusable_password()
+                user.save()
+            users.append(user)
+        room, created = ChatRoom.objects.get_or_create(
+            name='Benchmark', room_type='group', created_by=users[0]
+        )
+        existing = set(RoomMembership.objects.filter(room=room).values_list('user_id', flat=True))
+        if RoomMembership.objects.bulk_create([
+            RoomMembership(room=room, user=user) for user in users if user.id not in existing
+        ]):
+            # bulk_create sends no post_save: drop the cached members ourselves
+            member_cache.invalidate(room.id)
+        if created:
+            Message.objects.bulk_create([
+                Message(room=room, sender=users[i % clients], content=f'Benchmark message {i}') for i in range(200)
+            ])
+        return [str(AccessToken.for_user(user)) for user in users], str(room.id)
+
+    def server(self, mode, port):
+        command = self
+
+        class Server:
+            def __enter__(self):
+                env = dict(os.environ, ASYNC_HOT_VIEWS=MODES[mode], DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+                self.process = subprocess.Popen(
+                    [sys.executable, '-m', 'uvicorn', 'core.asgi:application', '--port', str(port), '--log-level', 'warning'],
+                    cwd=settings.BASE_DIR, env=env,
+                )
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    try:
+                        socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                        command.stdout.write(f'{mode}: server up on port {port}')
+                        return self
+                    except OSError:
+                        if self.process.poll() is not None:
+                            break
+                        time.sleep(0.2)
+                self.process.kill()
+                raise CommandError(f'{mode} server did not start')
+
+            def __exit__(self, *exc):
+                self.process.terminate()
+                self.process.wait(10)
+
+        return Server()
+
+    def run_load(self, base_url, tokens, room_id, options):
+        return asyncio.run(self.load(base_url, tokens, room_id, options['warmup'], options['duration']))
+
+    async def load(self, base_url, tokens, room_id, warmup, duration):
+        requests = [
+            ('chat_rooms', 'GET', '/api/rooms/', None),
+            ('room_messages', 'GET', f'/api/rooms/{room_id}/messages/?limit=50', None),
+            ('send_message', 'POST', '/api/messages/', {'room_id': room_id, 'content': 'benchmark'}),
+            ('mark_room_read', 'POST', f'/api/rooms/{room_id}/read/', None),
+        ]
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        start = time.monotonic()
+        measure_from = start + warmup
+        stop = measure_from + duration
+
+        async def client(http, token, offset):
+            headers = {'Authorization': f'Bearer {token}'}
+            i = offset
+            while time.monotonic() < stop:
+                name, method, path, body = requests[i % len(requests)]
+                i += 1
+                started = time.monotonic()
+                try:
+                    response = await http.request(method, path, json=body, headers=headers)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if started >= measure_from:
+                    if ok:
+                        latencies[name].append(time.monotonic() - started)
+                    else:
+                        errors[name] += 1
+
+        limits = httpx.Limits(max_connections=len(tokens), max_keepalive_connections=len(tokens))
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as http:
+            await asyncio.gather(*(client(http, token, i) for i, token in enumerate(tokens)))
+        return {name: (latencies[name], errors[name], duration) for name, *_ in requests}
+
+    def report(self, results):
+        self.stdout.write(f'\n{"server":<10} {"endpoint":<16} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>7}')
+        for label, endpoints in results.items():
+            everything, total_errors = [], 0
+            for name, (latencies, errors, duration) in endpoints.items():
+                everything.extend(latencies)
+                total_errors += errors
+                self.stdout.write(
+                    f'{label:<10} {name:<16} {len(latencies) / duration:>9.1f} '
+                    f'{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 99) * 1000:>9.1f} {errors:>7}'
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'{label:<10} {"total":<16} {len(everything) / duration:>9.1f} '
+                f'{percentile(everything, 50) * 1000:>9.1f} {percentile(everything, 99) * 1000:>9.1f} {total_errors:>7}'
+            ))
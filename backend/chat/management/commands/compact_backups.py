@@ -0,0 +1,22 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chat import backup_chain
+
+class Command(BaseCommand):
+    help = 'Fold incremental backup chains that are no longer extended into single full snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=backup_chain.COMPACT_AFTER_DAYS,
+            help='Compact chains whose newest backup is older than this many days'
+        )
+
+    def handle(self, *args, **options):
+        older_than = timezone.now() - datetime.timedelta(days=options['days'])
+        compacted = 0
+        for full in backup_chain.compactable(older_than).iterator():
+            if backup_chain.compact(full, older_than) is not None:
+                compacted += 1
+        self.stdout.write(self.style.SUCCESS(f'Compacted {compacted} backup chains'))
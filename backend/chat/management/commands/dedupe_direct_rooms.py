@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from chat import direct_rooms, member_cache, read_state, room_activity
+from chat.models import ChatRoom, DirectRoom, Message, RoomMembership
+
+class Command(BaseCommand):
+    help = 'Merge duplicate direct rooms of the same pair of users into one and map every pair to its room'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be merged')
+
+    def handle(self, *args, **options):
+        members = {}
+        for room_id, user_id in RoomMembership.objects.filter(room__room_type='direct').values_list('room_id', 'user_id').iterator():
+            members.setdefault(room_id, []).append(user_id)
+
+        mapped = dict(DirectRoom.objects.values_list('room_id', 'id'))
+        pairs = {}
+        # Oldest activity first, so the last room of a pair is its most recently active
+        for room_id in ChatRoom.objects.filter(id__in=list(members)).order_by('updated_at').values_list('id', flat=True):
+            if len(members[room_id]) == 2:
+                pairs.setdefault(direct_rooms.pair(*members[room_id]), []).append(room_id)
+
+        merged = moved = 0
+        for room_ids in pairs.values():
+            canonical = next((room_id for room_id in room_ids if room_id in mapped), room_ids[-1])
+            duplicates = [room_id for room_id in room_ids if room_id != canonical]
+            if not duplicates and canonical in mapped:
+                continue
+            if options['dry_run']:
+                merged += len(duplicates)
+                moved += Message.objects.filter(room_id__in=duplicates).count()
+                continue
+            moved += self.merge(canonical, duplicates)
+            merged += len(duplicates)
+
+        verb = 'Would merge' if options['dry_run'] else 'Merged'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {merged} duplicate direct rooms ({moved} messages) across {len(pairs)} pairs'))
+
+    @transaction.atomic
+    def merge(self, canonical, duplicates):
+        """Move the messages and read watermarks of ``duplicates`` into ``canonical``, then delete them."""
+        room = ChatRoom.objects.select_for_update().get(id=canonical)
+        moved = 0
+        if duplicates:
+            moved = Message.objects.filter(room_id__in=duplicates).update(room=room)
+
+            # Each member keeps the furthest they had read in any of the rooms
+            watermarks = {}
+            for user_id, message_id, timestamp in RoomMembership.objects.filter(
+                room_id__in=[canonical, *duplicates], last_read_timestamp__isnull=False
+            ).values_list('user_id', 'last_read_message_id', 'last_read_timestamp'):
+                if user_id not in watermarks or timestamp > watermarks[user_id][1]:
+                    watermarks[user_id] = (message_id, timestamp)
+            for user_id, (message_id, timestamp) in watermarks.items():
+                RoomMembership.objects.filter(room=room, user_id=user_id).update(
+                    last_read_message_id=message_id, last_read_timestamp=timestamp
+                )
+
+            updated_at = ChatRoom.objects.filter(id__in=[canonical, *duplicates]).aggregate(latest=Max('updated_at'))['latest']
+            ChatRoom.objects.filter(id__in=duplicates).delete()
+            ChatRoom.objects.filter(id=canonical).update(updated_at=updated_at)
+            room_activity.refresh_last_message(canonical)
+            read_state.rebuild_unread_counts(RoomMembership.objects.filter(room=room))
+
+        direct_rooms.map_room(room)
+        for room_id in [canonical, *duplicates]:
+            transaction.on_commit(lambda room_id=room_id: member_cache.invalidate(room_id))
+        return moved
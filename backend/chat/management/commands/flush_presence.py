@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from chat import presence
+
+class Command(BaseCommand):
+    help = 'Write pending last_seen/online status changes from Redis to the database'
+
+    def handle(self, *args, **options):
+        flushed = presence.flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed presence for {flushed} users'))
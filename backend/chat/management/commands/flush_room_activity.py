@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from chat import room_activity
+
+class Command(BaseCommand):
+    help = 'Write pending room activity (updated_at, last message) from Redis to the database'
+
+    def handle(self, *args, **options):
+        flushed = room_activity.flush()
+        self.stdout.write(self.style.SUCCESS(f'Flushed activity for {flushed} rooms'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from chat.models import MessageReactionCount
+from chat.reactions import create_missing_counts, rebuild_counts
+
+class Command(BaseCommand):
+    help = 'Rebuild MessageReactionCount rows from the MessageReaction rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        created = create_missing_counts(batch_size=batch_size)
+
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(MessageReactionCount.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            updated += rebuild_counts(MessageReactionCount.objects.filter(id__in=ids))
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {updated} reaction counts ({created} added)'))
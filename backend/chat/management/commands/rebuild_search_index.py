@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from chat.search import get_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text message search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        indexed = backend.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} messages with {backend.__class__.__name__}'
+        ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from chat.models import RoomMembership
+from chat.read_state import rebuild_unread_counts
+
+class Command(BaseCommand):
+    help = 'Rebuild RoomMembership.unread_count from the read watermarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only rebuild counters for this user id')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        memberships = RoomMembership.objects.order_by('id')
+        if options['user']:
+            memberships = memberships.filter(user_id=options['user'])
+
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            ids = list(memberships.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                break
+            updated += rebuild_unread_counts(RoomMembership.objects.filter(id__in=ids))
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt unread counters for {updated} memberships'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from chat import user_search
+
+class Command(BaseCommand):
+    help = 'Rebuild the username trigram index used by user search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        indexed = user_search.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} users'))
@@ -0,0 +1,163 @@
+# backend/chat/member_cache.py
+"""
+Cached room membership: ``{user_id: role}`` per room.
+
+Lookups go through a small in-process LRU (entries live ``LOCAL_TTL``
+seconds), then a Redis hash per room (``membership:<room_id>``), then the
+database. Creating, deleting or saving a ``RoomMembership`` drops both cache
+levels for its room once the transaction commits (see ``signals.py``); other
+processes see the change when their local entry expires. Code that writes
+memberships with ``bulk_create``/``update`` must call ``invalidate`` itself.
+
+Invalidating also bumps the room's generation (``membership:gen:<room_id>``).
+A load watches it and doesn't cache what it read if it changed meanwhile, so
+a load racing an invalidation can't put the old members back.
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from .models import RoomMembership
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'MEMBERSHIP_CACHE', {})
+
+LOCAL_TTL = _config.get('LOCAL_TTL', 5)
+LOCAL_SIZE = _config.get('LOCAL_SIZE', 10000)
+TTL = _config.get('TTL', 60 * 60)
+
+# Marks a loaded hash so empty rooms are cached too
+_LOADED = '_'
+
+
+class _LRU:
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + LOCAL_TTL, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = _LRU(LOCAL_SIZE)
+
+
+def _room_key(room_id):
+    """Canonical form of a room id, or ``None`` if it isn't one."""
+    try:
+        return str(room_id if isinstance(room_id, uuid.UUID) else uuid.UUID(str(room_id)))
+    except ValueError:
+        return None
+
+
+def _redis_key(room_key):
+    return f'membership:{room_key}'
+
+
+def _generation_key(room_key):
+    return f'membership:gen:{room_key}'
+
+
+def _query(room_key):
+    return dict(RoomMembership.objects.filter(room_id=room_key).values_list('user_id', 'role'))
+
+
+def _load(room_key):
+    """``(roles, cached)``; ``cached`` is false when the room was invalidated while loading."""
+    roles = None
+    try:
+        with get_redis().pipeline() as pipe:
+            pipe.watch(_generation_key(room_key))
+            roles = _query(room_key)
+            pipe.multi()
+            pipe.delete(_redis_key(room_key))
+            pipe.hset(_redis_key(room_key), mapping={_LOADED: '', **roles})
+            pipe.expire(_redis_key(room_key), TTL)
+            pipe.execute()
+    except redis.WatchError:
+        # Read again: the invalidation runs after its transaction committed
+        return _query(room_key), False
+    except redis.RedisError:
+        logger.exception('Membership cache write failed for room %s', room_key)
+        return (_query(room_key) if roles is None else roles), True
+    return roles, True
+
+
+def roles(room_id):
+    """``{user_id: role}`` for every member of the room (empty for unknown rooms)."""
+    room_key = _room_key(room_id)
+    if room_key is None:
+        return {}
+    cached = _local.get(room_key)
+    if cached is not None:
+        return cached
+
+    try:
+        stored = get_redis().hgetall(_redis_key(room_key))
+    except redis.RedisError:
+        logger.exception('Membership cache read failed for room %s', room_key)
+        stored = None
+    if stored:
+        result = {int(user_id): role for user_id, role in stored.items() if user_id != _LOADED}
+    else:
+        result, cached = _load(room_key)
+        if not cached:
+            return result
+    _local.set(room_key, result)
+    return result
+
+
+def role(room_id, user_id):
+    """The user's role in the room, or ``None`` if they aren't a member."""
+    return roles(room_id).get(user_id)
+
+
+def is_member(room_id, user_id):
+    return user_id in roles(room_id)
+
+
+def member_ids(room_id):
+    return list(roles(room_id))
+
+
+def invalidate(room_id):
+    room_key = _room_key(room_id)
+    if room_key is None:
+        return
+    _local.delete(room_key)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(_generation_key(room_key))
+        pipe.expire(_generation_key(room_key), TTL)
+        pipe.delete(_redis_key(room_key))
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Membership cache invalidation failed for room %s', room_key)
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:03
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_media'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommembership',
+            name='is_archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='usersettings',
+            name='wallpaper',
+            field=models.ImageField(blank=True, null=True, upload_to='wallpapers/'),
+        ),
+        migrations.CreateModel(
+            name='UserBackup',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data', models.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('size_bytes', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
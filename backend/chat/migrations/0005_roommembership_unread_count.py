@@ -0,0 +1,37 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:04
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_unread_counts(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    MessageRead = apps.get_model('chat', 'MessageRead')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+
+    unread = Message.objects.filter(
+        room=OuterRef('room')
+    ).exclude(
+        sender=OuterRef('user')
+    ).filter(
+        ~Exists(MessageRead.objects.filter(message=OuterRef('pk'), user=OuterRef(OuterRef('user'))))
+    ).order_by().values('room').annotate(total=Count('id')).values('total')
+
+    RoomMembership.objects.update(unread_count=Coalesce(Subquery(unread), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_roommembership_is_archived_usersettings_wallpaper_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommembership',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_unread_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_last_message(apps, schema_editor):
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+
+    newest = Message.objects.filter(
+        room=OuterRef('pk'), deleted_at__isnull=True
+    ).order_by('-timestamp', '-id').values('id')[:1]
+    ChatRoom.objects.update(last_message=Subquery(newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_roommembership_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message'),
+        ),
+        migrations.RunPython(backfill_last_message, migrations.RunPython.noop),
+    ]
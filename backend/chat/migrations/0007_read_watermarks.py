@@ -0,0 +1,82 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:08
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def collapse_message_reads(apps, schema_editor):
+    """
+    Turn per-message MessageRead rows into one watermark per membership: the
+    newest message the member has read (or written) in the room.
+    """
+    Message = apps.get_model('chat', 'Message')
+    MessageRead = apps.get_model('chat', 'MessageRead')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+
+    newest_read = Message.objects.filter(
+        room=OuterRef('room')
+    ).filter(
+        Q(sender=OuterRef('user')) | Q(messageread__user=OuterRef('user'))
+    ).order_by('-timestamp', '-id')
+    read_at = MessageRead.objects.filter(
+        user=OuterRef('user'), message__room=OuterRef('room')
+    ).order_by().values('user').annotate(latest=Max('read_at')).values('latest')
+
+    RoomMembership.objects.update(
+        last_read_message=Subquery(newest_read.values('id')[:1]),
+        last_read_timestamp=Subquery(newest_read.values('timestamp')[:1]),
+        last_read_at=Subquery(read_at),
+    )
+
+    epoch = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    unread = Message.objects.filter(
+        room=OuterRef('room'),
+        deleted_at__isnull=True,
+        timestamp__gt=Coalesce(OuterRef('last_read_timestamp'), Value(epoch))
+    ).exclude(
+        sender=OuterRef('user')
+    ).order_by().values('room').annotate(total=Count('id')).values('total')
+    RoomMembership.objects.update(unread_count=Coalesce(Subquery(unread), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatroom_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommembership',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='roommembership',
+            name='last_read_timestamp',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='roommembership',
+            index=models.Index(fields=['room', 'last_read_timestamp'], name='chat_roomme_room_id_2b650c_idx'),
+        ),
+        migrations.RunPython(collapse_message_reads, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='messageread',
+            unique_together=None,
+        ),
+        migrations.RemoveField(
+            model_name='messageread',
+            name='message',
+        ),
+        migrations.RemoveField(
+            model_name='messageread',
+            name='user',
+        ),
+        migrations.DeleteModel(
+            name='MessageRead',
+        ),
+    ]
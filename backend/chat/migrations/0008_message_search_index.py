@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_fts "
+            "USING fts5(content, message_id, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_message_fts (content, message_id) "
+            "SELECT content, id FROM chat_message WHERE deleted_at IS NULL"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "ALTER TABLE chat_message ADD COLUMN IF NOT EXISTS search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED"
+        )
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS chat_message_search_vector_idx "
+            "ON chat_message USING GIN (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS chat_message_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS chat_message_search_vector_idx")
+        schema_editor.execute("ALTER TABLE chat_message DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:12
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+def trigrams(value):
+    value = f'  {value.lower()} '
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def backfill_trigrams(apps, schema_editor):
+    User = apps.get_model('chat', 'User')
+    UserSearchTrigram = apps.get_model('chat', 'UserSearchTrigram')
+    rows = []
+    for user_id, username in User.objects.values_list('id', 'username').iterator():
+        rows.extend(UserSearchTrigram(user_id=user_id, trigram=trigram) for trigram in trigrams(username))
+        if len(rows) >= 5000:
+            UserSearchTrigram.objects.bulk_create(rows)
+            rows = []
+    UserSearchTrigram.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('chat', '0008_message_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(django.db.models.functions.text.Lower('username'), name='chat_user_username_lower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['phone_number'], name='chat_user_phone_idx'),
+        ),
+        migrations.AddField(
+            model_name='usersearchtrigram',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_trigrams', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='usersearchtrigram',
+            unique_together={('trigram', 'user')},
+        ),
+        migrations.RunPython(backfill_trigrams, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_reactions(apps, schema_editor):
+    """``Message.reactions`` (``{emoji: [user_id, ...]}``) to reaction and count rows."""
+    Message = apps.get_model('chat', 'Message')
+    MessageReaction = apps.get_model('chat', 'MessageReaction')
+    MessageReactionCount = apps.get_model('chat', 'MessageReactionCount')
+    User = apps.get_model('chat', 'User')
+    user_ids = set(User.objects.values_list('id', flat=True))
+
+    reactions, counts = [], []
+    for message_id, data in Message.objects.exclude(reactions={}).values_list('id', 'reactions').iterator():
+        for emoji, users in (data or {}).items():
+            users = {int(user_id) for user_id in users if str(user_id).isdigit()} & user_ids
+            if not users or len(emoji) > 32:
+                continue
+            reactions.extend(MessageReaction(message_id=message_id, user_id=user_id, emoji=emoji) for user_id in users)
+            counts.append(MessageReactionCount(message_id=message_id, emoji=emoji, count=len(users)))
+        if len(reactions) >= 5000:
+            MessageReaction.objects.bulk_create(reactions)
+            MessageReactionCount.objects.bulk_create(counts)
+            reactions, counts = [], []
+    MessageReaction.objects.bulk_create(reactions)
+    MessageReactionCount.objects.bulk_create(counts)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_user_tokens_valid_after'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageReaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=32)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reaction_set', to='chat.message')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reactions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('message', 'user', 'emoji')},
+            },
+        ),
+        migrations.CreateModel(
+            name='MessageReactionCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('emoji', models.CharField(max_length=32)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reaction_counts', to='chat.message')),
+            ],
+            options={
+                'unique_together': {('message', 'emoji')},
+            },
+        ),
+        migrations.RunPython(copy_reactions, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='message',
+            name='reactions',
+        ),
+    ]
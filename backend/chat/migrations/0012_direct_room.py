@@ -0,0 +1,54 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def map_direct_rooms(apps, schema_editor):
+    """Record the pair of every two-member direct room; of duplicates, the most recently active (see ``dedupe_direct_rooms``)."""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    RoomMembership = apps.get_model('chat', 'RoomMembership')
+    DirectRoom = apps.get_model('chat', 'DirectRoom')
+
+    members = {}
+    for room_id, user_id in RoomMembership.objects.filter(room__room_type='direct').values_list('room_id', 'user_id').iterator():
+        members.setdefault(room_id, []).append(user_id)
+
+    pairs = {}
+    for room_id in ChatRoom.objects.filter(id__in=list(members)).order_by('updated_at').values_list('id', flat=True):
+        users = sorted(members[room_id])
+        if len(users) == 2 and users[0] != users[1]:
+            pairs[tuple(users)] = room_id
+    DirectRoom.objects.bulk_create(
+        [DirectRoom(user_low_id=low, user_high_id=high, room_id=room_id) for (low, high), room_id in pairs.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_message_reactions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectRoom',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='direct_pair', to='chat.chatroom')),
+                ('user_high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('user_low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='directroom',
+            constraint=models.UniqueConstraint(fields=('user_low', 'user_high'), name='chat_directroom_pair_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='directroom',
+            constraint=models.CheckConstraint(check=models.Q(('user_low__lt', models.F('user_high'))), name='chat_directroom_pair_ordered'),
+        ),
+        migrations.RunPython(map_direct_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:45
+
+import json
+
+from django.db import migrations, models
+
+
+def move_payloads(apps, schema_editor):
+    """``UserBackup.data`` to gzip chunks in the backups storage."""
+    from chat import backup_storage
+
+    UserBackup = apps.get_model('chat', 'UserBackup')
+    for backup_id in UserBackup.objects.values_list('id', flat=True).iterator():
+        backup = UserBackup.objects.get(id=backup_id)
+        backup_storage.write(backup, [json.dumps(backup.data)])
+        backup.save(update_fields=['manifest', 'size_bytes', 'stored_bytes'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_direct_room'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbackup',
+            name='manifest',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='userbackup',
+            name='stored_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='userbackup',
+            name='size_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(move_payloads, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='userbackup',
+            name='data',
+        ),
+    ]
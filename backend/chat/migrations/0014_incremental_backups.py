@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_high_water_marks(apps, schema_editor):
+    """Existing backups are full snapshots taken when they were created."""
+    UserBackup = apps.get_model('chat', 'UserBackup')
+    UserBackup.objects.update(high_water_mark=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_backup_chunks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbackup',
+            name='base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='increments', to='chat.userbackup'),
+        ),
+        migrations.AddField(
+            model_name='userbackup',
+            name='high_water_mark',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='userbackup',
+            name='kind',
+            field=models.CharField(choices=[('full', 'Full'), ('incremental', 'Incremental')], default='full', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='userbackup',
+            name='sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(set_high_water_marks, migrations.RunPython.noop),
+    ]
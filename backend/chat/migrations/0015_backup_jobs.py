@@ -0,0 +1,38 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:50
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_incremental_backups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('backup', 'Backup'), ('restore_backup', 'Restore Backup'), ('restore_upload', 'Restore Upload')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('params', models.JSONField(default=dict)),
+                ('upload', models.JSONField(default=dict)),
+                ('percent', models.PositiveSmallIntegerField(default=0)),
+                ('bytes_processed', models.BigIntegerField(default=0)),
+                ('messages_processed', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('backup', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='chat.userbackup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='backup_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
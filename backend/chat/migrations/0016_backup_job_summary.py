@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_backup_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='summary',
+            field=models.JSONField(default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_backup_job_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
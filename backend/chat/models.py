@@ -1,6 +1,7 @@
 # backend/chat/models.py
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils import timezone
 import uuid
 
@@ -25,8 +26,32 @@ class User(AbstractUser):
     typing_status = models.JSONField(default=dict)
     device_tokens = models.JSONField(default=list)
     
+    # Access tokens issued before this are rejected (set on password change)
+    tokens_valid_after = models.DateTimeField(null=True, blank=True)
+    
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Prefix range scans for user search (chat.user_search)
+            models.Index(Lower('username'), name='chat_user_username_lower_idx'),
+            models.Index(fields=['phone_number'], name='chat_user_phone_idx'),
+        ]
+    
     def __str__(self):
         return self.username
+    
+    def refresh_from_db(self, using=None, fields=None):
+        # Principals from chat.auth only carry a few fields; the first access to
+        # any other field loads all of them in one query instead of one each.
+        if fields is not None and self.__dict__.pop('_load_deferred_together', False):
+            fields = set(fields) | self.get_deferred_fields()
+        super().refresh_from_db(using=using, fields=fields)
+
+class UserSearchTrigram(models.Model):
+    user = models.ForeignKey(User, related_name='search_trigrams', on_delete=models.CASCADE)
+    trigram = models.CharField(max_length=3)
+    
+    class Meta:
+        unique_together = ['trigram', 'user']
 
 class ChatRoom(models.Model):
     ROOM_TYPES = [('direct', 'Direct'), ('group', 'Group')]
@@ -42,6 +67,8 @@ class ChatRoom(models.Model):
     max_members = models.IntegerField(default=100)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized pointer to the newest non-deleted message, used for room previews
+    last_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
     
     def __str__(self):
         return self.name or f"Room {self.id}"
@@ -54,11 +81,30 @@ class RoomMembership(models.Model):
     role = models.CharField(max_length=10, choices=ROLES, default='member')
     joined_at = models.DateTimeField(auto_now_add=True)
     is_muted = models.BooleanField(default=False)
+    # Read watermark: everything up to last_read_timestamp has been read (see chat.read_state)
     last_read_message = models.ForeignKey('Message', null=True, blank=True, on_delete=models.SET_NULL)
+    last_read_timestamp = models.DateTimeField(null=True, blank=True)
+    last_read_at = models.DateTimeField(null=True, blank=True)
     is_archived = models.BooleanField(default=False)
+    unread_count = models.PositiveIntegerField(default=0)
     
     class Meta:
         unique_together = ['user', 'room']
+        indexes = [
+            models.Index(fields=['room', 'last_read_timestamp']),
+        ]
+
+class DirectRoom(models.Model):
+    """The one direct room of a pair of users, keyed by their ids in ascending order (see ``chat/direct_rooms.py``)."""
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    room = models.OneToOneField(ChatRoom, on_delete=models.CASCADE, related_name='direct_pair')
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='chat_directroom_pair_unique'),
+            models.CheckConstraint(check=models.Q(user_low__lt=models.F('user_high')), name='chat_directroom_pair_ordered'),
+        ]
 
 class Message(models.Model):
     MESSAGE_TYPES = [
@@ -87,9 +133,6 @@ class Message(models.Model):
     edited_at = models.DateTimeField(null=True, blank=True)
     deleted_at = models.DateTimeField(null=True, blank=True)
     
-    # Reactions
-    reactions = models.JSONField(default=dict)
-    
     class Meta:
         ordering = ['timestamp']
         indexes = [
@@ -100,13 +143,24 @@ class Message(models.Model):
     def __str__(self):
         return f"{self.sender} in {self.room}: {self.content[:20]}"
 
-class MessageRead(models.Model):
-    message = models.ForeignKey(Message, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    read_at = models.DateTimeField(auto_now_add=True)
+class MessageReaction(models.Model):
+    """One user's reaction to a message; see ``chat/reactions.py``."""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reaction_set')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reactions')
+    emoji = models.CharField(max_length=32)
+    created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
-        unique_together = ['message', 'user']
+        unique_together = ['message', 'user', 'emoji']
+
+class MessageReactionCount(models.Model):
+    """How many users reacted to a message with an emoji, kept in step with ``MessageReaction``."""
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='reaction_counts')
+    emoji = models.CharField(max_length=32)
+    count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['message', 'emoji']
 
 class UserBlock(models.Model):
     blocker = models.ForeignKey(User, related_name='blocked_users', on_delete=models.CASCADE)
@@ -220,12 +274,48 @@ class Media(models.Model):
 class UserBackup(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(User, related_name='backups', on_delete=models.CASCADE)
-    data = models.JSONField()
+    # Chunks of the payload in the backups storage (see chat.backup_storage)
+    manifest = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
-    size_bytes = models.IntegerField(default=0) # Helpful for UI
+    size_bytes = models.BigIntegerField(default=0) # Helpful for UI
+    stored_bytes = models.BigIntegerField(default=0)
+    # Incremental backups hold the changes since their base (see chat.backup_chain)
+    kind = models.CharField(max_length=12, choices=[('full', 'Full'), ('incremental', 'Incremental')], default='full')
+    base = models.ForeignKey('self', null=True, blank=True, on_delete=models.RESTRICT, related_name='increments')
+    sequence = models.PositiveIntegerField(default=0)
+    high_water_mark = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
         
     def __str__(self):
-        return f"Backup for {self.user.username} at {self.created_at}"
\ No newline at end of file
+        return f"Backup for {self.user.username} at {self.created_at}"
+
+class BackupJob(models.Model):
+    """A backup or restore run in the background (see chat.backup_jobs), polled by the client."""
+    KINDS = [('backup', 'Backup'), ('restore_backup', 'Restore Backup'), ('restore_upload', 'Restore Upload')]
+    STATUSES = [('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, related_name='backup_jobs', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending')
+    params = models.JSONField(default=dict)
+    # The backup written or restored
+    backup = models.ForeignKey(UserBackup, null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+    # Chunks of an uploaded payload waiting to be restored (see chat.backup_storage)
+    upload = models.JSONField(default=dict)
+    percent = models.PositiveSmallIntegerField(default=0)
+    bytes_processed = models.BigIntegerField(default=0)
+    messages_processed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Restores: rows inserted, updated and skipped per section (see chat.restore)
+    summary = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Last sign of life of the worker running the job; see chat.backup_jobs.LEASE_TIMEOUT
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
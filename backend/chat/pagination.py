@@ -0,0 +1,123 @@
+# backend/chat/pagination.py
+import base64
+import datetime
+import json
+import uuid
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _cursor_value(value):
+    # Full microsecond precision; DjangoJSONEncoder would round to milliseconds
+    # and make the keyset comparison skip or repeat rows.
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Unsupported cursor value: {value!r}')
+
+
+def encode_cursor(*values):
+    """Pack the ordering key of a row into an opaque, URL-safe token."""
+    raw = json.dumps(list(values), default=_cursor_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, size=2):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor('Invalid cursor')
+    return values
+
+
+def decode_timestamp_cursor(token):
+    """Decode a ``(datetime, id)`` cursor produced by ``encode_cursor``."""
+    value, pk = decode_cursor(token)
+    try:
+        timestamp = parse_datetime(value) if isinstance(value, str) else None
+        pk = uuid.UUID(pk) if isinstance(pk, str) else None
+    except ValueError:
+        raise InvalidCursor('Invalid cursor')
+    if timestamp is None or pk is None:
+        raise InvalidCursor('Invalid cursor')
+    return timestamp, pk
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        size = int(value) if value not in (None, '') else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, maximum))
+
+
+def keyset_filter(field, value, pk, descending):
+    """
+    Rows strictly after ``(value, pk)`` in ``(field, id)`` order.
+    The id tie-breaker keeps pages stable when several rows share a timestamp.
+    """
+    op = 'lt' if descending else 'gt'
+    return Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk})
+
+
+def keyset_slice(queryset, field, limit, cursor=None, descending=False):
+    """
+    Fetch one page of ``queryset`` ordered by ``(field, id)``.
+
+    Reads ``limit + 1`` rows so the caller learns whether another page exists
+    without a COUNT(*). Returns ``(rows, has_more)``.
+    """
+    if cursor is not None:
+        queryset = queryset.filter(keyset_filter(field, cursor[0], cursor[1], descending))
+    prefix = '-' if descending else ''
+    rows = list(queryset.order_by(f'{prefix}{field}', f'{prefix}id')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def paginate_messages(queryset, limit, before=None, after=None, around=None):
+    """
+    Keyset pagination over a room's history using the (room, timestamp) index.
+
+    ``before``/``after`` are decoded ``(timestamp, id)`` cursors and ``around``
+    is an anchor ``Message``. The page is always returned oldest-first together
+    with cursors for the neighbouring pages (``None`` when there are none).
+    """
+    if around is not None:
+        older, has_older = keyset_slice(
+            queryset, 'timestamp', limit // 2,
+            cursor=(around.timestamp, around.id), descending=True,
+        )
+        newer, has_newer = keyset_slice(
+            queryset.filter(
+                Q(id=around.id) | keyset_filter('timestamp', around.timestamp, around.id, descending=False)
+            ),
+            'timestamp', limit - limit // 2,
+        )
+        messages = older[::-1] + newer
+    elif after is not None:
+        messages, has_newer = keyset_slice(queryset, 'timestamp', limit, cursor=after)
+        has_older = True
+    else:
+        older, has_older = keyset_slice(queryset, 'timestamp', limit, cursor=before, descending=True)
+        messages = older[::-1]
+        has_newer = before is not None
+
+    if not messages:
+        return messages, None, None
+
+    first, last = messages[0], messages[-1]
+    before_cursor = encode_cursor(first.timestamp, first.id) if has_older else None
+    after_cursor = encode_cursor(last.timestamp, last.id) if has_newer else None
+    return messages, before_cursor, after_cursor
@@ -0,0 +1,182 @@
+# backend/chat/presence.py
+"""
+Who is online, kept in Redis rather than on ``User`` rows.
+
+Every open socket (Channels or Socket.IO, on any worker) is a member of the
+``presence:sockets:<user_id>`` sorted set, scored by when it expires; a user
+is online while that set holds an unexpired socket. Sockets call
+``heartbeat`` every ``HEARTBEAT_INTERVAL`` seconds, so one whose worker died
+without disconnecting it drops out after ``CONNECTION_TTL``.
+``connect``/``disconnect`` report the 0 -> 1 and 1 -> 0 transitions so
+callers only announce real changes.
+
+``last_seen`` is written to Redis (``presence:last_seen:<user_id>``, kept
+for ``LAST_SEEN_TTL`` seconds) and flushed to ``User.last_seen`` (with
+``online_status``) in bulk, at most every ``FLUSH_INTERVAL`` seconds by
+whichever worker gets there first, or by ``manage.py flush_presence``. Once
+a user's key has expired the database value is the one that counts.
+"""
+import logging
+import time
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import emitter
+from .models import RoomMembership, User
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'PRESENCE', {})
+
+FLUSH_INTERVAL = _config.get('FLUSH_INTERVAL', 30)
+# A socket not heard from for CONNECTION_TTL seconds counts as gone
+CONNECTION_TTL = _config.get('CONNECTION_TTL', 90)
+HEARTBEAT_INTERVAL = _config.get('HEARTBEAT_INTERVAL', 30)
+# Long past the flush that wrote it to the database
+LAST_SEEN_TTL = _config.get('LAST_SEEN_TTL', 24 * 60 * 60)
+FLUSH_BATCH_SIZE = 500
+MAX_BATCH = 200
+
+DIRTY_KEY = 'presence:dirty'
+FLUSH_LOCK_KEY = 'presence:flush_lock'
+
+def _conns_key(user_id):
+    return f'presence:sockets:{user_id}'
+
+
+def _last_seen_key(user_id):
+    return f'presence:last_seen:{user_id}'
+
+
+def _record_last_seen(pipe, user_id, when):
+    pipe.set(_last_seen_key(user_id), when.isoformat(), ex=LAST_SEEN_TTL)
+    pipe.sadd(DIRTY_KEY, user_id)
+
+
+def connect(user_id, connection_id):
+    """Register a socket. ``True`` when this made the user go online."""
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zremrangebyscore(_conns_key(user_id), '-inf', now)
+        pipe.zadd(_conns_key(user_id), {connection_id: now + CONNECTION_TTL})
+        pipe.zcard(_conns_key(user_id))
+        pipe.expire(_conns_key(user_id), CONNECTION_TTL)
+        _record_last_seen(pipe, user_id, timezone.now())
+        added, count = pipe.execute()[1:3]
+    except redis.RedisError:
+        logger.exception('Presence connect failed for user %s', user_id)
+        return False
+    maybe_flush()
+    return bool(added) and count == 1
+
+
+def heartbeat(user_id, connection_id):
+    """
+    Keep a socket registered for another ``CONNECTION_TTL`` seconds. ``True``
+    when it had already expired and this made the user go online again.
+    """
+    return connect(user_id, connection_id)
+
+
+def disconnect(user_id, connection_id):
+    """Unregister a socket. ``True`` when this was the user's last one."""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.zrem(_conns_key(user_id), connection_id)
+        pipe.zremrangebyscore(_conns_key(user_id), '-inf', time.time())
+        pipe.zcard(_conns_key(user_id))
+        _record_last_seen(pipe, user_id, timezone.now())
+        removed, _, count = pipe.execute()[:3]
+    except redis.RedisError:
+        logger.exception('Presence disconnect failed for user %s', user_id)
+        return False
+    maybe_flush()
+    return bool(removed) and count == 0
+
+
+def touch(user_id):
+    """Note activity that isn't a socket (login, logout)."""
+    when = timezone.now()
+    try:
+        pipe = get_redis().pipeline()
+        _record_last_seen(pipe, user_id, when)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Presence touch failed for user %s', user_id)
+        User.objects.filter(id=user_id).update(last_seen=when)
+        return
+    maybe_flush()
+
+
+def announce(user_id, username, status):
+    """Tell every room of the user, on both transports, that they went online/offline."""
+    payload = {'user_id': user_id, 'username': username, 'status': status}
+    room_ids = [str(room_id) for room_id in RoomMembership.objects.filter(user_id=user_id).values_list('room_id', flat=True)]
+
+    async def send_to_groups():
+        layer = get_channel_layer()
+        for room_id in room_ids:
+            await layer.group_send(f'chat_{room_id}', {'type': 'user_status', **payload})
+
+    try:
+        async_to_sync(send_to_groups)()
+    except Exception:
+        logger.exception('Presence announcement to Channels failed for user %s', user_id)
+    for room_id in room_ids:
+        emitter.emit('user_status', payload, room=room_id)
+
+
+def get_presence(user_ids):
+    """``{user_id: (online, last_seen)}`` in one Redis round trip; ``last_seen`` is ``None`` if never recorded."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    now = time.time()
+    pipe = get_redis().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zcount(_conns_key(user_id), f'({now}', '+inf')
+    pipe.mget([_last_seen_key(user_id) for user_id in user_ids])
+    *counts, last_seen = pipe.execute()
+    return {
+        user_id: (count > 0, parse_datetime(seen) if seen else None)
+        for user_id, count, seen in zip(user_ids, counts, last_seen)
+    }
+
+
+def maybe_flush():
+    """Flush if no worker has done so in the last ``FLUSH_INTERVAL`` seconds."""
+    try:
+        if get_redis().set(FLUSH_LOCK_KEY, 1, nx=True, ex=FLUSH_INTERVAL):
+            flush()
+    except redis.RedisError:
+        logger.exception('Presence flush failed')
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """Write pending ``last_seen``/``online_status`` changes with bulk UPDATEs."""
+    client = get_redis()
+    flushed = 0
+    while True:
+        user_ids = client.spop(DIRTY_KEY, batch_size)
+        if not user_ids:
+            return flushed
+        presence = get_presence(user_ids)
+        users = list(User.objects.filter(id__in=user_ids).only('id', 'last_seen'))
+        for user in users:
+            online, seen = presence[str(user.id)]
+            # An expired key (flushes stalled for LAST_SEEN_TTL) keeps the stored value
+            user.online_status, user.last_seen = online, seen or user.last_seen
+        try:
+            User.objects.bulk_update(users, ['online_status', 'last_seen'])
+        except Exception:
+            # Keep them pending for the next flush
+            client.sadd(DIRTY_KEY, *user_ids)
+            raise
+        flushed += len(users)
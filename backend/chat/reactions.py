@@ -0,0 +1,169 @@
+# backend/chat/reactions.py
+"""
+Message reactions: a ``MessageReaction`` row per (message, user, emoji) and
+a ``MessageReactionCount`` per (message, emoji) kept in step with it, so
+toggling touches two small indexed rows and never the message itself, and
+a list of messages gets its summaries from the counts in one query.
+
+Clients see ``{emoji: count}`` plus the emojis they reacted with themselves.
+Changes are pushed to the room as ``reactions`` events carrying the new
+counts; toggles on the same message within ``PUSH_WINDOW`` seconds are sent
+as one event.
+
+Reactions deleted along with their user are taken out of the counts by
+``remove_user`` (see ``signals.py``); ``rebuild_counts`` recomputes them from
+the reaction rows (``manage.py rebuild_reaction_counts``).
+"""
+import json
+import logging
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from . import emitter
+from .models import MessageReaction, MessageReactionCount
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'REACTIONS', {})
+
+PUSH_WINDOW = _config.get('PUSH_WINDOW', 0.25)
+MAX_EMOJI_LENGTH = MessageReaction._meta.get_field('emoji').max_length
+
+
+@transaction.atomic
+def toggle(message, user, emoji):
+    """Add ``user``'s ``emoji`` reaction, or remove it if present. ``True`` when added."""
+    deleted, _ = MessageReaction.objects.filter(message=message, user=user, emoji=emoji).delete()
+    if deleted:
+        MessageReactionCount.objects.filter(message=message, emoji=emoji).update(count=F('count') - 1)
+        added = False
+    else:
+        _, added = MessageReaction.objects.get_or_create(message=message, user=user, emoji=emoji)
+        if added:
+            MessageReactionCount.objects.get_or_create(message=message, emoji=emoji)
+            MessageReactionCount.objects.filter(message=message, emoji=emoji).update(count=F('count') + 1)
+    schedule_push(message)
+    return added
+
+
+def remove_user(user):
+    """Take ``user``'s reactions out of the counts, before the rows are deleted with the user. One UPDATE."""
+    return MessageReactionCount.objects.filter(
+        Exists(MessageReaction.objects.filter(user=user, message_id=OuterRef('message_id'), emoji=OuterRef('emoji'))),
+        count__gt=0,
+    ).update(count=F('count') - 1)
+
+
+def rebuild_counts(counts):
+    """Recompute the ``counts`` queryset of ``MessageReactionCount`` rows from the reactions; returns the rows updated."""
+    reactions = MessageReaction.objects.filter(
+        message_id=OuterRef('message_id'), emoji=OuterRef('emoji')
+    ).order_by().values('message_id', 'emoji').annotate(total=Count('id')).values('total')
+    return counts.update(count=Coalesce(Subquery(reactions), Value(0)))
+
+
+def create_missing_counts(batch_size=1000):
+    """Add the count rows missing for existing reactions (filled in by ``rebuild_counts``)."""
+    missing = MessageReaction.objects.filter(
+        ~Exists(MessageReactionCount.objects.filter(message_id=OuterRef('message_id'), emoji=OuterRef('emoji')))
+    ).order_by().values_list('message_id', 'emoji').distinct()
+    created = 0
+    rows = []
+    for message_id, emoji in missing.iterator(chunk_size=batch_size):
+        rows.append(MessageReactionCount(message_id=message_id, emoji=emoji))
+        if len(rows) == batch_size:
+            created += len(MessageReactionCount.objects.bulk_create(rows, ignore_conflicts=True))
+            rows = []
+    if rows:
+        created += len(MessageReactionCount.objects.bulk_create(rows, ignore_conflicts=True))
+    return created
+
+
+def summaries(message_ids, user=None):
+    """``{message_id: ({emoji: count}, [emoji user reacted with])}`` for ``message_ids``, in one query."""
+    rows = MessageReactionCount.objects.filter(message_id__in=message_ids, count__gt=0).order_by('id')
+    if user is not None and user.is_authenticated:
+        rows = rows.annotate(mine=Exists(MessageReaction.objects.filter(
+            message_id=OuterRef('message_id'), emoji=OuterRef('emoji'), user=user
+        )))
+        rows = rows.values_list('message_id', 'emoji', 'count', 'mine')
+    else:
+        rows = [(message_id, emoji, count, False) for message_id, emoji, count in rows.values_list('message_id', 'emoji', 'count')]
+
+    result = {message_id: ({}, []) for message_id in message_ids}
+    for message_id, emoji, count, mine in rows:
+        counts, own = result[message_id]
+        counts[emoji] = count
+        if mine:
+            own.append(emoji)
+    return result
+
+
+def summary(message, user=None):
+    return summaries([message.id], user)[message.id]
+
+
+class _Pusher:
+    """Collects changed messages for ``PUSH_WINDOW`` seconds, then sends each one's counts once."""
+
+    def __init__(self, window):
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.timer = None
+
+    def add(self, message_id, room_id):
+        with self.lock:
+            self.pending[message_id] = room_id
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.timer = None
+        if not pending:
+            return
+        try:
+            counts = summaries(list(pending))
+            _push([
+                {'message_id': str(message_id), 'room_id': str(room_id), 'reactions': counts[message_id][0]}
+                for message_id, room_id in pending.items()
+            ])
+        except Exception:
+            logger.exception('Pushing reactions of %d message(s) failed', len(pending))
+        finally:
+            close_old_connections()
+
+
+def _push(updates):
+    async def send_to_groups():
+        layer = get_channel_layer()
+        for update in updates:
+            await layer.group_send(f'chat_{update["room_id"]}', {
+                'type': 'reaction_update',
+                'text': json.dumps({'type': 'reactions', **update}),
+            })
+
+    try:
+        async_to_sync(send_to_groups)()
+    except Exception:
+        logger.exception('Reaction push to Channels failed')
+    for update in updates:
+        emitter.emit('reactions', update, room=update['room_id'])
+
+
+_pusher = _Pusher(PUSH_WINDOW)
+
+
+def schedule_push(message):
+    """Push ``message``'s reaction counts to its room once the transaction commits."""
+    transaction.on_commit(lambda: _pusher.add(message.id, message.room_id))
@@ -0,0 +1,208 @@
+# backend/chat/read_state.py
+"""
+Read state is a monotonic per-member watermark on ``RoomMembership``:
+``last_read_message``/``last_read_timestamp`` mark how far the member has
+read and ``last_read_at`` when they got there. A message is read by every
+member whose watermark is at or past its timestamp. ``unread_count`` is a
+denormalized counter kept in step with the watermark.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
+
+from . import room_activity
+from .models import ChatRoom, Message, RoomMembership
+
+# Stand-in watermark for members that have never read anything
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _behind(timestamp):
+    """Memberships whose watermark is strictly before ``timestamp``."""
+    return Q(last_read_timestamp__isnull=True) | Q(last_read_timestamp__lt=timestamp)
+
+
+def _unread_count():
+    """Correlated count of other members' visible messages past a membership's watermark."""
+    unread = Message.objects.filter(
+        room=OuterRef('room'),
+        deleted_at__isnull=True,
+        timestamp__gt=Coalesce(OuterRef('last_read_timestamp'), Value(_EPOCH))
+    ).exclude(
+        sender=OuterRef('user')
+    ).order_by().values('room').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(unread), Value(0))
+
+
+def _advance(memberships, message):
+    """Move the watermark of ``memberships`` up to ``message``; never backwards."""
+    return memberships.filter(_behind(message.timestamp)).update(
+        last_read_message=message,
+        last_read_timestamp=message.timestamp,
+        last_read_at=timezone.now()
+    )
+
+
+@transaction.atomic
+def record_new_message(message):
+    """
+    Bump the unread counter of every member except the sender, and move the
+    sender's own watermark to the message they just wrote.
+    """
+    RoomMembership.objects.filter(
+        room_id=message.room_id
+    ).exclude(
+        user_id=message.sender_id
+    ).update(unread_count=F('unread_count') + 1)
+
+    _advance(RoomMembership.objects.filter(room_id=message.room_id, user_id=message.sender_id), message)
+
+
+def record_deleted_message(message):
+    """Recount the members that still counted ``message`` (soft deleted) as unread."""
+    return RoomMembership.objects.filter(
+        _behind(message.timestamp), room_id=message.room_id
+    ).exclude(
+        user_id=message.sender_id
+    ).update(unread_count=_unread_count())
+
+
+@transaction.atomic
+def mark_room_read(room, user):
+    """
+    Advance ``user``'s watermark to the room's last message. A constant number
+    of queries regardless of how much was unread; returns the previous count.
+    """
+    membership = RoomMembership.objects.filter(room=room, user=user)
+    unread = membership.values_list('unread_count', flat=True).first() or 0
+
+    room_activity.apply_pending([room])
+    if room.last_message_id:
+        _advance(membership, room.last_message)
+    # Recount rather than zero so a message racing in after last_message was read stays unread
+    membership.update(unread_count=_unread_count())
+    return unread
+
+
+@transaction.atomic
+def mark_message_read(message, user):
+    """Read receipt for a single message: advance the watermark up to it."""
+    membership = RoomMembership.objects.filter(room_id=message.room_id, user=user)
+    advanced = _advance(membership, message)
+    if advanced:
+        membership.update(unread_count=_unread_count())
+    return bool(advanced)
+
+
+@transaction.atomic
+def mark_all_rooms_read(user):
+    """Advance every watermark of ``user`` to the last message of its room."""
+    room_activity.sync(RoomMembership.objects.filter(user=user).values_list('room_id', flat=True))
+    room = ChatRoom.objects.filter(id=OuterRef('room_id'))
+    memberships = RoomMembership.objects.filter(
+        user=user, room__last_message__isnull=False
+    ).filter(
+        Q(last_read_timestamp__isnull=True) | Q(last_read_timestamp__lt=F('room__last_message__timestamp'))
+    )
+    advanced = memberships.update(
+        last_read_message=Subquery(room.values('last_message_id')),
+        last_read_timestamp=Subquery(room.values('last_message__timestamp')),
+        last_read_at=timezone.now()
+    )
+    RoomMembership.objects.filter(user=user, unread_count__gt=0).update(unread_count=_unread_count())
+    return advanced
+
+
+def readers_of(message):
+    """Memberships (with users) whose watermark has reached ``message``."""
+    return RoomMembership.objects.filter(
+        room_id=message.room_id, last_read_timestamp__gte=message.timestamp
+    ).exclude(
+        user_id=message.sender_id
+    ).select_related('user')
+
+
+def readers_by_message(messages):
+    """
+    Resolve ``readers_of`` for a whole batch of messages in one query:
+    ``{message_id: [membership, ...]}`` with readers in the order they read.
+    """
+    oldest = {}
+    for message in messages:
+        if message.room_id not in oldest or message.timestamp < oldest[message.room_id]:
+            oldest[message.room_id] = message.timestamp
+    if not oldest:
+        return {}
+
+    # Only members whose watermark reaches the oldest message of the batch can appear
+    reached = Q()
+    for room_id, timestamp in oldest.items():
+        reached |= Q(room_id=room_id, last_read_timestamp__gte=timestamp)
+    by_room = defaultdict(list)
+    for membership in RoomMembership.objects.filter(reached).select_related('user').order_by('last_read_at', 'id'):
+        by_room[membership.room_id].append(membership)
+
+    return {
+        message.id: [
+            membership for membership in by_room[message.room_id]
+            if membership.last_read_timestamp >= message.timestamp and membership.user_id != message.sender_id
+        ]
+        for message in messages
+    }
+
+
+def reader_counts(messages):
+    """``{message_id: number of readers}`` for a batch of messages, counted in one query."""
+    readers = RoomMembership.objects.filter(
+        room=OuterRef('room'), last_read_timestamp__gte=OuterRef('timestamp')
+    ).exclude(
+        user=OuterRef('sender')
+    ).order_by().values('room').annotate(total=Count('id')).values('total')
+    return dict(
+        Message.objects.filter(id__in=[message.id for message in messages]).annotate(
+            read_count=Coalesce(Subquery(readers), Value(0))
+        ).values_list('id', 'read_count')
+    )
+
+
+def first_readers_by_message(messages, limit):
+    """
+    ``readers_by_message`` cut to the first ``limit`` readers of each message,
+    ranked in the database (one query) so the other readers are never loaded.
+    """
+    if not messages:
+        return {}
+    rank = Window(RowNumber(), partition_by=F('room__messages__id'), order_by=(F('last_read_at').asc(), F('id').asc()))
+    # One filter() call, so every condition is on the same join of the room's messages
+    ranked = RoomMembership.objects.filter(
+        ~Q(user_id=F('room__messages__sender_id')),
+        room__messages__id__in=[message.id for message in messages],
+        last_read_timestamp__gte=F('room__messages__timestamp'),
+    ).annotate(
+        message_id=F('room__messages__id'), rank=rank
+    ).filter(rank__lte=limit).select_related('user').order_by('rank')
+    readers = {message.id: [] for message in messages}
+    for membership in ranked:
+        readers[membership.message_id].append(membership)
+    return readers
+
+
+def unread_counts(user):
+    """``{room_id: unread_count}`` for every room of ``user``, read off the (user, room) index."""
+    return dict(
+        RoomMembership.objects.filter(user=user).values_list('room_id', 'unread_count')
+    )
+
+
+def rebuild_unread_counts(memberships=None):
+    """
+    Recompute the denormalized counters from the watermarks.
+    Runs as a single correlated UPDATE over ``memberships`` (all by default).
+    """
+    if memberships is None:
+        memberships = RoomMembership.objects.all()
+    return memberships.update(unread_count=_unread_count())
@@ -0,0 +1,20 @@
+# backend/chat/redis_client.py
+import threading
+
+import redis
+from django.conf import settings
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_redis():
+    """Process-wide client for ``settings.REDIS_URL`` (pooled connections, str responses)."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = redis.Redis.from_url(
+                    settings.REDIS_URL, decode_responses=True, socket_connect_timeout=2, socket_timeout=2
+                )
+    return _client
@@ -0,0 +1,479 @@
+# backend/chat/restore.py
+"""
+Replaying a backup (the ``/chat/backup/`` export, ``json`` or ``ndjson``)
+into a user's account.
+
+``records`` parses a payload as its bytes arrive, one value at a time, so
+only the message being read is held in memory whatever the size of the
+upload. ``Restore`` applies the records in batches of ``BATCH_SIZE``: the
+senders and existing rows of a batch are looked up with one query each and
+the batch is written with one upsert (``bulk_create(update_conflicts=True)``)
+in its own transaction.
+
+Rows that can't be restored are skipped and counted: malformed records,
+unknown senders, rooms or messages that belong to conversations the user
+is not in (a backup is no way into someone else's chat), and messages
+already there that someone else sent (only the user's own are updated).
+With ``dry_run`` nothing is written and the summary tells what would have
+been.
+"""
+import codecs
+import datetime
+import json
+import re
+import uuid
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import read_state, room_activity, search
+from .models import ChatRoom, Contact, Message, RoomMembership, User, UserSettings
+from .serializers import UserSerializer, UserSettingsSerializer
+
+_config = getattr(settings, 'CHAT_RESTORE', {})
+
+BATCH_SIZE = _config.get('BATCH_SIZE', 1000)
+# Characters a single value (a message, a room) may take before the upload is rejected
+MAX_VALUE_SIZE = _config.get('MAX_VALUE_SIZE', 16 * 1024 * 1024)
+
+FORMATS = ('json', 'ndjson')
+RECORD_KINDS = ('profile', 'settings', 'contact', 'room', 'message')
+# Written on conflict (the user's own messages only): never ``sender``, ``room`` or ``timestamp``
+MESSAGE_FIELDS = ['content', 'message_type', 'file_url', 'file_size', 'thumbnail_url', 'edited_at', 'deleted_at']
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*[ \t\n\r]*')
+# What an unfinished literal can look like at the end of the buffer
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+class InvalidBackup(ValueError):
+    pass
+
+
+class _Reader:
+    """JSON text arriving as byte chunks, read a value at a time."""
+
+    def __init__(self, chunks, progress=None):
+        self.chunks = iter(chunks)
+        self.progress = progress
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.json = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.done = False
+
+    def _fill(self):
+        """Append the next chunk to what is left of the buffer; ``False`` at the end of the input."""
+        if self.done:
+            return False
+        data = next(self.chunks, None)
+        if data is None:
+            self.done = True
+        elif self.progress is not None:
+            self.progress(size=len(data))
+        try:
+            text = self.text.decode(data or b'', final=data is None)
+        except UnicodeDecodeError:
+            raise InvalidBackup('The backup file is not valid JSON') from None
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def _more(self):
+        """``_fill`` for a value still being read, up to ``MAX_VALUE_SIZE``."""
+        if len(self.buffer) - self.pos > MAX_VALUE_SIZE:
+            raise InvalidBackup('The backup file has a value over the size limit')
+        return self._fill()
+
+    def peek(self):
+        """The next significant character, ``''`` at the end of the input."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise InvalidBackup('The backup file is not valid JSON')
+        self.pos += 1
+        return char
+
+    def _incomplete(self, error):
+        """Whether ``error`` is the end of the buffer cutting a value short, not bad JSON."""
+        rest = self.buffer[error.pos:]
+        if error.msg.startswith('Unterminated string'):
+            return True
+        if error.msg.startswith('Invalid \\uXXXX escape'):
+            return len(rest) <= len('uXXXX')
+        # Nothing left, or the start of a number or a literal
+        return _NUMBER_TAIL.fullmatch(rest) is not None or any(literal.startswith(rest) for literal in _LITERALS)
+
+    def value(self):
+        """
+        The next value. The buffer only grows while the value is unfinished,
+        and by at most ``MAX_VALUE_SIZE`` characters.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as error:
+                if self._incomplete(error) and self._more():
+                    continue
+                raise InvalidBackup('The backup file is not valid JSON') from None
+            # A number at the end of the buffer may go on in the next chunk
+            if (
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                and _NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer) and self._more()
+            ):
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        """Step through the array that comes next; the caller reads each element."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+    def keys(self):
+        """The keys of the object that comes next; the caller reads each value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            if self.peek() != '"':
+                raise InvalidBackup('The backup file is not valid JSON')
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+
+def _room_records(reader):
+    if reader.peek() != '{':
+        reader.value()
+        return
+    room_seen, held = False, []
+    for key in reader.keys():
+        if key == 'room':
+            yield 'room', reader.value()
+            room_seen = True
+            yield from (('message', message) for message in held)
+            held = []
+        elif key == 'messages' and reader.peek() == '[':
+            for _ in reader.items():
+                message = reader.value()
+                if room_seen:
+                    yield 'message', message
+                else:
+                    held.append(message)
+        else:
+            reader.value()
+    if not room_seen:
+        yield 'room', None
+        yield from (('message', message) for message in held)
+
+
+def _document_records(reader):
+    if reader.peek() != '{':
+        raise InvalidBackup('The backup file is not a Lunr backup')
+    for key in reader.keys():
+        if key in ('profile', 'settings'):
+            yield key, reader.value()
+        elif key == 'contacts' and reader.peek() == '[':
+            for _ in reader.items():
+                yield 'contact', reader.value()
+        elif key == 'chat_rooms' and reader.peek() == '[':
+            for _ in reader.items():
+                yield from _room_records(reader)
+        else:
+            reader.value()
+    if reader.peek():
+        raise InvalidBackup('The backup file is not valid JSON')
+
+
+def _ndjson_records(reader):
+    while reader.peek():
+        record = reader.value()
+        if not isinstance(record, dict):
+            raise InvalidBackup('The backup file is not a Lunr backup')
+        if record.get('type') in RECORD_KINDS:
+            yield record['type'], record.get('data')
+
+
+def records(chunks, output='json', progress=None):
+    """
+    ``(kind, data)`` records (``RECORD_KINDS``) of the payload in byte
+    ``chunks``; messages follow the room they belong to. ``progress`` is
+    called with ``size=<bytes>`` as chunks are read. Raises
+    ``InvalidBackup`` when the payload turns out to be malformed, after
+    the records before the error.
+    """
+    reader = _Reader(chunks, progress)
+    return _ndjson_records(reader) if output == 'ndjson' else _document_records(reader)
+
+
+def _uuid(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _datetime(value):
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        return None
+    if parsed is not None and settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, datetime.timezone.utc)
+    return parsed
+
+
+def _counts():
+    return {'inserted': 0, 'updated': 0, 'skipped': 0}
+
+
+class Restore:
+    """
+    Applies the records of one payload or more (a backup chain, oldest
+    first) for ``user``. ``finish`` brings the restored rooms' previews and
+    unread counts up to date and returns ``summary``: the rows inserted,
+    updated and skipped per section (``rooms`` the user already had count as
+    updated). ``progress`` is called with ``messages=<count>`` after each batch.
+    With ``rooms``, only the rooms with those ids are restored (a chain
+    restores the rooms of its newest backup: rooms left since are skipped).
+    """
+
+    def __init__(self, user, dry_run=False, progress=None, rooms=None):
+        self.user = user
+        self.dry_run = dry_run
+        self.progress = progress
+        self.rooms = rooms
+        self.summary = {'rooms': _counts(), 'contacts': _counts(), 'messages': _counts()}
+        self.room_id = None
+        self.contacts = []
+        self.messages = []
+        self.touched = set()
+        # Dry runs: what would have been written, so later payloads see it
+        self.planned = {'rooms': set(), 'contacts': set(), 'messages': {}}
+
+    def apply(self, records):
+        for kind, data in records:
+            if kind != 'message':
+                self._flush_messages()
+            if kind != 'contact':
+                self._flush_contacts()
+            if kind == 'message':
+                self.messages.append(data)
+                if len(self.messages) >= BATCH_SIZE:
+                    self._flush_messages()
+            elif kind == 'contact':
+                self.contacts.append(data)
+                if len(self.contacts) >= BATCH_SIZE:
+                    self._flush_contacts()
+            elif kind == 'room':
+                self._room(data)
+            elif kind == 'profile':
+                self._profile(data)
+            elif kind == 'settings':
+                self._settings(data)
+        self._flush_messages()
+        self._flush_contacts()
+
+    def finish(self):
+        for room_id in self.touched:
+            room_activity.refresh_last_message(room_id)
+        if self.touched:
+            read_state.rebuild_unread_counts(RoomMembership.objects.filter(room_id__in=self.touched))
+        return self.summary
+
+    def _profile(self, data):
+        if not isinstance(data, dict) or not data:
+            return
+        serializer = UserSerializer(self.user, data=data, partial=True)
+        if serializer.is_valid() and not self.dry_run:
+            serializer.save()
+
+    def _settings(self, data):
+        if not isinstance(data, dict) or not data:
+            return
+        instance = UserSettings.objects.filter(user=self.user).first()
+        serializer = UserSettingsSerializer(instance, data=data, partial=True)
+        if serializer.is_valid() and not self.dry_run:
+            serializer.save(user=self.user)
+
+    def _room(self, data):
+        self.room_id = None
+        counts = self.summary['rooms']
+        room_id = _uuid(data.get('id')) if isinstance(data, dict) else None
+        if room_id is None or (self.rooms is not None and room_id not in self.rooms):
+            counts['skipped'] += 1
+            return
+        if room_id in self.planned['rooms'] or RoomMembership.objects.filter(user=self.user, room_id=room_id).exists():
+            counts['updated'] += 1
+        elif ChatRoom.objects.filter(id=room_id).exists():
+            counts['skipped'] += 1
+            return
+        elif self.dry_run:
+            self.planned['rooms'].add(room_id)
+            counts['inserted'] += 1
+        else:
+            room_type = data.get('room_type')
+            try:
+                with transaction.atomic():
+                    room = ChatRoom.objects.create(
+                        id=room_id,
+                        name=str(data.get('name') or '')[:100],
+                        description=str(data.get('description') or ''),
+                        room_type=room_type if room_type in dict(ChatRoom.ROOM_TYPES) else 'direct',
+                        created_by=self.user,
+                    )
+                    RoomMembership.objects.create(user=self.user, room=room, role='admin')
+            except IntegrityError:
+                counts['skipped'] += 1
+                return
+            counts['inserted'] += 1
+        self.room_id = room_id
+
+    def _flush_contacts(self):
+        batch, self.contacts = self.contacts, []
+        if not batch:
+            return
+        counts = self.summary['contacts']
+        aliases = {}
+        for data in batch:
+            contact_user = data.get('contact_user') if isinstance(data, dict) else None
+            username = contact_user.get('username') if isinstance(contact_user, dict) else None
+            alias = data.get('alias') or '' if isinstance(data, dict) else ''
+            if not isinstance(username, str) or not isinstance(alias, str) or username in aliases:
+                counts['skipped'] += 1
+                continue
+            aliases[username] = alias[:100]
+        users = dict(User.objects.filter(username__in=aliases).exclude(id=self.user.id).values_list('username', 'id'))
+        counts['skipped'] += len(aliases) - len(users)
+        if not users:
+            return
+        existing = self.planned['contacts'] | set(Contact.objects.filter(
+            user=self.user, contact_user_id__in=users.values()
+        ).values_list('contact_user_id', flat=True))
+        for user_id in users.values():
+            counts['updated' if user_id in existing else 'inserted'] += 1
+        if self.dry_run:
+            self.planned['contacts'].update(users.values())
+            return
+        Contact.objects.bulk_create(
+            [Contact(user=self.user, contact_user_id=user_id, alias=aliases[username]) for username, user_id in users.items()],
+            update_conflicts=True, unique_fields=['user', 'contact_user'], update_fields=['alias'],
+        )
+
+    def _message(self, data):
+        """An unsaved ``Message`` in the current room for ``data``, ``None`` if it is malformed."""
+        if not isinstance(data, dict):
+            return None
+        sender = data.get('sender')
+        if isinstance(sender, dict):
+            sender = sender.get('id')
+        try:
+            sender_id = int(sender or self.user.id)
+        except (TypeError, ValueError):
+            return None
+        message_id = _uuid(data.get('id'))
+        timestamp = _datetime(data.get('timestamp'))
+        edited_at = _datetime(data.get('edited_at'))
+        deleted_at = _datetime(data.get('deleted_at'))
+        message_type = data.get('message_type') or 'text'
+        file_size = data.get('file_size')
+        texts = {name: data.get(name) or '' for name in ('content', 'file_url', 'thumbnail_url')}
+        if (
+            message_id is None or timestamp is None
+            or (data.get('edited_at') and edited_at is None) or (data.get('deleted_at') and deleted_at is None)
+            or message_type not in dict(Message.MESSAGE_TYPES)
+            or not (file_size is None or isinstance(file_size, int))
+            or any(
+                not isinstance(value, str) or len(value) > (Message._meta.get_field(name).max_length or len(value))
+                for name, value in texts.items()
+            )
+        ):
+            return None
+        return Message(
+            id=message_id, room_id=self.room_id, sender_id=sender_id, message_type=message_type,
+            timestamp=timestamp, edited_at=edited_at, deleted_at=deleted_at, file_size=file_size, **texts
+        )
+
+    def _flush_messages(self):
+        batch, self.messages = self.messages, []
+        if not batch:
+            return
+        counts = self.summary['messages']
+        if self.room_id is None:
+            counts['skipped'] += len(batch)
+            self._progress(len(batch))
+            return
+
+        rows = {}
+        for data in batch:
+            message = self._message(data)
+            # Malformed, or superseded by a later version in the same batch
+            if message is None or message.id in rows:
+                counts['skipped'] += 1
+            if message is not None:
+                rows[message.id] = message
+        senders = set(User.objects.filter(
+            id__in={message.sender_id for message in rows.values()}
+        ).values_list('id', flat=True))
+        # ``(room_id, sender_id)`` of the rows already there
+        existing = {
+            message_id: (room_id, sender_id) for message_id, room_id, sender_id in
+            Message.objects.filter(id__in=rows).values_list('id', 'room_id', 'sender_id')
+        }
+        for message_id in rows.keys() & self.planned['messages'].keys():
+            existing.setdefault(message_id, self.planned['messages'][message_id])
+
+        messages = []
+        # Only the user's own messages in this room are overwritten
+        own = (self.room_id, self.user.id)
+        for message in rows.values():
+            if message.sender_id not in senders or existing.get(message.id, own) != own:
+                counts['skipped'] += 1
+                continue
+            counts['updated' if message.id in existing else 'inserted'] += 1
+            messages.append(message)
+        if messages and self.dry_run:
+            self.planned['messages'].update(
+                (message.id, existing.get(message.id, (self.room_id, message.sender_id))) for message in messages
+            )
+        elif messages:
+            self._write(messages, [message for message in messages if message.id not in existing])
+        self._progress(len(batch))
+
+    def _write(self, messages, inserted):
+        timestamps = [message.timestamp for message in inserted]
+        with transaction.atomic():
+            Message.objects.bulk_create(
+                messages, update_conflicts=True, unique_fields=['id'], update_fields=MESSAGE_FIELDS
+            )
+            # auto_now_add stamped the inserted rows (and the instances) with the current time
+            for message, timestamp in zip(inserted, timestamps):
+                message.timestamp = timestamp
+            Message.objects.bulk_update(inserted, ['timestamp'])
+            search.index_messages(messages)
+        self.touched.add(self.room_id)
+
+    def _progress(self, count):
+        if self.progress is not None:
+            self.progress(messages=count)
@@ -0,0 +1,174 @@
+# backend/chat/room_activity.py
+"""
+The room list's ``ChatRoom.updated_at``/``last_message``.
+
+New messages don't write their room row: ``bump`` records the activity in
+the ``room_activity:pending`` sorted set (room id -> time of the newest
+message) and the rows are brought up to date in bulk UPDATEs, at most every
+``FLUSH_INTERVAL`` seconds by whichever worker gets there first (the
+``flush_room_activity`` task, on Celery beat, when no new message comes
+along), or by ``manage.py flush_room_activity``. Busy rooms thus take one row write per
+interval instead of one per message.
+
+Until then readers merge the pending bumps: ``apply_pending`` patches
+``updated_at`` and ``last_message`` on loaded rooms, and ``sync`` writes the
+bumps of some rooms right away for queries that read the rows themselves.
+Without Redis, ``bump`` falls back to updating the row.
+"""
+import datetime
+import logging
+
+import redis
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Greatest
+
+from .models import ChatRoom, Message
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+_config = getattr(settings, 'ROOM_ACTIVITY', {})
+
+FLUSH_INTERVAL = _config.get('FLUSH_INTERVAL', 2)
+FLUSH_BATCH_SIZE = 500
+
+PENDING_KEY = 'room_activity:pending'
+# Bumps being written by a flush; still pending for readers until it's done
+FLUSHING_KEY = 'room_activity:flushing'
+FLUSH_LOCK_KEY = 'room_activity:flush_lock'
+
+
+def _as_datetime(score):
+    return datetime.datetime.fromtimestamp(score, tz=datetime.timezone.utc)
+
+
+def _latest_message():
+    return Message.objects.filter(
+        room=OuterRef('pk'), deleted_at__isnull=True
+    ).order_by('-timestamp', '-id').values('id')[:1]
+
+
+def set_last_message(message):
+    """Point the room preview at ``message`` (a freshly created message)."""
+    ChatRoom.objects.filter(id=message.room_id).update(last_message=message)
+
+
+def refresh_last_message(room_id):
+    """
+    Re-point the room preview at its newest visible message.
+    Needed when the current last message is soft deleted or history is restored.
+    """
+    last_message = Message.objects.filter(
+        room_id=room_id, deleted_at__isnull=True
+    ).order_by('-timestamp', '-id').values_list('id', flat=True).first()
+    ChatRoom.objects.filter(id=room_id).update(last_message_id=last_message)
+    return last_message
+
+
+def bump(message):
+    """Make ``message`` (freshly created) its room's latest activity, once the transaction commits."""
+    def record():
+        try:
+            get_redis().zadd(PENDING_KEY, {str(message.room_id): message.timestamp.timestamp()}, gt=True)
+        except redis.RedisError:
+            logger.exception('Room activity bump failed for room %s', message.room_id)
+            ChatRoom.objects.filter(id=message.room_id).update(last_message=message, updated_at=message.timestamp)
+            return
+        maybe_flush()
+
+    transaction.on_commit(record)
+
+
+def pending(room_ids):
+    """``{room_id: activity time}`` of the unflushed bumps of ``room_ids``."""
+    room_ids = [str(room_id) for room_id in room_ids]
+    if not room_ids:
+        return {}
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zmscore(FLUSHING_KEY, room_ids)
+        pipe.zmscore(PENDING_KEY, room_ids)
+        flushing, scores = pipe.execute()
+    except redis.RedisError:
+        logger.exception('Could not read pending room activity')
+        return {}
+    return {
+        room_id: _as_datetime(max(score for score in pair if score is not None))
+        for room_id, *pair in zip(room_ids, flushing, scores)
+        if pair != [None, None]
+    }
+
+
+def apply_pending(rooms, bumps=None):
+    """
+    Bring loaded ``rooms`` up to date with their pending bumps: ``updated_at``
+    and ``last_message`` (with its sender). One query, only if any is behind.
+    """
+    if bumps is None:
+        bumps = pending([room.id for room in rooms])
+    behind = [room for room in rooms if str(room.id) in bumps and bumps[str(room.id)] > room.updated_at]
+    if not behind:
+        return rooms
+
+    latest = dict(
+        ChatRoom.objects.filter(id__in=[room.id for room in behind]).annotate(
+            latest_message=Subquery(_latest_message())
+        ).values_list('id', 'latest_message')
+    )
+    messages = Message.objects.select_related('sender').in_bulk(
+        [message_id for message_id in latest.values() if message_id]
+    )
+    for room in behind:
+        room.updated_at = bumps[str(room.id)]
+        message = messages.get(latest.get(room.id))
+        if message is not None:
+            room.last_message = message
+    return rooms
+
+
+def _write(bumps):
+    """One UPDATE moving ``updated_at`` forward and re-pointing ``last_message`` for ``{room_id: time}``."""
+    activity = Case(
+        *[When(id=room_id, then=Value(when)) for room_id, when in bumps.items()],
+        output_field=DateTimeField(),
+    )
+    ChatRoom.objects.filter(id__in=list(bumps)).update(
+        updated_at=Greatest('updated_at', activity),
+        last_message=Subquery(_latest_message()),
+    )
+
+
+def sync(room_ids):
+    """Write the pending bumps of ``room_ids`` now (they stay queued; flushing again is harmless)."""
+    bumps = pending(room_ids)
+    if bumps:
+        _write(bumps)
+
+
+def maybe_flush():
+    """Flush if no worker has done so in the last ``FLUSH_INTERVAL`` seconds."""
+    try:
+        if get_redis().set(FLUSH_LOCK_KEY, 1, nx=True, ex=FLUSH_INTERVAL):
+            flush()
+    except redis.RedisError:
+        logger.exception('Room activity flush failed')
+
+
+def flush(batch_size=FLUSH_BATCH_SIZE):
+    """Write every pending bump in bulk UPDATEs; returns the number of rooms."""
+    client = get_redis()
+    # Bumps arriving meanwhile go to a fresh pending set. A flushing set left
+    # behind by a failed flush is written first.
+    if not client.exists(FLUSHING_KEY):
+        try:
+            client.renamenx(PENDING_KEY, FLUSHING_KEY)
+        except redis.ResponseError:
+            return 0
+
+    entries = client.zrange(FLUSHING_KEY, 0, -1, withscores=True)
+    for start in range(0, len(entries), batch_size):
+        _write({room_id: _as_datetime(score) for room_id, score in entries[start:start + batch_size]})
+    client.delete(FLUSHING_KEY)
+    return len(entries)
@@ -0,0 +1,251 @@
+# backend/chat/search.py
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from .models import Message, RoomMembership
+from .pagination import InvalidCursor, decode_cursor, decode_timestamp_cursor, encode_cursor, keyset_filter
+
+FTS_TABLE = 'chat_message_fts'
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return WORD_RE.findall(query.lower())[:16]
+
+
+class BaseSearchBackend:
+    """
+    Full-text index over ``Message.content``.
+
+    ``search`` returns ``(message_ids, next_cursor)`` for messages in rooms the
+    user belongs to (optionally a single room), best match first. Hidden
+    (soft deleted) messages are never returned.
+    """
+
+    def index_message(self, message):
+        pass
+
+    def index_messages(self, messages):
+        for message in messages:
+            self.index_message(message)
+
+    def remove_message(self, message):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+    def search(self, user, query, limit, cursor=None, room_id=None):
+        raise NotImplementedError
+
+    def decode_cursor(self, token):
+        """The ``(rank, message_id)`` of a ``next_cursor`` from ``search``; raises ``InvalidCursor``."""
+        rank, pk = decode_cursor(token)
+        if isinstance(rank, bool) or not isinstance(rank, (int, float)) or not isinstance(pk, str):
+            raise InvalidCursor('Invalid cursor')
+        try:
+            return rank, uuid.UUID(pk)
+        except ValueError:
+            raise InvalidCursor('Invalid cursor')
+
+    def _scope_sql(self, user, room_id):
+        sql = 'm.deleted_at IS NULL AND m.room_id IN (SELECT room_id FROM chat_roommembership WHERE user_id = %s)'
+        params = [user.id]
+        if room_id is not None:
+            sql += ' AND m.room_id = %s'
+            params.append(Message._meta.pk.get_db_prep_value(room_id, connection))
+        return sql, params
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """
+    FTS5 virtual table (created by migration 0008) holding ``content`` and the
+    message id. The id column is tokenized too, so edits and deletes find the
+    row through the inverted index instead of scanning the table.
+    """
+
+    def _match_id(self, message_id):
+        return f'message_id : "{message_id.hex}"'
+
+    def index_message(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self._match_id(message.id)])
+            if message.deleted_at is None:
+                cursor.execute(
+                    f'INSERT INTO {FTS_TABLE} (content, message_id) VALUES (%s, %s)',
+                    [message.content, message.id.hex]
+                )
+
+    def index_messages(self, messages):
+        """Index a batch of messages (a restore) with one delete and one insert."""
+        if not messages:
+            return
+        match = 'message_id : (' + ' OR '.join(f'"{message.id.hex}"' for message in messages) + ')'
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (content, message_id) VALUES (%s, %s)',
+                [(message.content, message.id.hex) for message in messages if message.deleted_at is None]
+            )
+
+    def remove_message(self, message):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [self._match_id(message.id)])
+
+    def rebuild(self, batch_size=1000):
+        indexed = 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            messages = Message.objects.filter(deleted_at__isnull=True).order_by('id').values_list('id', 'content')
+            last_id = None
+            while True:
+                batch = messages.filter(id__gt=last_id) if last_id else messages
+                rows = list(batch[:batch_size])
+                if not rows:
+                    break
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (content, message_id) VALUES (%s, %s)',
+                    [(content, message_id.hex) for message_id, content in rows]
+                )
+                indexed += len(rows)
+                last_id = rows[-1][0]
+        return indexed
+
+    def search(self, user, query, limit, cursor=None, room_id=None):
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+        # Quote every term so user input can't inject FTS syntax; prefix-match the last one
+        match = 'content : (' + ' '.join(f'"{term}"' for term in terms) + '*)'
+
+        scope, params = self._scope_sql(user, room_id)
+        sql = (
+            f'SELECT m.id, {FTS_TABLE}.rank FROM {FTS_TABLE} '
+            f'JOIN chat_message m ON m.id = {FTS_TABLE}.message_id '
+            f'WHERE {FTS_TABLE} MATCH %s AND {scope}'
+        )
+        params = [match] + params
+        if cursor is not None:
+            # bm25 rank: lower is better
+            sql += f' AND ({FTS_TABLE}.rank > %s OR ({FTS_TABLE}.rank = %s AND m.id > %s))'
+            params += [cursor[0], cursor[0], Message._meta.pk.get_db_prep_value(cursor[1], connection)]
+        sql += f' ORDER BY {FTS_TABLE}.rank, m.id LIMIT %s'
+        params.append(limit + 1)
+        return self._page(sql, params, limit)
+
+    def _page(self, sql, params, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = [(Message._meta.pk.to_python(pk), rank) for pk, rank in cursor.fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return [pk for pk, rank in rows], next_cursor
+
+
+class PostgresSearchBackend(SQLiteSearchBackend):
+    """
+    ``chat_message.search_vector`` is a generated ``tsvector`` column with a GIN
+    index (migration 0008); PostgreSQL keeps it current on every insert and
+    update, so there is nothing to maintain from Python.
+    """
+
+    def index_message(self, message):
+        pass
+
+    def index_messages(self, messages):
+        pass
+
+    def remove_message(self, message):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute('REINDEX INDEX chat_message_search_vector_idx')
+        return Message.objects.filter(deleted_at__isnull=True).count()
+
+    def search(self, user, query, limit, cursor=None, room_id=None):
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+        tsquery = ' & '.join(terms) + ':*'
+
+        scope, params = self._scope_sql(user, room_id)
+        rank = "ts_rank(m.search_vector, to_tsquery('simple', %s))"
+        sql = (
+            f'SELECT m.id, {rank} AS rank FROM chat_message m '
+            f"WHERE m.search_vector @@ to_tsquery('simple', %s) AND {scope}"
+        )
+        params = [tsquery, tsquery] + params
+        if cursor is not None:
+            # ts_rank: higher is better
+            sql += f' AND ({rank} < %s OR ({rank} = %s AND m.id > %s))'
+            params += [tsquery, cursor[0], tsquery, cursor[0], cursor[1]]
+        sql += ' ORDER BY rank DESC, m.id LIMIT %s'
+        params.append(limit + 1)
+        return self._page(sql, params, limit)
+
+
+class BasicSearchBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a full-text engine."""
+
+    def decode_cursor(self, token):
+        # Ranked by recency: the cursor holds a timestamp
+        return decode_timestamp_cursor(token)
+
+    def search(self, user, query, limit, cursor=None, room_id=None):
+        terms = tokenize(query)
+        if not terms:
+            return [], None
+        messages = Message.objects.filter(
+            deleted_at__isnull=True,
+            room__in=RoomMembership.objects.filter(user=user).values('room')
+        )
+        if room_id is not None:
+            messages = messages.filter(room_id=room_id)
+        for term in terms:
+            messages = messages.filter(content__icontains=term)
+        if cursor is not None:
+            messages = messages.filter(keyset_filter('timestamp', cursor[0], cursor[1], descending=True))
+
+        rows = list(messages.order_by('-timestamp', '-id').values_list('id', 'timestamp')[:limit + 1])
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+        return [pk for pk, timestamp in rows], next_cursor
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_backend():
+    """``settings.MESSAGE_SEARCH_BACKEND`` (dotted path) or the one matching the database."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'MESSAGE_SEARCH_BACKEND', None)
+        backend_class = import_string(path) if path else BACKENDS.get(connection.vendor, BasicSearchBackend)
+        _backend = backend_class()
+    return _backend
+
+
+def index_message(message):
+    get_backend().index_message(message)
+
+
+def index_messages(messages):
+    get_backend().index_messages(messages)
+
+
+def remove_message(message):
+    get_backend().remove_message(message)
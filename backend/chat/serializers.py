@@ -4,8 +4,9 @@ from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 from .models import (
     User, Message, ChatRoom, RoomMembership, UserBlock, UserReport,
-    Notification, UserSettings, Update, Tool, MessageRead, Contact, Media, UserBackup
+    Notification, UserSettings, Update, Tool, Contact, Media, UserBackup, BackupJob
 )
+from . import reactions, read_state, user_search
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -52,6 +53,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
                  instance.avatar = avatar
         
         instance.save()
+        user_search.invalidate_profile(instance)
         return instance
 
     def to_representation(self, instance):
@@ -91,6 +93,7 @@ class RegisterSerializer(serializers.ModelSerializer):
             password=validated_data['password']
         )
         UserSettings.objects.create(user=user)
+        user_search.index_user(user)
         return user
 
 class RoomMembershipSerializer(serializers.ModelSerializer):
@@ -115,53 +118,168 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         ]
     
     def get_member_count(self, obj):
+        if hasattr(obj, 'num_members'):
+            return obj.num_members
         return obj.members.count()
 
     def get_unread_count(self, obj):
+        # Views listing rooms annotate the caller's counter to avoid a query per room
+        if hasattr(obj, 'my_unread_count'):
+            return obj.my_unread_count or 0
         user = self.context.get('request').user if self.context.get('request') else None
         if user and user.is_authenticated:
-            # Count messages in this room that are NOT read by this user AND NOT sent by this user
-            return obj.messages.exclude(sender=user).exclude(messageread__user=user).count()
+            membership = RoomMembership.objects.filter(room=obj, user=user).values_list('unread_count', flat=True).first()
+            return membership or 0
         return 0
     
     def get_last_message(self, obj):
-        last_msg = obj.messages.filter(deleted_at__isnull=True).last()
-        if last_msg:
-            return MessageSerializer(last_msg).data
+        # Denormalized pointer; list views select_related it so no per-room query is needed
+        if obj.last_message_id:
+            return MessagePreviewSerializer(obj.last_message).data
         return None
 
+class InboxRoomSerializer(ChatRoomSerializer):
+    """Room list entry carrying the caller's own membership flags; members are only listed for direct rooms."""
+    is_archived = serializers.BooleanField(source='my_is_archived', read_only=True)
+    is_muted = serializers.BooleanField(source='my_is_muted', read_only=True)
+    
+    class Meta(ChatRoomSerializer.Meta):
+        fields = ChatRoomSerializer.Meta.fields + ['updated_at', 'is_archived', 'is_muted']
+
 class UserBackupSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserBackup
-        fields = ['id', 'created_at', 'size_bytes']
-        read_only_fields = ['id', 'created_at', 'size_bytes']
+        fields = ['id', 'created_at', 'size_bytes', 'kind', 'base']
+        read_only_fields = fields
+        extra_kwargs = {'base': {'pk_field': serializers.UUIDField()}}
+
+class BackupJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BackupJob
+        fields = [
+            'id', 'kind', 'status', 'params', 'backup', 'percent', 'bytes_processed',
+            'messages_processed', 'summary', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+        # Plain strings so the data can be published as is
+        extra_kwargs = {'backup': {'pk_field': serializers.UUIDField()}}
+
+def _request_user(context):
+    request = context.get('request')
+    return request.user if request is not None else None
+
+class MessageListSerializer(serializers.ListSerializer):
+    """
+    Resolves read receipts and reactions for every message of the list, a
+    query each (compact receipts: one more, counting the readers).
+    """
+    
+    def to_representation(self, data):
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        context = self.child.context
+        if context.get('receipts') == 'compact':
+            context['read_receipts'] = read_state.first_readers_by_message(messages, self.child.receipts_limit())
+            context['read_counts'] = read_state.reader_counts(messages)
+        else:
+            context['read_receipts'] = read_state.readers_by_message(messages)
+        context['reactions'] = reactions.summaries([message.id for message in messages], _request_user(context))
+        try:
+            return super().to_representation(messages)
+        finally:
+            for key in ('read_receipts', 'read_counts', 'reactions'):
+                context.pop(key, None)
 
 class MessageSerializer(serializers.ModelSerializer):
+    """
+    Pass ``receipts='compact'`` in the context to only list the first
+    ``receipts_limit`` readers; ``read_count`` always holds the total.
+    """
     sender = UserSerializer(read_only=True)
     reply_to = serializers.SerializerMethodField()
     read_by = serializers.SerializerMethodField()
+    read_count = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
+    my_reactions = serializers.SerializerMethodField()
+    
+    COMPACT_RECEIPTS_LIMIT = 3
     
     class Meta:
         model = Message
         fields = [
             'id', 'sender', 'room', 'content', 'message_type',
             'file_url', 'file_size', 'thumbnail_url', 'reply_to',
-            'timestamp', 'edited_at', 'reactions', 'read_by'
+            'timestamp', 'edited_at', 'reactions', 'my_reactions', 'read_by', 'read_count'
         ]
         read_only_fields = ['id', 'sender', 'timestamp']
+        # Plain strings rather than UUID objects so the data can be published as is
+        extra_kwargs = {'room': {'pk_field': serializers.UUIDField()}}
+        list_serializer_class = MessageListSerializer
     
     def get_reply_to(self, obj):
         if obj.reply_to:
             return {
-                'id': obj.reply_to.id,
+                'id': str(obj.reply_to.id),
                 'content': obj.reply_to.content[:50],
                 'sender': obj.reply_to.sender.username
             }
         return None
     
+    def receipts_limit(self):
+        return self.context.get('receipts_limit', self.COMPACT_RECEIPTS_LIMIT)
+    
+    def _readers(self, obj):
+        receipts = self.context.get('read_receipts')
+        if receipts is not None and obj.id in receipts:
+            return receipts[obj.id]
+        # Single message outside of a list: cache so read_count doesn't query again
+        if getattr(obj, '_readers', None) is None:
+            readers = read_state.readers_of(obj).order_by('last_read_at', 'id')
+            if self.context.get('receipts') == 'compact':
+                readers = readers[:self.receipts_limit()]
+            obj._readers = list(readers)
+        return obj._readers
+    
     def get_read_by(self, obj):
-        reads = MessageRead.objects.filter(message=obj).select_related('user')
-        return [{'id': read.user.id, 'user': read.user.username, 'read_at': read.read_at} for read in reads]
+        read_at = serializers.DateTimeField()
+        return [
+            {'id': read.user.id, 'user': read.user.username, 'read_at': read_at.to_representation(read.last_read_at)}
+            for read in self._readers(obj)
+        ]
+    
+    def get_read_count(self, obj):
+        if self.context.get('receipts') != 'compact':
+            return len(self._readers(obj))
+        counts = self.context.get('read_counts')
+        if counts is not None and obj.id in counts:
+            return counts[obj.id]
+        return read_state.readers_of(obj).count()
+    
+    def _reactions(self, obj):
+        summaries = self.context.get('reactions')
+        if summaries is not None and obj.id in summaries:
+            return summaries[obj.id]
+        if getattr(obj, '_reactions', None) is None:
+            obj._reactions = reactions.summary(obj, _request_user(self.context))
+        return obj._reactions
+    
+    def get_reactions(self, obj):
+        return self._reactions(obj)[0]
+    
+    def get_my_reactions(self, obj):
+        return self._reactions(obj)[1]
+
+class MessagePreviewSerializer(serializers.ModelSerializer):
+    """Compact message used for room list previews (no reply or read receipt lookups)."""
+    sender = UserSerializer(read_only=True)
+    
+    class Meta:
+        model = Message
+        fields = [
+            'id', 'sender', 'room', 'content', 'message_type',
+            'file_url', 'file_size', 'thumbnail_url',
+            'timestamp', 'edited_at'
+        ]
+        read_only_fields = fields
 
 class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
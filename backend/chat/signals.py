@@ -0,0 +1,36 @@
+# backend/chat/signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import auth, backup_storage, member_cache, reactions
+from .models import RoomMembership, User, UserBackup
+
+
+@receiver(post_save, sender=RoomMembership)
+@receiver(post_delete, sender=RoomMembership)
+def invalidate_membership_cache(sender, instance, **kwargs):
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'role' not in update_fields:
+        return
+    room_id = instance.room_id
+    transaction.on_commit(lambda: member_cache.invalidate(room_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_principal(sender, instance, **kwargs):
+    # Password changes, deactivation and deletion must reach cached principals
+    user_id = instance.id
+    transaction.on_commit(lambda: auth.invalidate_user(user_id))
+
+
+@receiver(pre_delete, sender=User)
+def remove_reaction_counts(sender, instance, **kwargs):
+    # The user's reactions are cascade deleted without going through toggle()
+    reactions.remove_user(instance)
+
+
+@receiver(post_delete, sender=UserBackup)
+def delete_backup_payload(sender, instance, **kwargs):
+    transaction.on_commit(lambda: backup_storage.delete(instance))
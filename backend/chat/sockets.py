@@ -1,46 +1,72 @@
+import asyncio
 import socketio
 import os
-import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from urllib.parse import parse_qs
+from . import member_cache, presence
+from .auth import authenticate_token
 
 # Use Redis as message queue for scaling and to allow emitting from views
-# In Codespaces, Redis is at 127.0.0.1:6379
-mgr = socketio.AsyncRedisManager('redis://127.0.0.1:6379/0')
+# In Codespaces, Redis is at 127.0.0.1:6379 (settings.REDIS_URL)
+mgr = socketio.AsyncRedisManager(settings.REDIS_URL)
 sio = socketio.AsyncServer(async_mode='asgi', client_manager=mgr, cors_allowed_origins='*')
+# Presence heartbeat task per connected sid
+_heartbeats = {}
 
 @sio.event
-async def connect(sid, environ):
+async def connect(sid, environ, auth=None):
     query_string = environ.get('QUERY_STRING', '')
     if isinstance(query_string, bytes):
         query_string = query_string.decode('utf-8')
     params = parse_qs(query_string)
-    token = params.get('token', [None])[0]
+    token = (auth or {}).get('token') or params.get('token', [None])[0]
     
     if not token:
         print("No token provided")
         return False  # Reject connection
 
-    try:
-        # Verify token
-        # SimpleJWT uses HS256 by default with SECRET_KEY
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-        user_id = payload.get('user_id')
-        if not user_id:
-            print("No user_id in token")
-            return False
-            
-        # Store user_id in session
-        await sio.save_session(sid, {'user_id': user_id})
-        print(f"User {user_id} connected with sid {sid}")
-    except Exception as e:
-        print(f"Token verification failed: {e}")
+    # Same cached verification as REST and the Channels consumer
+    result = await sync_to_async(authenticate_token)(token)
+    if result is None:
+        print("Token verification failed")
         return False
+    user, claims = result
+        
+    # Store user_id in session
+    await sio.save_session(sid, {'user_id': user.id, 'username': user.username})
+    # Events meant for the user rather than a room (e.g. finished backup jobs)
+    await sio.enter_room(sid, f'user_{user.id}')
+    await sync_to_async(update_presence)(user.id, user.username, sid, True)
+    _heartbeats[sid] = asyncio.create_task(send_heartbeats(user.id, user.username, sid))
+    print(f"User {user.id} connected with sid {sid}")
 
 @sio.event
 async def disconnect(sid):
+    task = _heartbeats.pop(sid, None)
+    if task is not None:
+        task.cancel()
+    session = await sio.get_session(sid)
+    if session.get('user_id'):
+        await sync_to_async(update_presence)(session['user_id'], session.get('username'), sid, False)
     print(f"Client {sid} disconnected")
 
+def update_presence(user_id, username, sid, connected):
+    # Shares the per-user socket count with ChatConsumer; only 0 <-> 1 changes are announced
+    if connected:
+        changed, status = presence.connect(user_id, f'sio:{sid}'), 'online'
+    else:
+        changed, status = presence.disconnect(user_id, f'sio:{sid}'), 'offline'
+    if changed:
+        presence.announce(user_id, username, status)
+
+async def send_heartbeats(user_id, username, sid):
+    # Keeps this socket counted; one left behind by a dead worker expires
+    while True:
+        await asyncio.sleep(presence.HEARTBEAT_INTERVAL)
+        if await sync_to_async(presence.heartbeat)(user_id, f'sio:{sid}'):
+            await sync_to_async(presence.announce)(user_id, username, 'online')
+
 @sio.event
 async def join(sid, data):
     # Handle both string and dict payload
@@ -50,6 +76,10 @@ async def join(sid, data):
         room_id = data
         
     if room_id:
+        session = await sio.get_session(sid)
+        if not await sync_to_async(member_cache.is_member)(room_id, session.get('user_id')):
+            print(f"Client {sid} is not a member of room {room_id}")
+            return
         await sio.enter_room(sid, room_id)
         print(f"Client {sid} joined room {room_id}")
 
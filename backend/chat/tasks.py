@@ -0,0 +1,26 @@
+# backend/chat/tasks.py
+from celery import shared_task
+from django.core.management import call_command
+
+from . import backup_jobs, room_activity
+
+
+@shared_task(ignore_result=True)
+def run_backup_job(job_id):
+    backup_jobs.run(job_id)
+
+
+@shared_task(ignore_result=True)
+def compact_backups():
+    call_command('compact_backups')
+
+
+@shared_task(ignore_result=True)
+def flush_presence():
+    call_command('flush_presence')
+
+
+@shared_task(ignore_result=True)
+def flush_room_activity():
+    # Through the lock: a flush some request already made this interval counts
+    room_activity.maybe_flush()
@@ -1,3 +1,1582 @@
-from django.test import TestCase
+import asyncio
+import itertools
+import json
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import redis
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    async_views, auth, backup_chain, backup_jobs, backup_storage, emitter, fanout, frame_batching, member_cache,
+    presence, reactions, read_state, redis_client, restore, room_activity, search, typing_state, user_search,
+)
+from .consumers import ChatConsumer
+from .models import (
+    User, ChatRoom, DirectRoom, RoomMembership, Message, MessageReaction, MessageReactionCount, UserBackup, BackupJob
+)
+from .pagination import decode_cursor, encode_cursor
+
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'user_search': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'user-search'},
+}
+
+
+class FakeRedisMixin:
+    """
+    Runs the test class against an in-memory Redis (fakeredis), emptied
+    before each test: every client the app opens with ``from_url``
+    (``redis_client.get_redis``, the Socket.IO emitters), with an in-memory
+    channel layer and local caches. Nothing reaches a Redis server the
+    machine may be running, and nothing a test leaves there (a cached
+    membership, a pending bump) is seen by the next.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        server = fakeredis.FakeServer()
+        cls.redis = fakeredis.FakeRedis(server=server, decode_responses=True)
+
+        def sync_client(url, decode_responses=False, **kwargs):
+            return fakeredis.FakeRedis(server=server, decode_responses=decode_responses)
+
+        def async_client(url, decode_responses=False, **kwargs):
+            return fakeredis.FakeAsyncRedis(server=server, decode_responses=decode_responses)
+
+        cls.enterClassContext(mock.patch.object(redis.Redis, 'from_url', side_effect=sync_client))
+        cls.enterClassContext(mock.patch.object(redis.asyncio.Redis, 'from_url', side_effect=async_client))
+        cls.enterClassContext(mock.patch.object(redis_client, '_client', cls.redis))
+        cls.enterClassContext(mock.patch.object(emitter, '_emitter', None))
+        cls.enterClassContext(mock.patch.object(emitter, '_async_emitters', weakref.WeakKeyDictionary()))
+        cls.enterClassContext(override_settings(
+            CACHES=LOCAL_CACHES, CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        ))
+        member_cache._local.clear()
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        self.redis.flushall()
+        caches['user_search'].clear()
+        member_cache._local.clear()
+        self.addCleanup(member_cache._local.clear)
+
+
+class InboxTests(FakeRedisMixin, TestCase):
+    ROOMS = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret-pass-1')
+        cls.other = User.objects.create_user('bob', password='secret-pass-1')
+        now = timezone.now()
+
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(
+                name=f'Room {i}',
+                room_type='direct' if i % 2 else 'group',
+                created_by=cls.user
+            )
+            for i in range(cls.ROOMS)
+        ])
+        memberships = []
+        for i, room in enumerate(rooms):
+            memberships.append(RoomMembership(user=cls.user, room=room, is_archived=i % 10 == 0, is_muted=i % 5 == 0))
+            memberships.append(RoomMembership(user=cls.other, room=room))
+        RoomMembership.objects.bulk_create(memberships)
+
+        messages = Message.objects.bulk_create([
+            Message(room=room, sender=cls.other, content=f'hello {i}') for i, room in enumerate(rooms)
+        ])
+        for i, (room, message) in enumerate(zip(rooms, messages)):
+            room.last_message = message
+            room.updated_at = now - timedelta(seconds=i)
+        ChatRoom.objects.bulk_update(rooms, ['last_message', 'updated_at'])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fetch_all(self, **params):
+        results, cursor = [], None
+        while True:
+            query = dict(params, limit=200)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get('/api/inbox/', query)
+            self.assertEqual(response.status_code, 200)
+            results.extend(response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                return results
+
+    def test_query_count_is_independent_of_room_count(self):
+        # The user's room ids (for pending activity), the rooms (with counts,
+        # flags and previews) and the direct-room members
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/inbox/', {'limit': 200})
+        self.assertEqual(len(response.data['results']), 200)
+
+        with self.assertNumQueries(3):
+            self.client.get('/api/inbox/', {'limit': 5})
+
+    def test_pages_cover_inbox_in_activity_order(self):
+        results = self.fetch_all()
+        self.assertEqual(len(results), 900)
+        self.assertEqual(len({room['id'] for room in results}), 900)
+        timestamps = [room['updated_at'] for room in results]
+        self.assertEqual(timestamps, sorted(timestamps, reverse=True))
+
+        room = results[1]
+        self.assertEqual(room['member_count'], 2)
+        self.assertFalse(room['is_archived'])
+        self.assertTrue(room['last_message']['content'].startswith('hello'))
+        self.assertEqual(len(room['members']), 2 if room['room_type'] == 'direct' else 0)
+
+    def test_archived_and_muted_filters(self):
+        self.assertEqual(len(self.fetch_all(archived='true')), 100)
+        self.assertEqual(len(self.fetch_all(muted='true')), 100)
+        self.assertEqual(len(self.fetch_all(muted='false')), 800)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/inbox/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class RoomActivityTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('tara', password='secret-pass-1')
+        cls.other = User.objects.create_user('umar', password='secret-pass-1')
+        now = timezone.now()
+        cls.rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(name=f'Activity {i}', room_type='group', created_by=cls.user) for i in range(5)
+        ])
+        RoomMembership.objects.bulk_create([RoomMembership(user=cls.user, room=room) for room in cls.rooms])
+        for i, room in enumerate(cls.rooms):
+            room.updated_at = now - timedelta(minutes=i + 1)
+        ChatRoom.objects.bulk_update(cls.rooms, ['updated_at'])
+        cls.elsewhere = ChatRoom.objects.create(name='Elsewhere', room_type='group', created_by=cls.other)
+
+    def setUp(self):
+        super().setUp()
+        # Keep bumps pending: no flush until the test asks for one
+        self.redis.set(room_activity.FLUSH_LOCK_KEY, 1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, room, content='hi'):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(room=room, sender=self.other, content=content)
+            room_activity.bump(message)
+        return message
+
+    def inbox_ids(self):
+        ids, cursor = [], None
+        while True:
+            response = self.client.get('/api/inbox/', dict({'limit': 2}, **({'cursor': cursor} if cursor else {})))
+            ids.extend(room['id'] for room in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_bump_is_pending_until_flushed(self):
+        room = self.rooms[4]
+        message = self.send(room)
+        self.assertEqual(list(room_activity.pending([room.id, self.rooms[0].id])), [str(room.id)])
+        room.refresh_from_db()
+        self.assertIsNone(room.last_message_id)
+
+        self.assertEqual(room_activity.flush(), 1)
+        self.assertEqual(room_activity.pending([room.id]), {})
+        room.refresh_from_db()
+        self.assertEqual((room.last_message_id, room.updated_at), (message.id, message.timestamp))
+
+    def test_scheduled_flush_writes_a_quiet_room(self):
+        from .tasks import flush_room_activity
+        room = self.rooms[4]
+        message = self.send(room)
+        # A flush ran this interval: the task leaves the bump for the next one
+        flush_room_activity()
+        self.assertEqual(list(room_activity.pending([room.id])), [str(room.id)])
+
+        self.redis.delete(room_activity.FLUSH_LOCK_KEY)
+        flush_room_activity()
+        self.assertEqual(room_activity.pending([room.id]), {})
+        room.refresh_from_db()
+        self.assertEqual(room.last_message_id, message.id)
+
+    def test_flush_never_moves_activity_back(self):
+        room = self.rooms[0]
+        self.redis.zadd(room_activity.PENDING_KEY, {str(room.id): (room.updated_at - timedelta(hours=1)).timestamp()})
+        room_activity.flush()
+        updated_at = room.updated_at
+        room.refresh_from_db()
+        self.assertEqual(room.updated_at, updated_at)
+
+    def test_inbox_merges_pending_rooms_in_activity_order(self):
+        ids = [str(room.id) for room in self.rooms]
+        self.assertEqual(self.inbox_ids(), ids)
+
+        self.send(self.rooms[3])
+        self.send(self.elsewhere)
+        with mock.patch.object(room_activity, 'pending', wraps=room_activity.pending) as pending:
+            response = self.client.get('/api/inbox/', {'limit': 2})
+        # Only the user's rooms are looked up in the pending set
+        self.assertEqual(sorted(str(room_id) for room_id in pending.call_args.args[0]), sorted(ids))
+        first = response.data['results'][0]
+        self.assertEqual((first['id'], first['last_message']['content']), (ids[3], 'hi'))
+        self.assertEqual(self.inbox_ids(), [ids[3], ids[0], ids[1], ids[2], ids[4]])
+
+        room_activity.flush()
+        self.assertEqual(self.inbox_ids(), [ids[3], ids[0], ids[1], ids[2], ids[4]])
+
+
+class RoomHistoryTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('erin', password='secret-pass-1')
+        cls.other = User.objects.create_user('frank', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='History', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room, role='admin', unread_count=30)
+        RoomMembership.objects.create(user=cls.other, room=cls.room)
+        start = timezone.now() - timedelta(hours=1)
+        messages = Message.objects.bulk_create([
+            Message(room=cls.room, sender=cls.other, content=f'msg {i}') for i in range(30)
+        ])
+        for i, message in enumerate(messages):
+            message.timestamp = start + timedelta(seconds=i)
+        Message.objects.bulk_update(messages, ['timestamp'])
+        cls.room.last_message = messages[-1]
+        cls.room.save()
+        cls.contents = [f'msg {i}' for i in range(30)]
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.path = f'/api/rooms/{self.room.id}/messages/'
+
+    def contents_of(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [message['content'] for message in response.data]
+
+    def test_before_and_after_cursors_walk_the_history(self):
+        response = self.client.get(self.path, {'limit': 12})
+        pages = [self.contents_of(response)]
+        self.assertNotIn('X-Cursor-After', response)
+        while 'X-Cursor-Before' in response:
+            response = self.client.get(self.path, {'limit': 12, 'before': response['X-Cursor-Before']})
+            pages.insert(0, self.contents_of(response))
+        self.assertEqual(sum(pages, []), self.contents)
+        self.assertEqual([len(page) for page in pages], [6, 12, 12])
+
+        newer = self.client.get(self.path, {'limit': 12, 'after': response['X-Cursor-After']})
+        self.assertEqual(self.contents_of(newer), self.contents[6:18])
+
+    def test_around_centres_on_the_message(self):
+        anchor = Message.objects.get(content='msg 15')
+        response = self.client.get(self.path, {'limit': 10, 'around': str(anchor.id)})
+        self.assertEqual(self.contents_of(response), self.contents[10:20])
+        self.assertIn('X-Cursor-Before', response)
+        self.assertIn('X-Cursor-After', response)
+
+    def test_invalid_cursors(self):
+        timestamp = timezone.now()
+        for cursor in ['not-a-cursor', encode_cursor(timestamp, 'not-a-uuid'), encode_cursor('yesterday', str(uuid.uuid4()))]:
+            for param in ('before', 'after'):
+                response = self.client.get(self.path, {param: cursor})
+                self.assertEqual(response.status_code, 400, (param, cursor))
+        self.assertEqual(self.client.get(self.path, {'around': 'not-a-uuid'}).status_code, 404)
+
+    def test_only_the_latest_page_marks_the_chat_read(self):
+        membership = RoomMembership.objects.filter(room=self.room, user=self.user)
+        anchor = Message.objects.get(content='msg 25')
+        for param in ('before', 'after'):
+            self.client.get(self.path, {param: encode_cursor(anchor.timestamp, anchor.id)})
+        self.client.get(self.path, {'around': str(anchor.id)})
+        self.assertEqual(membership.get().unread_count, 30)
+
+        self.client.get(self.path)
+        self.assertEqual(membership.get().unread_count, 0)
+        self.assertEqual(membership.get().last_read_message_id, self.room.last_message_id)
+
+
+@mock.patch.object(fanout, '_sinks', [])
+class ReadStateTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('gina', password='secret-pass-1')
+        cls.other = User.objects.create_user('hank', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Reads', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room, role='admin')
+        RoomMembership.objects.create(user=cls.other, room=cls.room)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.other)
+        self.membership = RoomMembership.objects.filter(room=self.room, user=self.user)
+
+    def send(self, content, room=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/messages/', {'room_id': str((room or self.room).id), 'content': content})
+        self.assertEqual(response.status_code, 201)
+        return Message.objects.get(id=response.data['id'])
+
+    def test_deleted_messages_are_not_unread(self):
+        messages = [self.send(f'msg {i}') for i in range(3)]
+        self.assertEqual(self.membership.get().unread_count, 3)
+        self.assertEqual(self.client.delete(f'/api/messages/{messages[1].id}/').status_code, 200)
+        self.assertEqual(self.membership.get().unread_count, 2)
+        read_state.rebuild_unread_counts()
+        self.assertEqual(self.membership.get().unread_count, 2)
+
+    def test_watermark_only_moves_forward(self):
+        first, second = self.send('first'), self.send('second')
+        self.assertTrue(read_state.mark_message_read(second, self.user))
+        self.assertFalse(read_state.mark_message_read(first, self.user))
+        membership = self.membership.get()
+        self.assertEqual((membership.last_read_message_id, membership.unread_count), (second.id, 0))
+        self.assertEqual([m.user_id for m in read_state.readers_of(first)], [self.user.id])
+        # The sender's own watermark follows what they write
+        self.assertEqual(RoomMembership.objects.get(room=self.room, user=self.other).last_read_message_id, second.id)
+
+    def test_receipts_for_a_message_list_in_one_query(self):
+        messages = [self.send(f'msg {i}') for i in range(6)]
+        carol = User.objects.create_user('ivan', password='secret-pass-1')
+        dave = User.objects.create_user('judy', password='secret-pass-1')
+        RoomMembership.objects.create(user=carol, room=self.room)
+        RoomMembership.objects.create(user=dave, room=self.room)
+        read_state.mark_message_read(messages[2], self.user)
+        read_state.mark_message_read(messages[4], carol)
+
+        with self.assertNumQueries(1):
+            receipts = read_state.readers_by_message(messages)
+        for message in messages:
+            self.assertEqual(
+                [m.user_id for m in receipts[message.id]], [m.user_id for m in read_state.readers_of(message)]
+            )
+        self.assertEqual([len(receipts[m.id]) for m in messages], [2, 2, 2, 1, 1, 0])
+
+        # Compact receipts: counted and cut to the first readers in SQL
+        with self.assertNumQueries(1):
+            first = read_state.first_readers_by_message(messages, 1)
+        self.assertEqual({m.id: [r.id for r in first[m.id]] for m in messages}, {m.id: [r.id for r in receipts[m.id][:1]] for m in messages})
+        with self.assertNumQueries(1):
+            self.assertEqual(read_state.reader_counts(messages), {m.id: len(receipts[m.id]) for m in messages})
+
+        path = f'/api/rooms/{self.room.id}/messages/'
+        counts = []
+        for limit in (2, 6):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, {'limit': limit, 'receipts': 'compact', 'receipts_limit': 1})
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        first = response.data[0]
+        self.assertEqual((first['read_count'], len(first['read_by'])), (2, 1))
+
+    def test_mark_all_rooms_read(self):
+        other_room = ChatRoom.objects.create(name='More', room_type='group', created_by=self.user)
+        RoomMembership.objects.create(user=self.user, room=other_room)
+        RoomMembership.objects.create(user=self.other, room=other_room)
+        for i in range(3):
+            self.send(f'msg {i}')
+            self.send(f'more {i}', room=other_room)
+        reader = APIClient()
+        reader.force_authenticate(self.user)
+        self.assertEqual(reader.get('/api/rooms/unread/').data['total'], 6)
+
+        # The newest messages are still pending bumps, not yet on the rooms
+        self.assertEqual(set(room_activity.pending([self.room.id, other_room.id])), {str(self.room.id), str(other_room.id)})
+
+        # The user's room ids, one UPDATE writing their pending activity and
+        # two UPDATEs for the watermarks, however many rooms
+        with self.assertNumQueries(6):
+            response = reader.post('/api/rooms/read/')
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(reader.get('/api/rooms/unread/').data, {'rooms': {str(self.room.id): 0, str(other_room.id): 0}, 'total': 0})
+        self.assertEqual(
+            set(RoomMembership.objects.filter(user=self.user).values_list('last_read_message__content', flat=True)),
+            {'msg 2', 'more 2'}
+        )
+
+        # Nothing pending: no activity UPDATE
+        room_activity.flush()
+        with self.assertNumQueries(5):
+            self.assertEqual(reader.post('/api/rooms/read/').data['count'], 0)
+
+
+@mock.patch.object(fanout, '_sinks', [])
+class RoomPreviewTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('iris', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Previews', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room, role='admin')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/messages/', {'room_id': str(self.room.id), 'content': content})
+        return response.data['id']
+
+    def preview(self):
+        [room] = self.client.get('/api/rooms/').data
+        return room['last_message'] and room['last_message']['content']
+
+    def test_preview_falls_back_to_the_previous_visible_message(self):
+        first, second, third = self.send('first'), self.send('second'), self.send('third')
+        self.assertEqual(self.preview(), 'third')
+
+        self.client.delete(f'/api/messages/{second}/')
+        self.assertEqual(self.preview(), 'third')
+        self.client.delete(f'/api/messages/{third}/')
+        self.assertEqual(self.preview(), 'first')
+        self.client.delete(f'/api/messages/{first}/')
+        self.assertIsNone(self.preview())
+
+    def test_edits_show_without_bookkeeping(self):
+        message_id = self.send('typo')
+        self.client.put(f'/api/messages/{message_id}/', {'content': 'fixed'})
+        self.assertEqual(self.preview(), 'fixed')
+
+
+class MessageSearchTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('kate', password='secret-pass-1')
+        cls.other = User.objects.create_user('liam', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Search', room_type='group', created_by=cls.user)
+        cls.second = ChatRoom.objects.create(name='Search 2', room_type='group', created_by=cls.user)
+        cls.private = ChatRoom.objects.create(name='Private', room_type='group', created_by=cls.other)
+        for room in (cls.room, cls.second):
+            RoomMembership.objects.create(user=cls.user, room=room, role='admin')
+        RoomMembership.objects.create(user=cls.other, room=cls.private, role='admin')
+        start = timezone.now() - timedelta(hours=1)
+        messages = Message.objects.bulk_create(
+            [Message(room=cls.room, sender=cls.user, content=f'hello world {i}') for i in range(7)]
+            + [Message(room=cls.second, sender=cls.user, content='hello again')]
+            + [Message(room=cls.private, sender=cls.other, content='hello secret')]
+            + [Message(room=cls.room, sender=cls.user, content='unrelated')]
+            + [Message(room=cls.room, sender=cls.user, content='hello deleted', deleted_at=timezone.now())]
+        )
+        for i, message in enumerate(messages):
+            message.timestamp = start + timedelta(minutes=i)
+        Message.objects.bulk_update(messages, ['timestamp'])
+        search.index_messages(messages)
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def fetch_all(self, path, **params):
+        contents, cursor = [], None
+        while True:
+            query = dict(params, limit=3)
+            if cursor:
+                query['cursor'] = cursor
+            response = self.client.get(path, query)
+            self.assertEqual(response.status_code, 200)
+            contents.extend(message['content'] for message in response.data['results'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                return contents
+
+    def check_backend(self, backend):
+        with mock.patch.object(search, '_backend', backend):
+            found = self.fetch_all('/api/search/', q='hello')
+            self.assertEqual(sorted(found), sorted([f'hello world {i}' for i in range(7)] + ['hello again']))
+            found = self.fetch_all(f'/api/rooms/{self.second.id}/search/', q='hello')
+            self.assertEqual(found, ['hello again'])
+            self.assertEqual(self.fetch_all('/api/search/', q='wor'), self.fetch_all('/api/search/', q='world'))
+
+            response = self.client.get('/api/search/', {'q': 'hello', 'limit': 3})
+            rank, pk = decode_cursor(response.data['next_cursor'])
+            for cursor in ['garbage', encode_cursor(rank, 'not-a-uuid'), encode_cursor('not-a-rank', pk)]:
+                self.assertEqual(self.client.get('/api/search/', {'q': 'hello', 'cursor': cursor}).status_code, 400)
+
+    def test_sqlite_backend(self):
+        self.check_backend(search.SQLiteSearchBackend())
+
+    def test_basic_backend(self):
+        self.check_backend(search.BasicSearchBackend())
+
+    def test_search_is_limited_to_member_rooms(self):
+        self.assertEqual(self.client.get(f'/api/rooms/{self.private.id}/search/', {'q': 'hello'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'h'}).status_code, 400)
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class UserSearchTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('mona', password='secret-pass-1')
+        cls.nick = User.objects.create_user('nick', password='secret-pass-1', phone_number='+15550001')
+        for name in ['dan', 'danny', 'daniela', 'jordan']:
+            User.objects.create_user(name, password='secret-pass-1')
+        user_search.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        caches['user_search'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def names(self, q):
+        response = self.client.get('/api/users/search/', {'q': q})
+        self.assertEqual(response.status_code, 200)
+        return [user['username'] for user in response.data]
+
+    def test_ranking_and_typo_threshold(self):
+        # 'jordan' shares a single trigram with 'dan' and is left out
+        self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+        self.assertEqual(self.names('danielo'), ['daniela'])
+        self.assertEqual(self.names('+1555'), ['nick'])
+        self.assertEqual(self.names('m'), [])
+
+    def test_profile_edit_only_drops_pages_listing_that_user(self):
+        self.assertEqual(self.names('+1555'), ['nick'])
+        self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+
+        nick = APIClient()
+        nick.force_authenticate(self.nick)
+        self.assertEqual(nick.put('/api/profile/', {'phone_number': '+19990001'}).status_code, 200)
+
+        self.assertEqual(self.names('+1555'), [])
+        # Still cached: only the users are loaded
+        with self.assertNumQueries(1):
+            self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+
+    def test_blocked_users_are_excluded(self):
+        self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+        dan = User.objects.get(username='dan')
+        self.assertEqual(self.client.post('/api/privacy/block/', {'user_id': dan.id}).status_code, 200)
+        self.assertEqual(self.names('dan'), ['daniela', 'danny'])
+        self.assertEqual(self.client.delete(f'/api/privacy/unblock/{dan.id}/').status_code, 200)
+        self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+
+    def test_search_works_without_the_cache(self):
+        with override_settings(CACHES=dict(LOCAL_CACHES, user_search={
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:1/0'
+        })):
+            self.assertEqual(self.names('dan'), ['dan', 'daniela', 'danny'])
+
+
+class ReadWatermarkMigrationTests(FakeRedisMixin, TransactionTestCase):
+    """0007 collapses MessageRead rows into watermarks and recounts unread messages."""
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('chat', target)])
+        return executor.loader.project_state([('chat', target)]).apps
+
+    def test_message_reads_become_watermarks(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('chat')[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate('0006_chatroom_last_message')
+        User = apps.get_model('chat', 'User')
+        ChatRoom = apps.get_model('chat', 'ChatRoom')
+        RoomMembership = apps.get_model('chat', 'RoomMembership')
+        Message = apps.get_model('chat', 'Message')
+        MessageRead = apps.get_model('chat', 'MessageRead')
+
+        reader = User.objects.create(username='reader')
+        writer = User.objects.create(username='writer')
+        room = ChatRoom.objects.create(name='Old', room_type='group', created_by=writer)
+        RoomMembership.objects.create(user=reader, room=room)
+        RoomMembership.objects.create(user=writer, room=room)
+        start = timezone.now() - timedelta(hours=1)
+        messages = []
+        for i in range(5):
+            message = Message.objects.create(room=room, sender=writer, content=f'msg {i}')
+            Message.objects.filter(id=message.id).update(timestamp=start + timedelta(minutes=i))
+            messages.append(message)
+        Message.objects.filter(id=messages[4].id).update(deleted_at=timezone.now())
+        MessageRead.objects.create(message=messages[1], user=reader)
+
+        apps = self.migrate('0007_read_watermarks')
+        RoomMembership = apps.get_model('chat', 'RoomMembership')
+        reader_membership = RoomMembership.objects.get(user__username='reader')
+        writer_membership = RoomMembership.objects.get(user__username='writer')
+        # Read up to msg 1; msg 2 and 3 are unread, the deleted msg 4 doesn't count
+        self.assertEqual((reader_membership.last_read_message_id, reader_membership.unread_count), (messages[1].id, 2))
+        self.assertEqual((writer_membership.last_read_message_id, writer_membership.unread_count), (messages[4].id, 0))
+
+
+@mock.patch.object(fanout, '_sinks', [])
+class AsyncHotViewTests(FakeRedisMixin, TransactionTestCase):
+    # The views run their blocks on pool threads with their own connections,
+    # which only see committed rows
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('carol', password='secret-pass-1')
+        self.other = User.objects.create_user('dave', password='secret-pass-1')
+        self.room = ChatRoom.objects.create(name='Async', room_type='group', created_by=self.user)
+        RoomMembership.objects.create(user=self.user, room=self.room, role='admin')
+        RoomMembership.objects.create(user=self.other, room=self.room)
+        for i in range(5):
+            message = Message.objects.create(room=self.room, sender=self.other, content=f'msg {i}')
+        self.room.last_message = message
+        self.room.save()
+        RoomMembership.objects.filter(user=self.user).update(unread_count=5)
+
+        self.header = f'Bearer {AccessToken.for_user(self.user)}'
+        self.client = APIClient(HTTP_AUTHORIZATION=self.header)
+
+    def get(self, path, data=None):
+        return AsyncRequestFactory().get(path, data, headers={'Authorization': self.header})
+
+    def post(self, path, data=None):
+        return AsyncRequestFactory().post(path, data, content_type='application/json', headers={'Authorization': self.header})
+
+    async def test_room_messages_match_sync_view(self):
+        path = f'/api/rooms/{self.room.id}/messages/'
+        expected = await sync_to_async(self.client.get)(path, {'limit': 2})
+        response = await async_views.room_messages(self.get(path, {'limit': 2}), room_id=self.room.id)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(response['X-Cursor-Before'], expected['X-Cursor-Before'])
+
+        cursor = response['X-Cursor-Before']
+        older = await async_views.room_messages(self.get(path, {'before': cursor}), room_id=self.room.id)
+        self.assertEqual([m['content'] for m in json.loads(older.content)], ['msg 0', 'msg 1', 'msg 2'])
+
+    async def test_send_message_and_mark_read(self):
+        response = await async_views.send_message(self.post('/api/messages/', {'room_id': str(self.room.id), 'content': 'hi'}))
+        self.assertEqual(response.status_code, 201)
+        data = json.loads(response.content)
+        self.assertEqual(data['content'], 'hi')
+        self.assertEqual(data['room'], str(self.room.id))
+
+        # The room activity bump ran on commit: write it if it's still pending in Redis
+        await sync_to_async(room_activity.sync)([self.room.id])
+        room = await ChatRoom.objects.aget(id=self.room.id)
+        self.assertEqual(str(room.last_message_id), data['id'])
+        membership = await RoomMembership.objects.aget(room=self.room, user=self.other)
+        self.assertEqual(membership.unread_count, 1)
+
+        response = await async_views.mark_room_read(
+            self.post(f'/api/rooms/{self.room.id}/read/'), room_id=self.room.id
+        )
+        self.assertEqual(json.loads(response.content), {'message': 'Messages marked as read', 'count': 5})
+
+    async def test_errors_match_sync_views(self):
+        response = await async_views.send_message(AsyncRequestFactory().post('/api/messages/'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+
+        response = await async_views.send_message(self.post('/api/messages/', {}))
+        self.assertEqual(response.status_code, 400)
+
+        stranger = await ChatRoom.objects.acreate(name='Other', room_type='group', created_by=self.other)
+        response = await async_views.room_messages(self.get('/'), room_id=stranger.id)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), {'detail': 'Not found.'})
+
+        response = await async_views.chat_rooms(self.get('/api/rooms/'))
+        self.assertEqual([room['id'] for room in json.loads(response.content)], [str(self.room.id)])
+
+
+class EmitterTests(SimpleTestCase):
+    def make_emitter(self, fail=False, **kwargs):
+        """An emitter whose pipelines record each published batch; the first one waits for ``release``."""
+        instance = emitter.Emitter('redis://127.0.0.1:1/0', **kwargs)
+        self.batches, self.started, self.release = [], threading.Event(), threading.Event()
+
+        def pipeline(transaction):
+            pipe, packets = mock.Mock(), []
+            pipe.publish.side_effect = lambda channel, packet: packets.append(pickle.loads(packet)['data'])
+
+            def execute():
+                self.started.set()
+                self.release.wait(5)
+                if fail:
+                    raise redis.ConnectionError('down')
+                self.batches.append(packets)
+            pipe.execute.side_effect = execute
+            return pipe
+
+        instance.redis = mock.Mock(pipeline=mock.Mock(side_effect=pipeline))
+        return instance
+
+    def test_queued_emits_are_published_in_batches(self):
+        instance = self.make_emitter(blocking=False, batch_size=3)
+        instance.emit('new_message', 0, room='r')
+        self.assertTrue(self.started.wait(5))
+        for i in range(1, 7):
+            instance.emit('new_message', i, room='r')
+        self.release.set()
+        instance.flush()
+        self.assertEqual(self.batches, [[0], [1, 2, 3], [4, 5, 6]])
+
+    def test_blocking_emit_publishes_at_once(self):
+        instance = self.make_emitter()
+        self.release.set()
+        instance.emit('new_message', {'id': 1}, room='r')
+        self.assertEqual(self.batches, [[{'id': 1}]])
+        self.assertIsNone(instance._worker)
+
+    def test_full_queue_and_redis_errors_drop_events(self):
+        instance = self.make_emitter(fail=True, blocking=False, max_queue=1)
+        instance.emit('new_message', 0)
+        self.assertTrue(self.started.wait(5))
+        with self.assertLogs('chat.emitter', 'WARNING') as logs:
+            instance.emit('new_message', 1)
+            instance.emit('new_message', 2)
+        self.assertIn('queue full', logs.output[0])
+        with self.assertLogs('chat.emitter', 'ERROR'):
+            self.release.set()
+            instance.flush()
+        self.assertEqual(self.batches, [])
+
+
+class RecordingSink(fanout.BaseSink):
+    def __init__(self, name, fail=False):
+        self.name, self.fail, self.events = name, fail, []
+
+    def publish(self, event):
+        if self.fail:
+            raise RuntimeError('sink down')
+        self.events.append(event)
+
+
+class FanoutTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('olga', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Fanout', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room, role='admin')
+
+    def setUp(self):
+        super().setUp()
+        self.sinks = [RecordingSink('broken', fail=True), RecordingSink('ok')]
+        patcher = mock.patch.object(fanout, '_sinks', self.sinks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fanout.metrics.reset()
+        self.addCleanup(fanout.metrics.reset)
+
+    def test_publish_delivers_once_after_commit(self):
+        message = Message.objects.create(room=self.room, sender=self.user, content='hi')
+        with self.assertLogs('chat.fanout', 'ERROR'):
+            with self.captureOnCommitCallbacks() as callbacks:
+                payload = fanout.publish(message)
+                self.assertEqual(self.sinks[1].events, [])
+            for callback in callbacks:
+                callback()
+
+        event, = self.sinks[1].events
+        self.assertIs(event.payload, payload)
+        self.assertEqual(event.room_id, str(self.room.id))
+        frame = json.loads(event.channels_frame)
+        self.assertEqual((frame['type'], frame['message_id'], frame['content']), ('message', str(message.id), 'hi'))
+
+        stats = fanout.metrics.snapshot()
+        self.assertEqual((stats['broken']['published'], stats['broken']['errors']), (0, 1))
+        self.assertEqual((stats['ok']['published'], stats['ok']['errors']), (1, 0))
+
+    async def test_adeliver_runs_every_sink(self):
+        message = await Message.objects.acreate(room=self.room, sender=self.user, content='hi')
+        with self.assertLogs('chat.fanout', 'ERROR'):
+            await fanout.apublish(message, {'id': str(message.id)})
+        self.assertEqual([event.payload for event in self.sinks[1].events], [{'id': str(message.id)}])
+        self.assertEqual(fanout.metrics.snapshot()['broken']['errors'], 1)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        fanout.metrics.record('ok', 0.002)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/metrics/fanout/').status_code, 403)
+
+        self.user.is_staff = True
+        response = client.get('/api/metrics/fanout/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ok']['published'], 1)
+        self.assertAlmostEqual(response.data['ok']['avg_ms'], 2.0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TypingStateTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def test_debouncer_publishes_changes_and_refreshes(self):
+        debouncer = typing_state.TypingDebouncer(refresh=3, clock=self.clock)
+        self.assertFalse(debouncer.should_publish(False))
+        self.assertTrue(debouncer.should_publish(True))
+        self.clock.now += 1
+        self.assertFalse(debouncer.should_publish(True))
+        self.clock.now += 2
+        self.assertTrue(debouncer.should_publish(True))
+        self.assertTrue(debouncer.should_publish(False))
+        self.assertFalse(debouncer.should_publish(False))
+
+    def test_room_frames_are_throttled_and_expire(self):
+        room = typing_state.TypingRoom(ttl=6, interval=0.5, clock=self.clock)
+        self.assertIsNone(room.next_deadline())
+        room.update(1, 'ann', True)
+        self.assertEqual(room.next_deadline(), 0)
+        self.assertEqual(room.poll(), {
+            'type': 'typing', 'is_typing': True, 'count': 1, 'users': [{'user_id': 1, 'username': 'ann'}]
+        })
+        self.assertIsNone(room.poll())
+
+        # A second typer within the interval waits for it
+        self.clock.now += 0.2
+        room.update(2, 'ben', True)
+        self.assertIsNone(room.poll())
+        self.assertAlmostEqual(room.next_deadline(), 0.3)
+        self.clock.now += 0.3
+        self.assertEqual(room.poll()['count'], 2)
+
+        # Nothing changes until the first typer expires; no stop event needed
+        self.assertAlmostEqual(room.next_deadline(), 5.5)
+        self.clock.now += 5.5
+        self.assertEqual(room.poll()['users'], [{'user_id': 2, 'username': 'ben'}])
+        room.update(2, 'ben', False)
+        self.clock.now += 0.5
+        self.assertEqual(room.poll(), {'type': 'typing', 'is_typing': False, 'count': 0, 'users': []})
+        self.assertIsNone(room.next_deadline())
+
+    def test_frames_name_the_latest_typers(self):
+        room = typing_state.TypingRoom(clock=self.clock)
+        for user_id in range(typing_state.MAX_NAMED + 2):
+            room.update(user_id, f'user{user_id}', True)
+            self.clock.now += 0.1
+        frame = room.poll()
+        self.assertEqual(frame['count'], typing_state.MAX_NAMED + 2)
+        self.assertEqual(
+            [user['user_id'] for user in frame['users']],
+            list(range(typing_state.MAX_NAMED + 1, 1, -1))
+        )
+
+
+class PresenceTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('pete', password='secret-pass-1')
+
+    def test_online_while_any_socket_is_connected(self):
+        self.assertTrue(presence.connect(self.user.id, 'a'))
+        self.assertFalse(presence.connect(self.user.id, 'b'))
+        self.assertFalse(presence.disconnect(self.user.id, 'a'))
+        self.assertTrue(presence.get_presence([self.user.id])[self.user.id][0])
+        self.assertTrue(presence.disconnect(self.user.id, 'b'))
+        self.assertFalse(presence.get_presence([self.user.id])[self.user.id][0])
+
+    def test_sockets_expire_without_heartbeat(self):
+        presence.connect(self.user.id, 'live')
+        presence.connect(self.user.id, 'dead')
+        key = presence._conns_key(self.user.id)
+        self.assertLessEqual(self.redis.ttl(key), presence.CONNECTION_TTL)
+        self.redis.zadd(key, {'dead': time.time() - 1})
+        # The live socket's disconnect is the last one that counts
+        self.assertTrue(presence.disconnect(self.user.id, 'live'))
+
+        self.redis.zadd(key, {'live': time.time() - 1})
+        self.assertFalse(presence.get_presence([self.user.id])[self.user.id][0])
+        # A heartbeat from a socket that had expired brings the user back online
+        self.assertTrue(presence.heartbeat(self.user.id, 'live'))
+        self.assertFalse(presence.heartbeat(self.user.id, 'live'))
+
+    def test_flush_writes_status_and_last_seen(self):
+        # The first change flushes at once, later ones wait for the interval
+        presence.connect(self.user.id, 'a')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.online_status)
+        connected_at = self.user.last_seen
+
+        presence.disconnect(self.user.id, 'a')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.online_status)
+        self.assertEqual(presence.flush(), 1)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.online_status)
+        self.assertGreater(self.user.last_seen, connected_at)
+        self.assertEqual(presence.flush(), 0)
+
+        # last_seen expires from Redis; the flushed value stays the one served
+        key = presence._last_seen_key(self.user.id)
+        self.assertLessEqual(self.redis.ttl(key), presence.LAST_SEEN_TTL)
+        self.redis.delete(key)
+        self.redis.sadd(presence.DIRTY_KEY, self.user.id)
+        self.assertEqual(presence.flush(), 1)
+        last_seen = self.user.last_seen
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_seen, last_seen)
+
+    async def test_consumer_sends_heartbeats(self):
+        consumer = ChatConsumer()
+        consumer.user, consumer.channel_name = self.user, 'specific.abc'
+        beats = []
+
+        def heartbeat(user_id, connection_id):
+            beats.append((user_id, connection_id))
+            if len(beats) == 2:
+                task.cancel()
+            return False
+
+        with mock.patch.object(presence, 'HEARTBEAT_INTERVAL', 0), mock.patch.object(presence, 'heartbeat', heartbeat):
+            task = asyncio.create_task(consumer.send_heartbeats())
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        self.assertEqual(beats, [(self.user.id, 'specific.abc')] * 2)
+
+
+class FrameBatchingTests(SimpleTestCase):
+    def setUp(self):
+        self.frames = []
+
+    async def send(self, text_data):
+        self.frames.append(json.loads(text_data))
+
+    def test_batching_is_negotiated_in_the_query_string(self):
+        self.assertTrue(frame_batching.wants_batching({'query_string': b'token=x&batch=1'}))
+        self.assertTrue(frame_batching.wants_batching({'query_string': b'batch=true'}))
+        self.assertFalse(frame_batching.wants_batching({'query_string': b'token=x&nobatch=1'}))
+        self.assertFalse(frame_batching.wants_batching({}))
+
+    async def test_events_within_the_window_share_a_frame(self):
+        batcher = frame_batching.FrameBatcher(self.send, window=0.01)
+        await batcher.add('{"n": 1}')
+        await batcher.add('{"n": 2}')
+        self.assertEqual(self.frames, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.frames, [[{'n': 1}, {'n': 2}]])
+        self.assertIsNone(batcher.timer)
+
+    async def test_full_batches_are_sent_at_once(self):
+        batcher = frame_batching.FrameBatcher(self.send, window=60, max_events=2, max_bytes=20)
+        await batcher.add('{"n": 1}')
+        await batcher.add('{"n": 2}')
+        await batcher.add('{"text": "' + 'x' * 20 + '"}')
+        self.assertEqual(self.frames, [[{'n': 1}, {'n': 2}], [{'text': 'x' * 20}]])
+        self.assertIsNone(batcher.timer)
+
+    async def test_close_drops_pending_events(self):
+        batcher = frame_batching.FrameBatcher(self.send, window=0.01)
+        await batcher.add('{"n": 1}')
+        batcher.close()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.frames, [])
+
+    async def test_consumer_sends_single_frames_unless_batching(self):
+        consumer = ChatConsumer()
+        consumer.send = self.send
+        consumer.batcher = None
+        await consumer.send_event('{"n": 1}')
+        self.assertEqual(self.frames, [{'n': 1}])
+
+        consumer.batcher = frame_batching.FrameBatcher(self.send, window=60, max_events=1)
+        await consumer.send_event('{"n": 2}')
+        self.assertEqual(self.frames, [{'n': 1}, [{'n': 2}]])
+
+
+class ReactionTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('erin', password='secret-pass-1')
+        cls.other = User.objects.create_user('frank', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Reactions', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room)
+        RoomMembership.objects.create(user=cls.other, room=cls.room)
+        cls.messages = [Message.objects.create(room=cls.room, sender=cls.other, content=f'msg {i}') for i in range(3)]
+
+    def react(self, user, message, emoji):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(f'/api/messages/{message.id}/react/', {'emoji': emoji}, format='json')
+
+    def test_toggle_updates_counts(self):
+        message = self.messages[0]
+        self.assertEqual(self.react(self.user, message, '👍').data, {'reactions': {'👍': 1}, 'my_reactions': ['👍']})
+        self.assertEqual(self.react(self.other, message, '👍').data, {'reactions': {'👍': 2}, 'my_reactions': ['👍']})
+        self.react(self.other, message, '🎉')
+        self.assertEqual(self.react(self.user, message, '👍').data, {'reactions': {'👍': 1, '🎉': 1}, 'my_reactions': []})
+
+    def test_message_list_summaries(self):
+        self.react(self.user, self.messages[0], '👍')
+        self.react(self.other, self.messages[0], '👍')
+        self.react(self.other, self.messages[2], '❤️')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(f'/api/rooms/{self.room.id}/messages/')
+        summaries = [(m['reactions'], m['my_reactions']) for m in response.data]
+        self.assertEqual(summaries, [({'👍': 2}, ['👍']), ({}, []), ({'❤️': 1}, [])])
+
+    def test_non_member_cannot_react(self):
+        stranger = User.objects.create_user('grace', password='secret-pass-1')
+        self.assertEqual(self.react(stranger, self.messages[0], '👍').status_code, 404)
+
+    def test_emoji_must_be_a_short_string(self):
+        for emoji in (None, '', 5, 0, ['👍'], {'emoji': '👍'}, 'x' * (reactions.MAX_EMOJI_LENGTH + 1)):
+            self.assertEqual(self.react(self.user, self.messages[0], emoji).status_code, 400, emoji)
+        self.assertFalse(MessageReaction.objects.exists())
+
+    def test_deleted_users_leave_the_counts(self):
+        leaver = User.objects.create_user('hugo', password='secret-pass-1')
+        RoomMembership.objects.create(user=leaver, room=self.room)
+        self.react(self.user, self.messages[0], '👍')
+        self.react(leaver, self.messages[0], '👍')
+        self.react(leaver, self.messages[1], '🎉')
+        leaver.delete()
+        self.assertEqual(self.react(self.other, self.messages[1], '❤️').data['reactions'], {'❤️': 1})
+        self.assertEqual(self.react(self.other, self.messages[0], '❤️').data['reactions'], {'👍': 1, '❤️': 1})
+
+    def test_rebuild_command_repairs_drift(self):
+        self.react(self.user, self.messages[0], '👍')
+        self.react(self.other, self.messages[0], '👍')
+        self.react(self.other, self.messages[2], '❤️')
+        MessageReactionCount.objects.filter(emoji='👍').update(count=7)
+        MessageReactionCount.objects.filter(emoji='❤️').delete()
+        MessageReactionCount.objects.create(message=self.messages[1], emoji='🎉', count=3)
+
+        call_command('rebuild_reaction_counts', batch_size=1, stdout=StringIO())
+        self.assertEqual(
+            set(MessageReactionCount.objects.values_list('message_id', 'emoji', 'count')),
+            {(self.messages[0].id, '👍', 2), (self.messages[1].id, '🎉', 0), (self.messages[2].id, '❤️', 1)}
+        )
+
+
+class GroupMemberTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('admin', password='secret-pass-1')
+        cls.users = User.objects.bulk_create([User(username=f'member{i}') for i in range(30)])
+        cls.room = ChatRoom.objects.create(name='Team', room_type='group', created_by=cls.admin, max_members=25)
+        RoomMembership.objects.create(user=cls.admin, room=cls.room, role='admin')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.url = f'/api/rooms/{self.room.id}/members/'
+
+    def test_bulk_add_uses_constant_queries(self):
+        ids = [user.id for user in self.users[:20]]
+        with self.assertNumQueries(16):
+            response = self.client.post(self.url, {'user_ids': ids + ['x', 999999]}, format='json')
+        self.assertEqual(response.data['added'], ids)
+        self.assertEqual(RoomMembership.objects.filter(room=self.room).count(), 21)
+        system = Message.objects.filter(room=self.room, message_type='system').get()
+        self.assertEqual(system.content, 'Added member0, member1, member2 and 17 others to the group')
+
+        # Already members are skipped
+        response = self.client.post(self.url, {'user_ids': ids[:2]}, format='json')
+        self.assertEqual(response.data['added'], [])
+
+    def test_max_members_is_all_or_nothing(self):
+        response = self.client.post(self.url, {'user_ids': [user.id for user in self.users]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(RoomMembership.objects.filter(room=self.room).count(), 1)
+
+    def test_bulk_roles_and_removal(self):
+        ids = [user.id for user in self.users[:5]]
+        self.client.post(self.url, {'user_ids': ids}, format='json')
+
+        response = self.client.patch(self.url, {'user_ids': ids[:2], 'role': 'admin'}, format='json')
+        self.assertEqual(response.data['updated'], 2)
+        response = self.client.patch(self.url, {'user_ids': ids + [self.admin.id], 'role': 'member'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(RoomMembership.objects.filter(room=self.room, role='admin').count(), 3)
+
+        response = self.client.delete(self.url, {'user_ids': ids[1:] + [self.admin.id]}, format='json')
+        self.assertEqual(response.data['removed'], ids[1:])
+        self.assertEqual(
+            set(RoomMembership.objects.filter(room=self.room).values_list('user_id', flat=True)),
+            {self.admin.id, ids[0]}
+        )
+
+    def test_only_admins_change_roles_or_remove(self):
+        member = self.users[0]
+        RoomMembership.objects.create(user=member, room=self.room)
+        # on_commit invalidation doesn't run inside TestCase
+        member_cache.invalidate(self.room.id)
+        client = APIClient()
+        client.force_authenticate(member)
+        self.assertEqual(client.delete(self.url, {'user_ids': [self.admin.id]}, format='json').status_code, 403)
+        self.assertEqual(client.patch(self.url, {'user_ids': [member.id], 'role': 'admin'}, format='json').status_code, 403)
+
+
+class MemberCacheTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user('quinn', password='secret-pass-1')
+        cls.joiner = User.objects.create_user('rita', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Cache', room_type='group', created_by=cls.admin)
+        RoomMembership.objects.create(user=cls.admin, room=cls.room, role='admin')
+
+    def test_roles_are_cached_in_redis(self):
+        self.assertEqual(member_cache.roles(self.room.id), {self.admin.id: 'admin'})
+        member_cache._local.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(member_cache.role(self.room.id, self.admin.id), 'admin')
+        self.assertEqual(member_cache.roles('not-a-room'), {})
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        query = member_cache._query
+
+        def query_then_join(room_key):
+            # Another request adds a member and invalidates right after the first read
+            roles = query(room_key)
+            if not RoomMembership.objects.filter(user=self.joiner, room=self.room).exists():
+                RoomMembership.objects.create(user=self.joiner, room=self.room)
+                member_cache.invalidate(self.room.id)
+            return roles
+
+        with mock.patch.object(member_cache, '_query', query_then_join):
+            self.assertEqual(member_cache.roles(self.room.id), {self.admin.id: 'admin', self.joiner.id: 'member'})
+        self.assertFalse(self.redis.exists(member_cache._redis_key(str(self.room.id))))
+        self.assertTrue(member_cache.is_member(self.room.id, self.joiner.id))
+
+
+class AuthCacheTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('sara', password='secret-pass-1')
+
+    def setUp(self):
+        super().setUp()
+        auth._tokens.entries.clear()
+        self.addCleanup(auth._tokens.entries.clear)
+
+    def token(self):
+        token = AccessToken.for_user(self.user)
+        token.set_iat(at_time=timezone.now() - timedelta(minutes=1))
+        return str(token)
+
+    def get_profile(self, token):
+        return APIClient(HTTP_AUTHORIZATION=f'Bearer {token}').get('/api/profile/').status_code
+
+    def test_change_password_issues_fresh_tokens(self):
+        old = self.token()
+        self.assertEqual(self.get_profile(old), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient(HTTP_AUTHORIZATION=f'Bearer {old}').post(
+                '/api/auth/change-password/', {'old_password': 'secret-pass-1', 'new_password': 'secret-pass-2'}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_profile(old), 401)
+        self.assertEqual(self.get_profile(response.data['access']), 200)
+
+    def test_load_racing_an_invalidation_is_not_cached(self):
+        load = auth._load_principal
+
+        def load_then_deactivate(user_id):
+            # The user is deactivated and invalidated right after the first read
+            principal = load(user_id)
+            if principal['is_active']:
+                User.objects.filter(id=user_id).update(is_active=False)
+                auth.invalidate_user(user_id)
+            return principal
+
+        with mock.patch.object(auth, '_load_principal', load_then_deactivate):
+            self.assertIsNone(auth.authenticate_token(self.token()))
+        self.assertFalse(self.redis.exists(auth._principal_key(self.user.id)))
+
+
+class DirectRoomTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='secret-pass-1')
+        cls.bob = User.objects.create_user('bob', password='secret-pass-1')
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def open_dm(self, client, other):
+        return client.post('/api/rooms/', {'room_type': 'direct', 'other_user_id': other.id}, format='json')
+
+    def test_pair_resolves_to_one_room(self):
+        response = self.open_dm(self.client, self.bob)
+        self.assertEqual(response.status_code, 201)
+        room_id = response.data['id']
+
+        other = APIClient()
+        other.force_authenticate(self.bob)
+        response = self.open_dm(other, self.alice)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], room_id)
+        self.assertEqual(DirectRoom.objects.get().user_low_id, min(self.alice.id, self.bob.id))
+
+        self.assertEqual(self.open_dm(self.client, self.alice).status_code, 400)
+        self.assertEqual(self.client.post('/api/rooms/', {'room_type': 'direct', 'other_user_id': 999999}, format='json').status_code, 404)
+
+    def test_dedupe_merges_duplicates(self):
+        now = timezone.now()
+        rooms = []
+        for age in (3, 1):
+            room = ChatRoom.objects.create(room_type='direct', created_by=self.alice)
+            RoomMembership.objects.create(user=self.alice, room=room, role='admin')
+            RoomMembership.objects.create(user=self.bob, room=room)
+            Message.objects.create(room=room, sender=self.bob, content=f'{age}h ago', timestamp=now - timedelta(hours=age))
+            ChatRoom.objects.filter(id=room.id).update(updated_at=now - timedelta(hours=age))
+            rooms.append(room)
+
+        call_command('dedupe_direct_rooms', stdout=mock.MagicMock())
+        room = ChatRoom.objects.get(room_type='direct')
+        self.assertEqual(room.id, rooms[1].id)
+        self.assertEqual(room.messages.count(), 2)
+        self.assertEqual(room.last_message.content, '1h ago')
+        self.assertEqual(RoomMembership.objects.get(room=room, user=self.alice).unread_count, 2)
+        self.assertEqual(DirectRoom.objects.get().room_id, room.id)
+
+
+class BackupExportTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', password='secret-pass-1')
+        cls.bob = User.objects.create_user('bob', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(room_type='direct', created_by=cls.alice)
+        RoomMembership.objects.create(user=cls.alice, room=cls.room, role='admin')
+        RoomMembership.objects.create(user=cls.bob, room=cls.room)
+        Message.objects.bulk_create([
+            Message(room=cls.room, sender=cls.bob if i % 2 else cls.alice, content=f'message {i}')
+            for i in range(25)
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def export(self, query='', **headers):
+        response = self.client.get(f'/api/chat/backup/{query}', **headers)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_streams_the_whole_document(self):
+        with mock.patch('chat.export.MESSAGE_BATCH_SIZE', 10):
+            data = json.loads(self.export())
+        self.assertEqual(data['user_id'], self.alice.id)
+        self.assertEqual(data['profile']['username'], 'alice')
+        self.assertEqual(data['contacts'], [])
+        [chat] = data['chat_rooms']
+        self.assertEqual(chat['room']['id'], str(self.room.id))
+        self.assertEqual(len(chat['messages']), 25)
+        self.assertEqual(len({message['id'] for message in chat['messages']}), 25)
+
+        data = json.loads(self.export('?include=chats'))
+        self.assertNotIn('profile', data)
+
+    def test_queries_per_message_batch_are_constant(self):
+        # Rooms and their members, then messages, receipts and reactions per batch of 10
+        with mock.patch('chat.export.MESSAGE_BATCH_SIZE', 10), self.assertNumQueries(2 + 3 * 3):
+            self.export('?include=chats')
+        Message.objects.bulk_create([Message(room=self.room, sender=self.bob, content='more') for _ in range(10)])
+        with mock.patch('chat.export.MESSAGE_BATCH_SIZE', 10), self.assertNumQueries(2 + 3 * 4):
+            self.export('?include=chats')
+
+    def test_ndjson_and_gzip(self):
+        import gzip
+        body = gzip.decompress(self.export('?output=ndjson&include=chats', HTTP_ACCEPT_ENCODING='gzip'))
+        records = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual([record['type'] for record in records[:2]], ['header', 'room'])
+        self.assertEqual(sum(record['type'] == 'message' for record in records), 25)
+
+
+class CloudBackupTests(FakeRedisMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='secret-pass-1')
+        cls.room = ChatRoom.objects.create(name='Notes', room_type='group', created_by=cls.user)
+        RoomMembership.objects.create(user=cls.user, room=cls.room, role='admin')
+        Message.objects.bulk_create([Message(room=cls.room, sender=cls.user, content=f'note {i}') for i in range(40)])
+
+    def setUp(self):
+        super().setUp()
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'backups': {'BACKEND': 'django.core.files.storage.FileSystemStorage', 'OPTIONS': {'location': location}},
+        }
+        self.enterContext(override_settings(STORAGES=storages))
+        self.enterContext(mock.patch('chat.backup_jobs.RUNNER', 'inline'))
+        self.notify = self.enterContext(mock.patch('chat.backup_jobs.notify'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_job(self, url, **kwargs):
+        """POST to a job endpoint and return the finished job as clients poll it."""
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, **kwargs)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        return self.client.get(f'/api/backup-jobs/{response.data["id"]}/').data
+
+    def test_payload_is_stored_in_chunks(self):
+        with mock.patch('chat.backup_storage.CHUNK_SIZE', 1024):
+            job = self.run_job('/api/cloud/backups/create/')
+        self.assertEqual((job['status'], job['percent'], job['messages_processed']), ('succeeded', 100, 40))
+        backup = UserBackup.objects.get(id=job['backup'])
+        self.assertEqual(job['bytes_processed'], backup.size_bytes)
+        self.assertGreater(len(backup.manifest['chunks']), 1)
+        self.assertEqual(backup.size_bytes, sum(chunk['size'] for chunk in backup.manifest['chunks']))
+        self.assertLess(backup.stored_bytes, backup.size_bytes)
+        self.assertEqual(len(backup_storage.load(backup)['chat_rooms'][0]['messages']), 40)
+        self.notify.assert_called_once()
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cloud/backups/')
+        self.assertEqual(response.data[0]['size_bytes'], backup.size_bytes)
+
+        self.assertEqual(self.run_job(f'/api/cloud/backups/{backup.id}/restore/')['status'], 'succeeded')
+
+        storage = backup_storage.get_storage()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/cloud/backups/{backup.id}/delete/')
+        self.assertFalse(any(storage.exists(chunk['name']) for chunk in backup.manifest['chunks']))
+
+    def test_incremental_chain_restore_and_compaction(self):
+        full = UserBackup.objects.get(id=self.run_job('/api/cloud/backups/create/')['backup'])
+        with mock.patch('chat.backup_chain.OVERLAP', 0):
+            Message.objects.create(room=self.room, sender=self.user, content='new note')
+            job = self.run_job('/api/cloud/backups/create/')
+        self.assertEqual(job['messages_processed'], 1)
+        increment = UserBackup.objects.get(id=job['backup'])
+        self.assertEqual((full.kind, increment.kind, increment.base_id), ('full', 'incremental', full.id))
+        payload = backup_storage.load(increment)
+        self.assertEqual([m['content'] for m in payload['chat_rooms'][0]['messages']], ['new note'])
+
+        # Restoring the increment replays the full snapshot first
+        Message.objects.filter(room=self.room).delete()
+        job = self.run_job(f'/api/cloud/backups/{increment.id}/restore/')
+        self.assertEqual((job['status'], job['messages_processed']), ('succeeded', 41))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 41)
+        self.assertEqual(self.client.delete(f'/api/cloud/backups/{full.id}/delete/').status_code, 409)
+
+        later = timezone.now() + timedelta(days=1)
+        [compacted] = [backup_chain.compact(full, later) for full in backup_chain.compactable(later)]
+        self.assertEqual(list(UserBackup.objects.values_list('id', 'kind')), [(compacted.id, 'full')])
+        self.assertEqual(len(backup_storage.load(compacted)['chat_rooms'][0]['messages']), 41)
+
+    def test_increments_carry_deletes_and_rooms_left(self):
+        other = ChatRoom.objects.create(name='Old', room_type='group', created_by=self.user)
+        RoomMembership.objects.create(user=self.user, room=other, role='admin')
+        Message.objects.create(room=other, sender=self.user, content='old room')
+        full = UserBackup.objects.get(id=self.run_job('/api/cloud/backups/create/')['backup'])
+        deleted = Message.objects.filter(room=self.room).first()
+        with mock.patch('chat.backup_chain.OVERLAP', 0):
+            Message.objects.filter(id=deleted.id).update(deleted_at=timezone.now())
+            RoomMembership.objects.filter(user=self.user, room=other).delete()
+            job = self.run_job('/api/cloud/backups/create/')
+        self.assertEqual(job['messages_processed'], 1)
+        increment = UserBackup.objects.get(id=job['backup'])
+        payload = backup_storage.load(increment)
+        self.assertEqual([room['room']['id'] for room in payload['chat_rooms']], [str(self.room.id)])
+        [tombstone] = payload['chat_rooms'][0]['messages']
+        self.assertEqual(tombstone['id'], str(deleted.id))
+        self.assertIsNotNone(tombstone['deleted_at'])
+
+        # Replaying the chain deletes the message again and leaves the old room out
+        Message.objects.filter(id=deleted.id).update(deleted_at=None)
+        other.delete()
+        job = self.run_job(f'/api/cloud/backups/{increment.id}/restore/')
+        self.assertEqual(job['summary']['rooms']['skipped'], 1)
+        self.assertIsNotNone(Message.objects.get(id=deleted.id).deleted_at)
+        self.assertFalse(ChatRoom.objects.filter(name='Old').exists())
+
+        # Compaction reads the chain a chunk at a time, never a whole payload
+        later = timezone.now() + timedelta(days=1)
+        with mock.patch('chat.backup_storage.CHUNK_SIZE', 1024), \
+                mock.patch('chat.backup_storage.load', side_effect=AssertionError('payload loaded whole')):
+            compacted = backup_chain.compact(full, later)
+        [room] = backup_storage.load(compacted)['chat_rooms']
+        self.assertEqual(room['room']['id'], str(self.room.id))
+        self.assertEqual(len(room['messages']), 40)
+        self.assertEqual([m['id'] for m in room['messages'] if m['deleted_at']], [str(deleted.id)])
+        self.assertEqual(backup_storage.load(compacted)['profile']['username'], 'alice')
+
+    def test_increment_holds_whole_history_of_rooms_joined_since(self):
+        bob = User.objects.create_user('bob', password='secret-pass-2')
+        joined = ChatRoom.objects.create(name='Joined', room_type='group', created_by=bob)
+        RoomMembership.objects.create(user=bob, room=joined, role='admin')
+        history = Message.objects.bulk_create([Message(room=joined, sender=bob, content=f'old {i}') for i in range(5)])
+        self.run_job('/api/cloud/backups/create/')
+        with mock.patch('chat.backup_chain.OVERLAP', 0):
+            RoomMembership.objects.create(user=self.user, room=joined)
+            Message.objects.create(room=self.room, sender=self.user, content='new note')
+            job = self.run_job('/api/cloud/backups/create/')
+        self.assertEqual(job['messages_processed'], 6)
+        increment = UserBackup.objects.get(id=job['backup'])
+        payload = {room['room']['id']: room['messages'] for room in backup_storage.load(increment)['chat_rooms']}
+        self.assertEqual(len(payload[str(joined.id)]), 5)
+        self.assertEqual([m['content'] for m in payload[str(self.room.id)]], ['new note'])
+
+        Message.objects.filter(id__in=[message.id for message in history]).delete()
+        job = self.run_job(f'/api/cloud/backups/{increment.id}/restore/')
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertEqual(sorted(joined.messages.values_list('content', flat=True)), [f'old {i}' for i in range(5)])
+
+    def test_restore_never_overwrites_other_members_messages(self):
+        bob = User.objects.create_user('bob', password='secret-pass-2')
+        RoomMembership.objects.create(user=bob, room=self.room)
+        theirs = Message.objects.create(room=self.room, sender=bob, content='from bob')
+        mine = Message.objects.filter(room=self.room, sender=self.user).first()
+        sent_at = timezone.now() - timedelta(days=400)
+
+        def message(original, **fields):
+            return {'id': str(original.id), 'sender': {'id': self.user.id}, 'content': 'overwritten',
+                    'message_type': 'text', 'timestamp': sent_at.isoformat(), **fields}
+
+        payload = {'chat_rooms': [{'room': {'id': str(self.room.id)}, 'messages': [
+            message(theirs), message(theirs, sender={'id': bob.id}), message(mine),
+        ]}]}
+        job = self.run_job('/api/chat/restore/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(job['summary']['messages'], {'inserted': 0, 'updated': 1, 'skipped': 2})
+        theirs_after = Message.objects.get(id=theirs.id)
+        self.assertEqual((theirs_after.content, theirs_after.sender_id, theirs_after.timestamp), ('from bob', bob.id, theirs.timestamp))
+        # The user's own message is updated, but keeps its sender and time
+        mine_after = Message.objects.get(id=mine.id)
+        self.assertEqual((mine_after.content, mine_after.timestamp), ('overwritten', mine.timestamp))
+
+    def test_running_job_is_taken_over_once_its_lease_expires(self):
+        now = timezone.now()
+        live = BackupJob.objects.create(user=self.user, kind='backup', status='running', started_at=now, heartbeat_at=now)
+        backup_jobs.run(live.id)
+        self.assertEqual(BackupJob.objects.get(id=live.id).status, 'running')
+
+        stale = now - timedelta(seconds=backup_jobs.LEASE_TIMEOUT + 1)
+        BackupJob.objects.filter(id=live.id).update(started_at=stale, heartbeat_at=stale, messages_processed=7)
+        job = backup_jobs.run(live.id)
+        self.assertEqual((job.status, job.messages_processed), ('succeeded', 40))
+        self.assertGreater(job.started_at, stale)
+
+        # A run that was taken over while stalled finishes without saving
+        def taken_over(job):
+            BackupJob.objects.filter(id=job.id).update(started_at=timezone.now())
+            raise RuntimeError('stalled')
+
+        pending = BackupJob.objects.create(user=self.user, kind='backup')
+        with mock.patch.dict(backup_jobs.HANDLERS, backup=taken_over):
+            backup_jobs.run(pending.id)
+        self.assertEqual(BackupJob.objects.get(id=pending.id).status, 'running')
+        self.notify.assert_called_once()
+
+    def test_upload_restore_job(self):
+        export = json.loads(b''.join(self.client.get('/api/chat/backup/').streaming_content))
+        Message.objects.filter(room=self.room).delete()
+        job = self.run_job('/api/chat/restore/', data=json.dumps(export), content_type='application/json')
+        self.assertEqual((job['status'], job['messages_processed']), ('succeeded', 40))
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 40)
+
+        job = self.run_job('/api/chat/restore/', data='{"chat_rooms": [', content_type='application/json')
+        self.assertEqual((job['status'], job['error']), ('failed', 'The backup file is not valid JSON'))
+        self.assertFalse(BackupJob.objects.exclude(upload={}).exists())
+
+    def test_upload_is_parsed_as_it_is_read(self):
+        export = b''.join(self.client.get('/api/chat/backup/').streaming_content).replace(b'note 1"', 'nöte 1"'.encode())
+        records = list(restore.records(export[i:i + 1] for i in range(len(export))))
+        data = json.loads(export)
+        self.assertEqual(records[0], ('profile', data['profile']))
+        self.assertEqual([data for kind, data in records if kind == 'message'], data['chat_rooms'][0]['messages'])
+
+        ndjson = b''.join(self.client.get('/api/chat/backup/?output=ndjson').streaming_content)
+        Message.objects.filter(room=self.room).delete()
+        job = self.run_job('/api/chat/restore/', data=ndjson, content_type='application/x-ndjson')
+        self.assertEqual(job['summary']['messages'], {'inserted': 40, 'updated': 0, 'skipped': 0})
+
+    def test_malformed_upload_fails_without_reading_on(self):
+        read = []
+
+        def chunks(head):
+            yield head
+            while True:
+                read.append(1)
+                self.assertLess(len(read), 3, 'kept reading after the error')
+                yield b' ' * 1024
+
+        for head in (b'{"profile": {"name": 1 x', b'{"profile": [tx', b'{"profile": "\\q'):
+            read.clear()
+            with self.assertRaisesMessage(restore.InvalidBackup, 'not valid JSON'):
+                list(restore.records(chunks(head)))
+
+        with mock.patch('chat.restore.MAX_VALUE_SIZE', 4096):
+            with self.assertRaisesMessage(restore.InvalidBackup, 'over the size limit'):
+                list(restore.records(itertools.chain([b'{"profile": "'], itertools.repeat(b'x' * 512))))
+            self.assertEqual(list(restore.records([b'{"profile": "' + b'x' * 4000, b'"}'])), [('profile', 'x' * 4000)])
+
+    def test_restore_summary_and_dry_run(self):
+        bob = User.objects.create_user('bob', password='secret-pass-2')
+        other_room = ChatRoom.objects.create(name='Private', room_type='group', created_by=bob)
+        RoomMembership.objects.create(user=bob, room=other_room, role='admin')
+        foreign = Message.objects.create(room=other_room, sender=bob, content='not yours')
+        kept = list(Message.objects.filter(room=self.room)[:2])
+        sent_at = timezone.now() - timedelta(days=400)
+
+        def message(**fields):
+            return {'id': str(uuid.uuid4()), 'sender': {'id': self.user.id}, 'content': 'restored',
+                    'message_type': 'text', 'timestamp': sent_at.isoformat(), **fields}
+
+        payload = {'chat_rooms': [
+            {'room': {'id': str(self.room.id), 'name': 'Notes', 'room_type': 'group'}, 'messages': [
+                message(id=str(kept[0].id), content='edited'),
+                message(id=str(kept[1].id), content='edited'),
+                message(),
+                message(sender={'id': 999999}),
+                message(id=str(foreign.id)),
+                message(timestamp='yesterday'),
+            ]},
+            {'room': {'id': str(other_room.id)}, 'messages': [message()]},
+            {'room': {'id': str(uuid.uuid4()), 'name': 'Restored', 'room_type': 'group'}, 'messages': [message()]},
+        ]}
+        expected = {
+            'rooms': {'inserted': 1, 'updated': 1, 'skipped': 1},
+            'contacts': {'inserted': 0, 'updated': 0, 'skipped': 0},
+            'messages': {'inserted': 2, 'updated': 2, 'skipped': 4},
+        }
+
+        job = self.run_job('/api/chat/restore/?dry_run=true', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual((job['status'], job['params']['dry_run'], job['summary']), ('succeeded', True, expected))
+        self.assertEqual(Message.objects.filter(content__in=['edited', 'restored']).count(), 0)
+        self.assertFalse(ChatRoom.objects.filter(name='Restored').exists())
+
+        job = self.run_job('/api/chat/restore/', data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(job['summary'], expected)
+        self.assertEqual(Message.objects.filter(room=self.room, content='edited').count(), 2)
+        restored = Message.objects.get(room=self.room, content='restored')
+        self.assertEqual(restored.timestamp, sent_at)
+        self.assertEqual(Message.objects.get(id=foreign.id).content, 'not yours')
+        self.assertFalse(RoomMembership.objects.filter(user=self.user, room=other_room).exists())
+        self.assertEqual(ChatRoom.objects.get(name='Restored').messages.count(), 1)
@@ -0,0 +1,93 @@
+# backend/chat/typing_state.py
+"""
+Typing indicators, kept entirely in memory (never in the database).
+
+Senders debounce: a connection publishes when its user starts or stops
+typing, and while typing re-announces at most every ``REFRESH`` seconds.
+Receivers expire a typer ``TTL`` seconds after the last announcement, so no
+"stopped typing" frame is needed, and send their client one aggregated frame
+for the whole room at most every ``FRAME_INTERVAL`` seconds.
+"""
+import time
+
+from django.conf import settings
+
+_config = getattr(settings, 'TYPING_INDICATORS', {})
+
+TTL = _config.get('TTL', 6.0)
+REFRESH = _config.get('REFRESH', 3.0)
+FRAME_INTERVAL = _config.get('FRAME_INTERVAL', 0.5)
+# Typers named in a frame; ``count`` always holds the total
+MAX_NAMED = _config.get('MAX_NAMED', 3)
+
+
+class TypingDebouncer:
+    """Decides which keystroke events of one user in one room are worth publishing."""
+
+    def __init__(self, refresh=REFRESH, clock=time.monotonic):
+        self.refresh = refresh
+        self.clock = clock
+        self.is_typing = False
+        self.published_at = None
+
+    def should_publish(self, is_typing):
+        now = self.clock()
+        if is_typing == self.is_typing and (not is_typing or now - self.published_at < self.refresh):
+            return False
+        self.is_typing = is_typing
+        self.published_at = now
+        return True
+
+
+class TypingRoom:
+    """The typers one connection knows about in its room, and when to tell the client."""
+
+    def __init__(self, ttl=TTL, interval=FRAME_INTERVAL, clock=time.monotonic):
+        self.ttl = ttl
+        self.interval = interval
+        self.clock = clock
+        self.typers = {}  # user_id -> (username, expires_at)
+        self.sent = frozenset()
+        self.sent_at = None
+
+    def update(self, user_id, username, is_typing):
+        if is_typing:
+            self.typers[user_id] = (username, self.clock() + self.ttl)
+        else:
+            self.typers.pop(user_id, None)
+
+    def _expire(self, now):
+        for user_id in [user_id for user_id, (_, expires_at) in self.typers.items() if expires_at <= now]:
+            del self.typers[user_id]
+
+    def next_deadline(self):
+        """
+        Seconds until ``poll`` may have something to do: the frame interval
+        while the client is out of date, otherwise the next expiry. ``None``
+        when idle.
+        """
+        now = self.clock()
+        self._expire(now)
+        if frozenset(self.typers) != self.sent:
+            if self.sent_at is None:
+                return 0
+            return max(0, self.sent_at + self.interval - now)
+        if self.typers:
+            return max(0, min(expires_at for _, expires_at in self.typers.values()) - now)
+        return None
+
+    def poll(self):
+        """The aggregated frame to send now, or ``None`` if nothing changed or it's too early."""
+        now = self.clock()
+        self._expire(now)
+        current = frozenset(self.typers)
+        if current == self.sent or (self.sent_at is not None and now - self.sent_at < self.interval):
+            return None
+        self.sent, self.sent_at = current, now
+        typers = sorted(self.typers.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'type': 'typing',
+            'is_typing': bool(typers),
+            'count': len(typers),
+            'users': [{'user_id': user_id, 'username': username} for user_id, (username, _) in typers[:MAX_NAMED]],
+        }
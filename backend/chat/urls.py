@@ -1,15 +1,16 @@
 # backend/chat/urls.py
+from django.conf import settings
 from django.urls import path
 from .views import (
     # Authentication
     register, login, logout, change_password, delete_account,
     
     # User Profile
-    user_profile, search_users,
+    user_profile, search_users, user_presence,
     
     
     # Chat Rooms
-    chat_rooms, chat_room_detail, room_messages, mark_room_read,
+    chat_rooms, inbox_rooms, chat_room_detail, room_messages, mark_room_read, mark_all_rooms_read, unread_counts,
     room_members, room_member_detail,
     
     # Contacts
@@ -18,6 +19,9 @@ from .views import (
     # Messages
     send_message, message_detail, add_reaction,
     
+    # Search
+    room_search, message_search,
+    
     # Settings & Privacy
     user_settings, block_user, unblock_user, blocked_users,
     
@@ -25,7 +29,7 @@ from .views import (
     notifications, mark_notification_read,
     
     # App Features
-    updates, tools, report_user,
+    updates, tools, report_user, fanout_metrics,
     
     # Media
     FileUploadView,
@@ -34,9 +38,13 @@ from .views import (
     backup_data, restore_data, toggle_archive,
     
     # Cloud Backup
-    create_cloud_backup, list_cloud_backups, restore_cloud_backup, delete_cloud_backup
+    create_cloud_backup, list_cloud_backups, restore_cloud_backup, delete_cloud_backup,
+    backup_jobs_list, backup_job_detail
 )
 
+if settings.ASYNC_HOT_VIEWS:
+    from .async_views import chat_rooms, room_messages, mark_room_read, send_message
+
 urlpatterns = [
     # Authentication
     path('auth/register/', register, name='register'),
@@ -48,13 +56,18 @@ urlpatterns = [
     # User Profile
     path('profile/', user_profile, name='user_profile'),
     path('users/search/', search_users, name='search_users'),
+    path('users/presence/', user_presence, name='user_presence'),
     
     # Chat Rooms
     path('rooms/', chat_rooms, name='chat_rooms'),
+    path('rooms/unread/', unread_counts, name='unread_counts'),
+    path('rooms/read/', mark_all_rooms_read, name='mark_all_rooms_read'),
+    path('inbox/', inbox_rooms, name='inbox_rooms'),
     path('rooms/<uuid:room_id>/', chat_room_detail, name='chat_room_detail'),
     path('rooms/<uuid:room_id>/', chat_room_detail, name='chat_room_detail'),
     path('rooms/<uuid:room_id>/messages/', room_messages, name='room_messages'),
     path('rooms/<uuid:room_id>/read/', mark_room_read, name='mark_room_read'),
+    path('rooms/<uuid:room_id>/search/', room_search, name='room_search'),
     path('rooms/<uuid:room_id>/members/', room_members, name='room_members'),
     path('rooms/<uuid:room_id>/members/<int:user_id>/', room_member_detail, name='room_member_detail'),
     
@@ -67,6 +80,9 @@ urlpatterns = [
     path('messages/<uuid:message_id>/', message_detail, name='message_detail'),
     path('messages/<uuid:message_id>/react/', add_reaction, name='add_reaction'),
     
+    # Search
+    path('search/', message_search, name='message_search'),
+    
     # Settings & Privacy
     path('settings/', user_settings, name='user_settings'),
     path('privacy/block/', block_user, name='block_user'),
@@ -81,6 +97,7 @@ urlpatterns = [
     path('updates/', updates, name='updates'),
     path('tools/', tools, name='tools'),
     path('report/', report_user, name='report_user'),
+    path('metrics/fanout/', fanout_metrics, name='fanout_metrics'),
     
     # Media
     path('upload/', FileUploadView.as_view(), name='file_upload'),
@@ -94,6 +111,8 @@ urlpatterns = [
     path('cloud/backups/create/', create_cloud_backup, name='create_cloud_backup'),
     path('cloud/backups/<uuid:backup_id>/restore/', restore_cloud_backup, name='restore_cloud_backup'),
     path('cloud/backups/<uuid:backup_id>/delete/', delete_cloud_backup, name='delete_cloud_backup'),
+    path('backup-jobs/', backup_jobs_list, name='backup_jobs_list'),
+    path('backup-jobs/<uuid:job_id>/', backup_job_detail, name='backup_job_detail'),
 
     # Archive
     path('rooms/<uuid:room_id>/archive/', toggle_archive, name='toggle_archive'),
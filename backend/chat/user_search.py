@@ -0,0 +1,203 @@
+# backend/chat/user_search.py
+import logging
+import math
+
+import redis
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Count, Exists, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Lower
+
+from .models import User, UserBlock, UserSearchTrigram
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+MIN_QUERY_LENGTH = 2
+MAX_PAGE_SIZE = 20
+CACHE_TIMEOUT = 60
+INDEX_VERSION = 'user_search:version'
+# Share of the query's trigrams a username must contain to match on typos
+MIN_OVERLAP = 0.6
+
+# Ranking: exact username > username prefix > phone prefix, then trigram overlap
+EXACT, PREFIX, PHONE = 3000, 2000, 1000
+
+
+def trigrams(value, pad_end=True):
+    """pg_trgm style trigrams: lowercased, two leading spaces and one trailing space."""
+    value = f'  {value.lower()}' + (' ' if pad_end else '')
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+@transaction.atomic
+def index_user(user):
+    """(Re)build the trigram rows of ``user`` and invalidate cached pages listing them."""
+    UserSearchTrigram.objects.filter(user=user).delete()
+    UserSearchTrigram.objects.bulk_create([
+        UserSearchTrigram(user=user, trigram=trigram) for trigram in trigrams(user.username)
+    ])
+    invalidate_profile(user)
+
+
+def rebuild(batch_size=1000):
+    UserSearchTrigram.objects.all().delete()
+    indexed, last_id = 0, 0
+    while True:
+        users = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'username')[:batch_size])
+        if not users:
+            break
+        UserSearchTrigram.objects.bulk_create([
+            UserSearchTrigram(user_id=user_id, trigram=trigram)
+            for user_id, username in users for trigram in trigrams(username)
+        ])
+        indexed += len(users)
+        last_id = users[-1][0]
+    invalidate()
+    return indexed
+
+
+def _cache():
+    return caches['user_search']
+
+
+def _profile_version(user_id):
+    return f'user_search:profile:{user_id}'
+
+
+def _blocks_version(user_id):
+    return f'user_search:blocks:{user_id}'
+
+
+def _bump(key):
+    try:
+        try:
+            _cache().incr(key)
+        except ValueError:
+            _cache().set(key, 1, None)
+    except redis.RedisError:
+        logger.exception('User search cache invalidation failed for %s', key)
+
+
+def invalidate():
+    """Drop every cached page; only for index rebuilds."""
+    _bump(INDEX_VERSION)
+
+
+def invalidate_profile(user):
+    """Drop the cached pages listing ``user``, after their profile changed."""
+    _bump(_profile_version(user.id))
+
+
+def invalidate_blocks(user):
+    """Drop the cached pages ``user`` got, after they blocked or unblocked someone."""
+    _bump(_blocks_version(user.id))
+
+
+def _cache_key(user, query, limit, cursor):
+    versions = _cache().get_many([INDEX_VERSION, _blocks_version(user.id)])
+    return 'user_search:{}:{}:{}:{}:{}:{}'.format(
+        versions.get(INDEX_VERSION, 0), versions.get(_blocks_version(user.id), 0),
+        user.id, limit, cursor or '', query
+    )
+
+
+def _profile_versions(ids):
+    versions = _cache().get_many([_profile_version(pk) for pk in ids])
+    return [versions.get(_profile_version(pk), 0) for pk in ids]
+
+
+def decode_search_cursor(token):
+    """Decode the ``(score, username, id)`` cursor handed out by ``search``."""
+    score, name, pk = decode_cursor(token, size=3)
+    if not (isinstance(score, int) and isinstance(name, str) and isinstance(pk, int)):
+        raise InvalidCursor('Invalid cursor')
+    return score, name, pk
+
+
+def search(user, query, limit=MAX_PAGE_SIZE, cursor=None):
+    """
+    Ranked typeahead search. Returns ``(users, next_cursor)``; ``cursor`` is a
+    decoded ``(score, username, id)`` triple. Pages are cached per searcher and query.
+    """
+    query = query.strip().lower()
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    if len(query) < MIN_QUERY_LENGTH:
+        return [], None
+
+    # A cached page also records the profile versions of the users it lists,
+    # so a profile edit only drops the pages that user appears on. New matches
+    # show up once the page expires.
+    try:
+        key = _cache_key(user, query, limit, cursor and encode_cursor(*cursor))
+        cached = _cache().get(key)
+        if cached is not None and _profile_versions(cached[0]) != cached[2]:
+            cached = None
+    except redis.RedisError:
+        logger.exception('User search cache read failed')
+        key, cached = None, None
+
+    if cached is None:
+        ids, next_cursor = _search(user, query, limit, cursor)
+        if key is not None:
+            try:
+                _cache().set(key, (ids, next_cursor, _profile_versions(ids)), CACHE_TIMEOUT)
+            except redis.RedisError:
+                logger.exception('User search cache write failed')
+    else:
+        ids, next_cursor, _ = cached
+
+    found = User.objects.in_bulk(ids)
+    return [found[pk] for pk in ids if pk in found], next_cursor
+
+
+def _search(user, query, limit, cursor):
+    grams = trigrams(query, pad_end=False)
+    # Most of the query's trigrams must match, so a typo still does but a
+    # short query sharing one trigram with a name does not
+    threshold = min(len(grams), max(2, math.ceil(len(grams) * MIN_OVERLAP)))
+    fuzzy = UserSearchTrigram.objects.filter(
+        trigram__in=grams
+    ).values('user').annotate(hits=Count('id')).filter(hits__gte=threshold).values('user')
+    hits = UserSearchTrigram.objects.filter(
+        user=OuterRef('pk'), trigram__in=grams
+    ).order_by().values('user').annotate(hits=Count('id')).values('hits')
+
+    # Range on the lower(username) index; startswith rechecks the exact prefix
+    prefix = Q(username_lower__gte=query, username_lower__lt=query + '\uffff', username_lower__startswith=query)
+    matches = prefix | Q(id__in=fuzzy)
+    if query.lstrip('+').isdigit():
+        matches |= Q(phone_number__startswith=query)
+
+    users = User.objects.annotate(
+        username_lower=Lower('username')
+    ).filter(
+        matches, is_active=True
+    ).exclude(
+        id=user.id
+    ).exclude(
+        Exists(UserBlock.objects.filter(blocker=user, blocked=OuterRef('pk')))
+    ).annotate(
+        score=Case(
+            When(username_lower=query, then=Value(EXACT)),
+            When(prefix, then=Value(PREFIX)),
+            When(phone_number__startswith=query, then=Value(PHONE)),
+            default=Value(0),
+            output_field=IntegerField()
+        ) + Coalesce(Subquery(hits, output_field=IntegerField()), Value(0))
+    )
+
+    if cursor is not None:
+        score, name, pk = cursor
+        users = users.filter(
+            Q(score__lt=score) |
+            Q(score=score, username_lower__gt=name) |
+            Q(score=score, username_lower=name, id__gt=pk)
+        )
+
+    rows = list(users.order_by('-score', 'username_lower', 'id').values_list('id', 'score', 'username_lower')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][2], rows[-1][0])
+    return [pk for pk, score, name in rows], next_cursor
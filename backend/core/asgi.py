@@ -11,7 +11,7 @@ django_asgi_app = get_asgi_application()
 # 3. Import your project code AFTER step 2
 # Now that Django is ready, these imports won't throw AppRegistryNotReady
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from chat.auth import JWTAuthMiddleware
 import chat.routing
 import socketio
 from chat.sockets import sio
@@ -19,7 +19,7 @@ from chat.sockets import sio
 application = ProtocolTypeRouter({
     # 4. Use the variable we created in step 2
     "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddleware(
         URLRouter(chat.routing.websocket_urlpatterns)
     ),
 })
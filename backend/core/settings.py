@@ -128,11 +128,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CORS
 CORS_ALLOW_ALL_ORIGINS = True 
+# Keyset pagination cursors for room history are returned as headers
+CORS_EXPOSE_HEADERS = ['X-Cursor-Before', 'X-Cursor-After']
 
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'chat.auth.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -159,15 +161,171 @@ SIMPLE_JWT = {
 
 # Channels Configuration for Codespaces
 # We assume you installed redis via `sudo apt-get install redis-server`
+# In Codespaces, Redis runs on localhost inside the container
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            # In Codespaces, Redis runs on localhost inside the container
-            "hosts": [("127.0.0.1", 6379)],
+            "hosts": [REDIS_URL],
         },
     },
 }
 
+# User search pages and their versions (chat/user_search.py) live in Redis so
+# an invalidation in one process is seen by all of them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'user_search': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    },
+}
+
+# Socket.IO events emitted from REST views (chat/emitter.py). With blocking
+# off, emits are queued and published in batches by a background thread.
+SOCKETIO_EMIT_BLOCKING = os.getenv('SOCKETIO_EMIT_BLOCKING', 'True').lower() == 'true'
+SOCKETIO_EMIT_BATCH_SIZE = int(os.getenv('SOCKETIO_EMIT_BATCH_SIZE', '100'))
+
+# Serve the hot chat endpoints (rooms list, room history, mark read, send)
+# from the async views in chat/async_views.py. Only useful under ASGI.
+ASYNC_HOT_VIEWS = os.getenv('ASYNC_HOT_VIEWS', 'False').lower() == 'true'
+
+# Where new messages are delivered (chat/fanout.py), whichever path created them
+MESSAGE_FANOUT_SINKS = [
+    'chat.fanout.ChannelsSink',
+    'chat.fanout.SocketIOSink',
+]
+
+# Typing indicators (chat/typing_state.py), in seconds. In memory only.
+TYPING_INDICATORS = {
+    'TTL': 6.0,
+    'REFRESH': 3.0,
+    'FRAME_INTERVAL': 0.5,
+}
+
+# WebSocket clients connecting with ?batch=1 get events as array frames
+# (chat/frame_batching.py), flushed every WINDOW seconds or when full.
+WEBSOCKET_BATCHING = {
+    'WINDOW': 0.05,
+    'MAX_EVENTS': 50,
+    'MAX_BYTES': 64 * 1024,
+}
+
+# Room membership cache (chat/member_cache.py): per-process LRU in front of a
+# Redis hash per room. LOCAL_TTL bounds how long other processes see stale roles.
+MEMBERSHIP_CACHE = {
+    'LOCAL_TTL': 5,
+    'LOCAL_SIZE': 10000,
+    'TTL': 60 * 60,
+}
+
+# Verified JWTs and compact user principals (chat/auth.py), shared by REST,
+# Channels and Socket.IO.
+AUTH_CACHE = {
+    'LOCAL_TTL': 5,
+    'LOCAL_SIZE': 10000,
+    'PRINCIPAL_TTL': 15 * 60,
+}
+
+# Reaction changes are pushed to rooms at most once per message every
+# PUSH_WINDOW seconds (chat/reactions.py).
+REACTIONS = {
+    'PUSH_WINDOW': 0.25,
+}
+
+# Room activity (chat/room_activity.py): new messages queue their room's
+# updated_at/last_message in Redis; rows are written in bulk every FLUSH_INTERVAL seconds
+# (also scheduled on Celery beat, so the last bumps of a room gone quiet are written too).
+ROOM_ACTIVITY = {
+    'FLUSH_INTERVAL': 2,
+}
+
+# Presence (chat/presence.py): online status is counted per socket in Redis;
+# sockets refresh their entry every HEARTBEAT_INTERVAL seconds and expire after
+# CONNECTION_TTL without one. last_seen/online_status reach the database in
+# bulk every FLUSH_INTERVAL seconds (also scheduled on Celery beat); Redis
+# keeps each user's last_seen for LAST_SEEN_TTL seconds after its last change.
+PRESENCE = {
+    'FLUSH_INTERVAL': 30,
+    'CONNECTION_TTL': 90,
+    'HEARTBEAT_INTERVAL': 30,
+    'LAST_SEEN_TTL': 24 * 60 * 60,
+}
+
+# /chat/backup/ export (chat/export.py): rows read and serialized per batch while streaming.
+CHAT_EXPORT = {
+    'ROOM_BATCH_SIZE': 100,
+    'MESSAGE_BATCH_SIZE': 500,
+}
+
+# Cloud backup payloads (chat/backup_storage.py) are stored as gzip chunks of
+# CHUNK_SIZE bytes in the 'backups' storage, never in the database.
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'backups': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {'location': os.getenv('BACKUP_ROOT', os.path.join(BASE_DIR, 'backups'))},
+    },
+}
+if os.getenv('BACKUP_S3_BUCKET'):
+    STORAGES['backups'] = {
+        'BACKEND': 'storages.backends.s3.S3Storage',
+        'OPTIONS': {
+            'bucket_name': os.getenv('BACKUP_S3_BUCKET'),
+            'endpoint_url': os.getenv('BACKUP_S3_ENDPOINT_URL') or None,
+            'location': os.getenv('BACKUP_S3_PREFIX', 'backups'),
+            'default_acl': 'private',
+            'file_overwrite': False,
+        },
+    }
+
+BACKUP_STORAGE = {
+    'STORAGE': 'backups',
+    'CHUNK_SIZE': 4 * 1024 * 1024,
+    'COMPRESSION_LEVEL': 6,
+}
+
+# Cloud backups (chat/backup_chain.py) are increments on the previous backup;
+# every FULL_EVERY-th is a full snapshot. Chains left alone for
+# COMPACT_AFTER_DAYS are folded into one snapshot by compact_backups.
+BACKUP_CHAIN = {
+    'FULL_EVERY': 7,
+    'OVERLAP': 60,
+    'COMPACT_AFTER_DAYS': 30,
+}
+
+# Backup and restore jobs (chat/backup_jobs.py) run on Celery workers
+# (`celery -A core worker -B`). RUNNER 'inline' runs them synchronously in the
+# request that starts them: the response is only sent once the job has finished.
+# Progress is saved every PROGRESS_INTERVAL seconds; a running job without
+# progress for LEASE_TIMEOUT seconds is taken over by the next worker given it.
+BACKUP_JOBS = {
+    'RUNNER': os.getenv('BACKUP_JOB_RUNNER', 'celery'),
+    'PROGRESS_INTERVAL': 1.0,
+    'LEASE_TIMEOUT': 600,
+}
+
+# Restores (chat/restore.py): messages and contacts written per upsert and transaction;
+# MAX_VALUE_SIZE characters at most are buffered for one value before an upload is rejected.
+CHAT_RESTORE = {
+    'BATCH_SIZE': 1000,
+    'MAX_VALUE_SIZE': 16 * 1024 * 1024,
+}
+
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', REDIS_URL)
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ACKS_LATE = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_BEAT_SCHEDULE = {
+    'compact-backups': {'task': 'chat.tasks.compact_backups', 'schedule': 24 * 60 * 60},
+    'flush-presence': {'task': 'chat.tasks.flush_presence', 'schedule': PRESENCE['FLUSH_INTERVAL']},
+    'flush-room-activity': {'task': 'chat.tasks.flush_room_activity', 'schedule': ROOM_ACTIVITY['FLUSH_INTERVAL']},
+}
+
 # Custom user
 AUTH_USER_MODEL = 'chat.User'
\ No newline at end of file
@@ -86,6 +86,28 @@ WantedBy=multi-user.target
     run_command("systemctl start daphne")
     run_command("systemctl enable daphne")
 
+def configure_celery():
+    print("Configuring Celery (backup and restore jobs)...")
+    service_content = f"""
+[Unit]
+Description=celery worker (backup and restore jobs)
+After=network.target redis-server.service
+
+[Service]
+User={USER}
+Group=www-data
+WorkingDirectory={BACKEND_DIR}
+ExecStart={VENV_DIR}/bin/celery -A core worker -B --concurrency 2 --loglevel INFO
+
+[Install]
+WantedBy=multi-user.target
+    """
+    with open("/etc/systemd/system/celery.service", "w") as f:
+        f.write(service_content)
+
+    run_command("systemctl start celery")
+    run_command("systemctl enable celery")
+
 def configure_nginx():
     print("Configuring Nginx...")
     # Use "default" as filename for IP-based catch-all
@@ -154,6 +176,7 @@ def main():
     configure_database()
     configure_gunicorn()
     configure_daphne()
+    configure_celery()
     configure_nginx()
     
     print("Deployment Setup Complete!")
@@ -13,7 +13,8 @@ class Message extends Equatable {
   final Map<String, dynamic>? replyTo;
   final DateTime timestamp;
   final DateTime? editedAt;
-  final Map<String, List<String>> reactions;
+  final Map<String, int> reactions;
+  final List<String> myReactions;
   final List<Map<String, dynamic>> readBy;
 
   const Message({
@@ -29,6 +30,7 @@ class Message extends Equatable {
     required this.timestamp,
     this.editedAt,
     this.reactions = const {},
+    this.myReactions = const [],
     this.readBy = const [],
   });
 
@@ -45,9 +47,11 @@ class Message extends Equatable {
       replyTo: json['reply_to'],
       timestamp: DateTime.parse(json['timestamp']),
       editedAt: json['edited_at'] != null ? DateTime.parse(json['edited_at']) : null,
-      reactions: Map<String, List<String>>.from(
-        (json['reactions'] ?? {}).map((k, v) => MapEntry(k, List<String>.from(v)))
+      // Counts per emoji; older payloads listed the reacting user ids instead
+      reactions: Map<String, int>.from(
+        (json['reactions'] ?? {}).map((k, v) => MapEntry(k, v is List ? v.length : v as int))
       ),
+      myReactions: List<String>.from(json['my_reactions'] ?? []),
       readBy: List<Map<String, dynamic>>.from(json['read_by'] ?? []),
     );
   }
@@ -66,6 +70,7 @@ class Message extends Equatable {
       'timestamp': timestamp.toIso8601String(),
       'edited_at': editedAt?.toIso8601String(),
       'reactions': reactions,
+      'my_reactions': myReactions,
       'read_by': readBy,
     };
   }
@@ -78,6 +83,15 @@ class Message extends Equatable {
   @override
   List<Object?> get props => [
     id, sender, roomId, content, messageType, fileUrl, fileSize,
-    thumbnailUrl, replyTo, timestamp, editedAt, reactions, readBy
+    thumbnailUrl, replyTo, timestamp, editedAt, reactions, myReactions, readBy
   ];
-}
\ No newline at end of file
+}
+
+/// One page of room history, oldest first. [before] is the cursor of the
+/// older page (`X-Cursor-Before`), null when the start of the chat is loaded.
+class MessagePage {
+  final List<Message> messages;
+  final String? before;
+
+  const MessagePage(this.messages, this.before);
+}
@@ -52,14 +52,37 @@ class _BackupRestoreScreenState extends State<BackupRestoreScreen> with SingleTi
     if (mounted) setState(() => _loadingBackups = false);
   }
   
+  // Polls /backup-jobs/<id>/ until the job has finished; null if it can't be read
+  Future<Map<String, dynamic>?> _waitForJob(String token, Map<String, dynamic> job) async {
+    while (mounted && (job['status'] == 'pending' || job['status'] == 'running')) {
+      await Future.delayed(const Duration(seconds: 1));
+      final latest = await _apiService.getBackupJob(token, job['id']);
+      if (latest == null) return null;
+      job = latest;
+    }
+    return job;
+  }
+
+  void _showJobResult(Map<String, dynamic>? job, String succeeded, String failed) {
+    if (!mounted) return;
+    final error = job?['error'];
+    final message = job?['status'] == 'succeeded' ? succeeded : (error is String && error.isNotEmpty ? '$failed: $error' : failed);
+    ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text(message)));
+  }
+
   Future<void> _performCloudBackup() async {
      setState(() => _isProcessing = true);
      final token = await _authService.getToken();
      if (token != null) {
-       final success = await _apiService.createCloudBackup(token);
-       if (mounted) {
-         ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text(success ? 'Cloud backup created' : 'Failed to create backup')));
-         if (success) _loadCloudBackups();
+       final job = await _apiService.createCloudBackup(token);
+       if (job == null) {
+         if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Failed to create backup')));
+       } else {
+         // The backup is written in the background
+         if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Cloud backup started')));
+         final finished = await _waitForJob(token, job);
+         _showJobResult(finished, 'Cloud backup created', 'Failed to create backup');
+         _loadCloudBackups();
        }
      }
      if (mounted) setState(() => _isProcessing = false);
@@ -69,8 +92,13 @@ class _BackupRestoreScreenState extends State<BackupRestoreScreen> with SingleTi
      setState(() => _isProcessing = true);
      final token = await _authService.getToken();
      if (token != null) {
-       final success = await _apiService.restoreCloudBackup(token, id);
-       if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text(success ? 'Restore completed' : 'Restore failed')));
+       final job = await _apiService.restoreCloudBackup(token, id);
+       if (job == null) {
+         if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Restore failed')));
+       } else {
+         if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Restore started')));
+         _showJobResult(await _waitForJob(token, job), 'Restore complete', 'Restore failed');
+       }
      }
      if (mounted) setState(() => _isProcessing = false);
   }
@@ -141,7 +169,7 @@ class _BackupRestoreScreenState extends State<BackupRestoreScreen> with SingleTi
         if (token != null) {
           bool success = await _apiService.restoreData(token, data);
           if (success) {
-            if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Restore completed successfully')));
+            if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Restore started, your chats will update shortly')));
           } else {
              if (mounted) ScaffoldMessenger.of(context).showSnackBar(SnackBar(content: Text('Restore failed at backend')));
           }
@@ -32,6 +32,9 @@ class _ChatScreenState extends State<ChatScreen> {
   List<Message> _messages = [];
   bool _isLoading = true;
   bool _isSending = false;
+  // Cursor of the next older page of history; null once the start is loaded
+  String? _olderCursor;
+  bool _isLoadingOlder = false;
   late int _currentUserId;
 
   final AuthService _authService = AuthService();
@@ -56,6 +59,7 @@ class _ChatScreenState extends State<ChatScreen> {
   @override
   void initState() {
     super.initState();
+    _scrollController.addListener(_onScroll);
     _loadSettings();
     _loadWallpaper();
     _initializeChat();
@@ -408,7 +412,8 @@ class _ChatScreenState extends State<ChatScreen> {
       final token = await _authService.getToken();
       if (token != null) {
         try {
-          final messages = await _apiService.getRoomMessages(token, widget.roomId);
+          final page = await _apiService.getRoomMessages(token, widget.roomId);
+          final messages = page.messages;
           
           // Save to DB
           await _databaseService.insertMessages(messages);
@@ -416,6 +421,7 @@ class _ChatScreenState extends State<ChatScreen> {
           if (mounted) {
             setState(() {
               _messages = messages;
+              _olderCursor = page.before;
               _messages.sort((a, b) => a.timestamp.compareTo(b.timestamp));
               _isLoading = false;
             });
@@ -431,6 +437,35 @@ class _ChatScreenState extends State<ChatScreen> {
     }
   }
 
+  void _onScroll() {
+    if (_scrollController.hasClients &&
+        _scrollController.position.pixels <= _scrollController.position.minScrollExtent + 100) {
+      _loadOlderMessages();
+    }
+  }
+
+  Future<void> _loadOlderMessages() async {
+    if (_isLoadingOlder || _olderCursor == null) return;
+    _isLoadingOlder = true;
+    try {
+      final token = await _authService.getToken();
+      if (token == null) return;
+      final page = await _apiService.getRoomMessages(token, widget.roomId, before: _olderCursor);
+      await _databaseService.insertMessages(page.messages);
+      if (mounted) {
+        setState(() {
+          final known = _messages.map((m) => m.id).toSet();
+          _messages.insertAll(0, page.messages.where((m) => !known.contains(m.id)));
+          _olderCursor = page.before;
+        });
+      }
+    } catch (e) {
+      print("Error fetching older messages: $e");
+    } finally {
+      _isLoadingOlder = false;
+    }
+  }
+
   Future<void> _handleRefresh() async {
     await _loadMessages(forceRefresh: true);
   }
@@ -695,7 +730,7 @@ class _ChatScreenState extends State<ChatScreen> {
                                                   border: Border.all(color: Colors.grey[300]!),
                                                 ),
                                                 child: Text(
-                                                  '${entry.key} ${entry.value.length}',
+                                                  '${entry.key} ${entry.value}',
                                                   style: TextStyle(fontSize: 12),
                                                 ),
                                               );
@@ -38,11 +38,15 @@ class _SecuritySettingsScreenState extends State<SecuritySettingsScreen> {
 
     final token = await _authService.getToken();
     if (token != null) {
-      final success = await _apiService.changePassword(
+      final newToken = await _apiService.changePassword(
         token,
         _oldPasswordController.text,
         _newPasswordController.text,
       );
+      if (newToken != null) {
+        await _authService.saveToken(newToken);
+      }
+      final success = newToken != null;
 
       if (mounted) {
         setState(() => _isLoading = false);
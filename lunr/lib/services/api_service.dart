@@ -76,7 +76,8 @@ class ApiService {
   }
 
   // Account Management
-  Future<bool> changePassword(String token, String oldPassword, String newPassword) async {
+  // Returns the new access token: changing the password invalidates the old one
+  Future<String?> changePassword(String token, String oldPassword, String newPassword) async {
     try {
       final response = await http.post(
         Uri.parse('$_baseUrl/auth/change-password/'),
@@ -89,9 +90,12 @@ class ApiService {
           'new_password': newPassword
         }),
       );
-      return response.statusCode == 200;
+      if (response.statusCode == 200) {
+        return jsonDecode(response.body)['access'];
+      }
+      return null;
     } catch (e) {
-      return false;
+      return null;
     }
   }
 
@@ -354,15 +358,22 @@ class ApiService {
   }
 
   // Messages
-  Future<List<Message>> getRoomMessages(String token, String roomId) async {
+  Future<MessagePage> getRoomMessages(String token, String roomId, {String? before}) async {
+    // Without a cursor the server returns the latest page and marks the chat read
+    final uri = Uri.parse('$_baseUrl/rooms/$roomId/messages/').replace(
+      queryParameters: before != null ? {'before': before} : null,
+    );
     final response = await http.get(
-      Uri.parse('$_baseUrl/rooms/$roomId/messages/'),
+      uri,
       headers: {'Authorization': 'Bearer $token'},
     );
     
     if (response.statusCode == 200) {
       final List<dynamic> data = jsonDecode(response.body);
-      return data.map((json) => Message.fromJson(json)).toList();
+      return MessagePage(
+        data.map((json) => Message.fromJson(json)).toList(),
+        response.headers['x-cursor-before'],
+      );
     }
     throw Exception('Failed to load messages: ${response.statusCode}');
   }
@@ -507,22 +518,42 @@ class ApiService {
         },
         body: jsonEncode(data),
       );
-      return response.statusCode == 200;
+      // Runs as a background job (202); progress is at /backup-jobs/<id>/
+      return response.statusCode == 200 || response.statusCode == 202;
     } catch (e) {
       return false;
     }
   }
 
   // Cloud Backup Methods
-  Future<bool> createCloudBackup(String token) async {
+  // Returns the background job (202), to be polled with getBackupJob
+  Future<Map<String, dynamic>?> createCloudBackup(String token) async {
     try {
       final response = await http.post(
         Uri.parse('$_baseUrl/cloud/backups/create/'),
         headers: {'Authorization': 'Bearer $token'},
       );
-      return response.statusCode == 200;
+      if (response.statusCode == 202) {
+        return jsonDecode(response.body);
+      }
+      return null;
     } catch (e) {
-      return false;
+      return null;
+    }
+  }
+
+  Future<Map<String, dynamic>?> getBackupJob(String token, String jobId) async {
+    try {
+      final response = await http.get(
+        Uri.parse('$_baseUrl/backup-jobs/$jobId/'),
+        headers: {'Authorization': 'Bearer $token'},
+      );
+      if (response.statusCode == 200) {
+        return jsonDecode(response.body);
+      }
+      return null;
+    } catch (e) {
+      return null;
     }
   }
 
@@ -541,15 +572,19 @@ class ApiService {
     }
   }
 
-  Future<bool> restoreCloudBackup(String token, String backupId) async {
+  // Returns the background job (202), to be polled with getBackupJob
+  Future<Map<String, dynamic>?> restoreCloudBackup(String token, String backupId) async {
     try {
       final response = await http.post(
         Uri.parse('$_baseUrl/cloud/backups/$backupId/restore/'),
         headers: {'Authorization': 'Bearer $token'},
       );
-      return response.statusCode == 200;
+      if (response.statusCode == 202) {
+        return jsonDecode(response.body);
+      }
+      return null;
     } catch (e) {
-      return false;
+      return null;
     }
   }
 